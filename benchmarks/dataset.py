@@ -0,0 +1,191 @@
+import logging
+import os
+import random
+import subprocess
+import uuid
+
+from datetime import datetime
+from datetime import timedelta
+
+import openpgp
+
+"""
+Generator of synthetic Passbolt data : users with real OpenPGP keys, groups, and resources whose descriptions reference
+the connectors of the toolbox. Secrets are encrypted for the benchmark user, so that the toolbox can decrypt them.
+"""
+
+
+class BenchmarkKey:
+    """OpenPGP key generated for a benchmark user or for the fake server."""
+
+    def __init__(self, fingerprint, armoredPublicKey, armoredSecretKey):
+        self.fingerprint = fingerprint
+        self.keyID = fingerprint[-8:]
+        self.armoredPublicKey = armoredPublicKey
+        self.armoredSecretKey = armoredSecretKey
+        self.certificate = openpgp.parseCertificates(openpgp.dearmor(armoredSecretKey))[0]
+        for key in self.certificate.keys():
+            if key.isSecret():
+                key.unlock()
+
+
+class KeyGenerator:
+    logger = logging.getLogger('KeyGenerator')
+
+    def __init__(self, gnupgHome):
+        self.gnupgHome = gnupgHome
+        os.makedirs(self.gnupgHome, mode=0o700, exist_ok=True)
+
+    """
+    Generate the given number of Ed25519 / Curve25519 keys with a single gpg process.
+    """
+    def generate(self, names):
+        parameters = ''
+        for name in names:
+            parameters += ('Key-Type: eddsa\nKey-Curve: ed25519\nKey-Usage: sign\n'
+                           'Subkey-Type: ecdh\nSubkey-Curve: cv25519\nSubkey-Usage: encrypt\n'
+                           'Name-Real: {}\nName-Email: {}@bench.local\nExpire-Date: 0\n%no-protection\n%commit\n'
+                           .format(name, name.lower().replace(' ', '.')))
+        self.__gpg(['--gen-key'], parameters.encode('utf-8'))
+
+        # Name -> fingerprint of the primary key
+        fingerprints = {}
+        fingerprint = None
+        for line in self.__gpg(['--list-secret-keys', '--with-colons']).decode('utf-8').splitlines():
+            fields = line.split(':')
+            if fields[0] == 'sec':
+                fingerprint = None
+            elif fields[0] == 'fpr' and fingerprint is None:
+                fingerprint = fields[9]
+            elif fields[0] == 'uid':
+                fingerprints[fields[9].split(' <')[0]] = fingerprint
+        self.logger.info('Generated [{}] keys'.format(len(names)))
+
+        return {name: BenchmarkKey(fingerprint,
+                                   self.__gpg(['--armor', '--export', fingerprint]).decode('utf-8'),
+                                   self.__gpg(['--armor', '--export-secret-keys', fingerprint]).decode('utf-8'))
+                for name, fingerprint in fingerprints.items() if name in names}
+
+    def __gpg(self, arguments, data=None):
+        return subprocess.run(['gpg', '--homedir', self.gnupgHome, '--batch', '--pinentry-mode', 'loopback',
+                               '--passphrase', ''] + arguments,
+                              input=data, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+
+
+class Dataset:
+    """
+    @param users : the number of users, the first one being the user running the toolbox
+    @param groups : the number of groups. Every resource is shared with the first group, named "Benchmark", and with
+    one of the other groups
+    @param resources : the number of resources
+    @param groupSize : the number of members of each group
+    @param connectorRatio : the share of resources having a connector
+    """
+    def __init__(self, users=50, groups=5, resources=200, groupSize=20, connectorRatio=0.8, seed=42):
+        self.userCount = users
+        self.groupCount = max(1, groups)
+        self.resourceCount = resources
+        self.groupSize = max(1, min(groupSize, users))
+        self.connectorRatio = connectorRatio
+        self.random = random.Random(seed)
+
+        self.serverKey = None
+        self.users = []
+        # User ID -> BenchmarkKey
+        self.userKeys = {}
+        self.groups = []
+        self.resources = []
+        # Resource ID -> user ID -> armored secret
+        self.secrets = {}
+        # Username -> password, as known by the fake services
+        self.servicePasswords = {}
+
+    @property
+    def currentUser(self):
+        return self.users[0]
+
+    @property
+    def currentUserKey(self):
+        return self.userKeys[self.currentUser['User']['id']]
+
+    def generate(self, gnupgHome, xwikiURI, sshURI):
+        userNames = ['Bench User {}'.format(i) for i in range(self.userCount)]
+        keys = KeyGenerator(gnupgHome).generate(['Bench Server'] + userNames)
+        self.serverKey = keys['Bench Server']
+
+        # Users and keys have been created well before the benchmark, as on a real instance
+        modified = (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+        for name in userNames:
+            key = keys[name]
+            userID = str(uuid.uuid4())
+            self.users.append({
+                'User': {'id': userID, 'username': '{}@bench.local'.format(name.lower().replace(' ', '.')),
+                         'active': True, 'deleted': False, 'modified': modified},
+                'Profile': {'first_name': 'Bench', 'last_name': name.split(' ')[-1]},
+                'Gpgkey': {'id': str(uuid.uuid4()), 'user_id': userID, 'key_id': key.keyID,
+                           'fingerprint': key.fingerprint, 'armored_key': key.armoredPublicKey, 'deleted': False,
+                           'modified': modified}
+            })
+            self.userKeys[self.users[-1]['User']['id']] = key
+
+        otherUsers = self.users[1:]
+        for i in range(self.groupCount):
+            members = [self.currentUser] + self.random.sample(otherUsers, self.groupSize - 1)
+            self.groups.append({
+                'Group': {'id': str(uuid.uuid4()), 'name': 'Benchmark' if i == 0 else 'Benchmark {}'.format(i),
+                          'deleted': False},
+                'GroupUser': [{'user_id': x['User']['id'], 'group_id': None, 'is_admin': x is self.currentUser}
+                              for x in members]
+            })
+            for groupUser in self.groups[-1]['GroupUser']:
+                groupUser['group_id'] = self.groups[-1]['Group']['id']
+
+        for i in range(self.resourceCount):
+            self.resources.append(self.__generateResource(i, xwikiURI, sshURI))
+
+    def __generateResource(self, index, xwikiURI, sshURI):
+        resourceID = str(uuid.uuid4())
+        username = 'bench-{}'.format(index)
+        password = uuid.uuid4().hex
+        description = ['Generated resource {}'.format(index)]
+
+        uri = 'https://service-{}.bench.local'.format(index)
+        if self.random.random() < self.connectorRatio:
+            if self.random.random() < 0.8:
+                uri = xwikiURI
+                description.append('>>> Connector : XWiki')
+            else:
+                uri = sshURI
+                description.append('>>> Connector : Apache')
+            lastUpdate = datetime.now() - timedelta(days=self.random.randint(0, 365))
+            description.append('>>> Last password update : {}'.format(lastUpdate.strftime('%d/%m/%Y')))
+            description.append('>>> Update count : {}'.format(self.random.randint(0, 10)))
+        self.servicePasswords[username] = password
+
+        groupIDs = [self.groups[0]['Group']['id']]
+        if self.groupCount > 1:
+            groupIDs.append(self.groups[1 + index % (self.groupCount - 1)]['Group']['id'])
+
+        # Only the secret of the benchmark user is generated, the toolbox never reads the other ones
+        self.secrets[resourceID] = {
+            self.currentUser['User']['id']: openpgp.encryptMessage(password.encode('utf-8'),
+                                                                   [self.currentUserKey.certificate])
+        }
+        modified = datetime.now().strftime('%Y-%m-%dT%H:%M:%S+00:00')
+        return {
+            'Resource': {'id': resourceID, 'name': 'Resource {}'.format(index), 'username': username, 'uri': uri,
+                         'description': '\n'.join(description), 'deleted': False, 'created': modified,
+                         'modified': modified},
+            'Permission': [{'id': str(uuid.uuid4()), 'aco': 'Resource', 'aco_foreign_key': resourceID,
+                            'aro': 'Group', 'aro_foreign_key': groupID, 'type': 15} for groupID in groupIDs]
+        }
+
+    """
+    Write a CSV file that can be imported with the "import" action, with resources shared with the given groups.
+    """
+    def writeImportFile(self, path, groupNames):
+        with open(path, 'w') as csvFile:
+            for i in range(self.resourceCount):
+                csvFile.write('Imported {i},imported-{i},{password},https://imported-{i}.bench.local,'
+                              'Imported resource {i},{group}\n'
+                              .format(i=i, password=uuid.uuid4().hex, group=groupNames[i % len(groupNames)]))
@@ -0,0 +1,331 @@
+import json
+import logging
+import re
+import threading
+import uuid
+
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import quote_plus
+from urllib.parse import urlparse
+
+import openpgp
+
+"""
+Fake Passbolt server serving a Dataset, implementing the GPGAuth login and the endpoints used by the toolbox through
+passboltapi. Every request is counted by method and endpoint, so that the benchmark can report the number of API calls
+needed per resource.
+"""
+
+GPGAUTH_VERSION = '1.3.0'
+
+
+class FakePassboltHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    uuidPattern = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.__dispatch('GET')
+
+    def do_POST(self):
+        self.__dispatch('POST')
+
+    def do_PUT(self):
+        self.__dispatch('PUT')
+
+    def __dispatch(self, method):
+        parsedURL = urlparse(self.path)
+        path = re.sub('/+', '/', parsedURL.path)
+        self.query = parse_qs(parsedURL.query)
+        self.body = self.__readBody()
+        self.responseHeaders = []
+
+        endpoint = self.uuidPattern.sub('{id}', path)
+        self.server.countRequest(method, endpoint)
+
+        handler = self.server.routes.get((method, endpoint))
+        if handler is None:
+            return self.__respond(404, {'message': 'Unknown endpoint [{} {}]'.format(method, endpoint)})
+
+        if not endpoint.startswith('/auth/') and not self.server.isAuthenticated(self.headers.get('Cookie', '')):
+            return self.__respond(403, {'message': 'Authentication required'})
+
+        ids = self.uuidPattern.findall(path)
+        status, body = getattr(self, handler)(*ids)
+        self.__respond(status, body)
+
+    def __readBody(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length == 0:
+            return {}
+
+        data = self.rfile.read(length).decode('utf-8')
+        try:
+            return json.loads(data)
+        except ValueError:
+            # passboltapi sends form-encoded data
+            return {key: values if len(values) > 1 else values[0] for key, values in parse_qs(data).items()}
+
+    def __respond(self, status, body):
+        content = json.dumps({'header': {'status': 'success' if status == 200 else 'error', 'code': status,
+                                         'servertime': int(datetime.now().timestamp())},
+                              'body': body}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('X-GPGAuth-Version', GPGAUTH_VERSION)
+        for header, value in self.responseHeaders:
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def param(self, name, default=None):
+        values = self.query.get(name)
+        return values[0] if values else default
+
+    def params(self, name):
+        return self.query.get(name, [])
+
+    # GPGAuth
+
+    def getVerify(self):
+        return 200, {'fingerprint': self.server.dataset.serverKey.fingerprint,
+                     'keydata': self.server.dataset.serverKey.armoredPublicKey}
+
+    def postVerify(self):
+        token = openpgp.decryptMessage(self.body['gpg_auth']['server_verify_token'], self.server.keyStore)
+        self.responseHeaders += [('X-GPGAuth-Authenticated', 'false'), ('X-GPGAuth-Progress', 'stage0'),
+                                 ('X-GPGAuth-Verify-Response', token.decode('utf-8'))]
+        return 200, None
+
+    def postLogin(self):
+        server = self.server
+        fingerprint = self.body['gpg_auth']['keyid']
+        if self.body['gpg_auth'].get('user_token_result') is None:
+            # Stage 1 : send a token encrypted for the user
+            token = 'gpgauthv{v}|36|{uuid}|gpgauthv{v}'.format(v=GPGAUTH_VERSION, uuid=uuid.uuid4())
+            user = next(x for x in server.dataset.users if x['Gpgkey']['fingerprint'] == fingerprint)
+            with server.lock:
+                server.pendingTokens[fingerprint] = token
+            encryptedToken = openpgp.encryptMessage(token.encode('utf-8'),
+                                                    [server.dataset.userKeys[user['User']['id']].certificate])
+            self.responseHeaders += [('X-GPGAuth-Authenticated', 'false'), ('X-GPGAuth-Progress', 'stage1'),
+                                     ('X-GPGAuth-User-Auth-Token', quote_plus(encryptedToken))]
+            return 200, None
+
+        # Stage 2 : check the decrypted token and open a session
+        with server.lock:
+            expectedToken = server.pendingTokens.pop(fingerprint, None)
+        if expectedToken is None or self.body['gpg_auth']['user_token_result'] != expectedToken:
+            return 403, {'message': 'Invalid user token'}
+
+        sessionID = uuid.uuid4().hex
+        with server.lock:
+            server.sessions.add(sessionID)
+        self.responseHeaders += [('X-GPGAuth-Authenticated', 'true'), ('X-GPGAuth-Progress', 'complete'),
+                                 ('X-GPGAuth-Refer', '/'),
+                                 ('Set-Cookie', 'passbolt_session={}; Path=/'.format(sessionID)),
+                                 ('Set-Cookie', 'csrfToken={}; Path=/'.format(uuid.uuid4().hex))]
+        return 200, None
+
+    def checkSession(self):
+        if self.server.isAuthenticated(self.headers.get('Cookie', '')):
+            return 200, None
+        return 403, None
+
+    # Users and groups
+
+    def getUsers(self):
+        if self.param('contain[gpgkey]') == '0':
+            return 200, [{key: value for key, value in x.items() if key != 'Gpgkey'} for x in self.server.dataset.users]
+        return 200, self.server.dataset.users
+
+    def getKeys(self):
+        modifiedAfter = self.param('filter[modified-after]')
+        return 200, [x['Gpgkey'] for x in self.server.dataset.users
+                     if not modifiedAfter or x['Gpgkey']['modified'] > modifiedAfter]
+
+    def getUser(self, userID):
+        user = self.server.usersByID.get(userID)
+        return (200, user) if user else (404, None)
+
+    def getGroups(self):
+        server = self.server
+        currentUserID = server.dataset.currentUser['User']['id']
+        groups = []
+        for group in server.dataset.groups:
+            groupJSON = {'Group': group['Group']}
+            if self.param('contain[group_user]'):
+                groupJSON['GroupUser'] = group['GroupUser']
+            if self.param('contain[my_group_user]'):
+                for groupUser in group['GroupUser']:
+                    if groupUser['user_id'] == currentUserID:
+                        groupJSON['MyGroupUser'] = groupUser
+            groups.append(groupJSON)
+        return 200, groups
+
+    def getGroup(self, groupID):
+        group = self.server.groupsByID.get(groupID)
+        return (200, group) if group else (404, None)
+
+    def postGroup(self):
+        server = self.server
+        groupName = self.body.get('Group', {})
+        groupName = groupName.get('name') if isinstance(groupName, dict) else None
+        group = {'Group': {'id': str(uuid.uuid4()), 'name': groupName or 'Group {}'.format(len(server.groupsByID)),
+                           'deleted': False},
+                 'GroupUser': []}
+        with server.lock:
+            server.dataset.groups.append(group)
+            server.groupsByID[group['Group']['id']] = group
+        return 200, group
+
+    # Resources
+
+    def getResources(self):
+        server = self.server
+        groupIDs = set(self.params('filter[is-shared-with-group]') + self.params('filter[is-shared-with-group][]'))
+        resourceIDs = set(self.params('filter[has-id][]'))
+        modifiedAfter = self.param('filter[modified-after]')
+        withSecret = self.param('contain[secret]') == '1'
+
+        resources = []
+        for resource in list(server.dataset.resources):
+            if groupIDs and not any(x['aro_foreign_key'] in groupIDs for x in resource['Permission']):
+                continue
+            if resourceIDs and resource['Resource']['id'] not in resourceIDs:
+                continue
+            if modifiedAfter and resource['Resource']['modified'] <= modifiedAfter:
+                continue
+            resources.append(server.renderResource(resource, withSecret))
+        return 200, resources
+
+    def getResource(self, resourceID):
+        resource = self.server.resourcesByID.get(resourceID)
+        return (200, self.server.renderResource(resource, True)) if resource else (404, None)
+
+    def postResource(self):
+        server = self.server
+        resourceID = str(uuid.uuid4())
+        modified = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S+00:00')
+        resource = {
+            'Resource': {'id': resourceID, 'name': self.body.get('name'), 'username': self.body.get('username'),
+                         'uri': self.body.get('uri'), 'description': self.body.get('description'),
+                         'deleted': False, 'created': modified, 'modified': modified},
+            'Permission': [{'id': str(uuid.uuid4()), 'aco': 'Resource', 'aco_foreign_key': resourceID, 'aro': 'User',
+                            'aro_foreign_key': server.dataset.currentUser['User']['id'], 'type': 15}]
+        }
+        with server.lock:
+            server.dataset.resources.append(resource)
+            server.resourcesByID[resourceID] = resource
+            server.dataset.secrets[resourceID] = {}
+        # Resources are created with the v2 API, returning the resource without its envelope
+        return 200, resource['Resource']
+
+    def putResource(self, resourceID):
+        server = self.server
+        resource = server.resourcesByID.get(resourceID)
+        if resource is None:
+            return 404, None
+
+        with server.lock:
+            for field in ['name', 'username', 'uri', 'description']:
+                resource['Resource'][field] = self.body.get(field, resource['Resource'][field])
+            resource['Resource']['modified'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S+00:00')
+            secrets = self.body.get('secrets')
+            if isinstance(secrets, list) and secrets and isinstance(secrets[0], dict):
+                server.dataset.secrets[resourceID] = {x['user_id']: x['data'] for x in secrets}
+        return 200, server.renderResource(resource, False)
+
+    def getSecret(self, resourceID):
+        server = self.server
+        secret = server.dataset.secrets.get(resourceID, {}).get(server.dataset.currentUser['User']['id'])
+        if secret is None:
+            return 404, None
+        return 200, {'Secret': {'id': resourceID, 'resource_id': resourceID, 'data': secret}}
+
+    def putShare(self, resourceID):
+        server = self.server
+        resource = server.resourcesByID.get(resourceID)
+        if resource is None:
+            return 404, None
+
+        with server.lock:
+            for permission in self.body.get('permissions', []):
+                if permission.get('is_new'):
+                    resource['Permission'].append(dict(permission, id=str(uuid.uuid4())))
+            for secret in self.body.get('secrets', []):
+                server.dataset.secrets.setdefault(resourceID, {})[secret['user_id']] = secret['data']
+        return 200, None
+
+
+class FakePassboltServer(ThreadingHTTPServer):
+    logger = logging.getLogger('FakePassboltServer')
+    daemon_threads = True
+
+    def __init__(self, dataset, address=('127.0.0.1', 0)):
+        super(FakePassboltServer, self).__init__(address, FakePassboltHandler)
+        self.dataset = dataset
+        self.lock = threading.Lock()
+        self.requestCounts = Counter()
+
+        self.keyStore = openpgp.KeyStore()
+        self.keyStore.add([dataset.serverKey.certificate])
+        self.sessions = set()
+        # User auth tokens waiting for the stage 2 of the login
+        self.pendingTokens = {}
+
+        self.usersByID = {x['User']['id']: x for x in dataset.users}
+        self.groupsByID = {x['Group']['id']: x for x in dataset.groups}
+        self.resourcesByID = {x['Resource']['id']: x for x in dataset.resources}
+        self.routes = {
+            ('GET', '/auth/verify.json'): 'getVerify',
+            ('POST', '/auth/verify.json'): 'postVerify',
+            ('POST', '/auth/login.json'): 'postLogin',
+            ('GET', '/auth/checkSession.json'): 'checkSession',
+            ('GET', '/users.json'): 'getUsers',
+            ('GET', '/users/{id}.json'): 'getUser',
+            ('GET', '/gpgkeys.json'): 'getKeys',
+            ('GET', '/groups.json'): 'getGroups',
+            ('GET', '/groups/{id}.json'): 'getGroup',
+            ('POST', '/groups.json'): 'postGroup',
+            ('GET', '/resources.json'): 'getResources',
+            ('POST', '/resources.json'): 'postResource',
+            ('GET', '/resources/{id}.json'): 'getResource',
+            ('PUT', '/resources/{id}.json'): 'putResource',
+            ('GET', '/secrets/resource/{id}.json'): 'getSecret',
+            ('PUT', '/share/resource/{id}.json'): 'putShare',
+        }
+
+    @property
+    def uri(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-passbolt', daemon=True).start()
+
+    def countRequest(self, method, endpoint):
+        with self.lock:
+            self.requestCounts['{} {}'.format(method, endpoint)] += 1
+
+    def resetCounts(self):
+        with self.lock:
+            self.requestCounts = Counter()
+
+    def isAuthenticated(self, cookieHeader):
+        cookies = dict(x.strip().split('=', 1) for x in cookieHeader.split(';') if '=' in x)
+        return cookies.get('passbolt_session') in self.sessions
+
+    def renderResource(self, resource, withSecret):
+        resourceJSON = {'Resource': resource['Resource'], 'Permission': resource['Permission']}
+        if withSecret:
+            currentUserID = self.dataset.currentUser['User']['id']
+            secret = self.dataset.secrets.get(resource['Resource']['id'], {}).get(currentUserID)
+            resourceJSON['Secret'] = [{'data': secret}] if secret else []
+        return resourceJSON
@@ -0,0 +1,204 @@
+import base64
+import logging
+import re
+import shlex
+import socket
+import threading
+import time
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import paramiko
+
+"""
+Stand-ins for the services updated by the connectors of the toolbox :
+* an XWiki server exposing the REST password property used by XWikiConnector
+* an SSH server accepting the htdigest scripts run by HtdigestConnector
+Both can simulate the latency of a real service.
+"""
+
+
+class FakeXWikiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    passwordPathPattern = re.compile('^/xwiki/rest/wikis/xwiki/spaces/XWiki/pages/([^/]+)/objects/'
+                                     'XWiki.XWikiUsers/0/properties/password$')
+    userPathPattern = re.compile('^/xwiki/rest/wikis/xwiki/spaces/XWiki/pages/([^/]+)$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.countRequest('GET')
+        match = self.userPathPattern.match(self.path)
+        if match is None:
+            return self.__respond(200, '<html data-xwiki-rest-url="/xwiki/rest/"><body>XWiki</body></html>',
+                                  'text/html')
+
+        if not self.__isAuthenticated(match.group(1)):
+            return self.__respond(401, 'Unauthorized')
+        self.__respond(200, '{}', 'application/json')
+
+    def do_PUT(self):
+        self.server.countRequest('PUT')
+        newPassword = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+        match = self.passwordPathPattern.match(self.path)
+        if match is None:
+            return self.__respond(404, 'Not found')
+
+        time.sleep(self.server.latency)
+        if not self.__isAuthenticated(match.group(1)):
+            return self.__respond(401, 'Unauthorized')
+
+        with self.server.lock:
+            self.server.passwords[match.group(1)] = newPassword
+        self.__respond(202, '{}', 'application/json')
+
+    def __isAuthenticated(self, username):
+        authUsername, password = base64.b64decode(self.headers.get('Authorization', ' ').split(' ')[1])\
+            .decode('utf-8').split(':', 1)
+        return authUsername == username and self.server.passwords.get(username) == password
+
+    def __respond(self, status, content, contentType='text/plain'):
+        content = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeXWikiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    """
+    @param passwords : map of username -> current password, updated when passwords are changed
+    @param latency : the number of seconds taken by each password update
+    """
+    def __init__(self, passwords, latency=0.0, address=('127.0.0.1', 0)):
+        super(FakeXWikiServer, self).__init__(address, FakeXWikiHandler)
+        self.passwords = passwords
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requestCounts = Counter()
+
+    @property
+    def uri(self):
+        return 'http://{}:{}/xwiki/bin/view/Main/'.format(*self.server_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-xwiki', daemon=True).start()
+
+    def countRequest(self, method):
+        with self.lock:
+            self.requestCounts[method] += 1
+
+
+class FakeSSHInterface(paramiko.ServerInterface):
+    def __init__(self, server):
+        self.server = server
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, channelID):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        error = self.server.runCommand(command.decode('utf-8'))
+        threading.Thread(target=self.__runCommand, args=(channel, error), daemon=True).start()
+        return True
+
+    def __runCommand(self, channel, error):
+        time.sleep(self.server.latency)
+        if error:
+            channel.sendall_stderr(error.encode('utf-8'))
+        # The channel is left open for the client to close it, as closing it could happen before the exec request
+        # has been acknowledged
+        channel.send_exit_status(1 if error else 0)
+
+
+class FakeSSHServer:
+    logger = logging.getLogger('FakeSSHServer')
+
+    """
+    @param passwords : map of username -> password of the htdigest users, updated by the update script
+    @param latency : the number of seconds taken by each command
+    """
+    def __init__(self, passwords, latency=0.0, address=('127.0.0.1', 0)):
+        self.passwords = passwords
+        self.latency = latency
+        self.hostKey = paramiko.RSAKey.generate(2048)
+        self.lock = threading.Lock()
+        self.commands = Counter()
+        # Commands whose arguments were not the ones expected by the scripts
+        self.rejectedCommands = []
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.listen(64)
+        self.address = self.socket.getsockname()
+
+    @property
+    def uri(self):
+        return 'ssh://{}:{}'.format(*self.address)
+
+    def start(self):
+        threading.Thread(target=self.__acceptConnections, name='fake-ssh', daemon=True).start()
+
+    """
+    Check the arguments of the given command, as the scripts of the toolbox would, and apply it.
+    Returns an error message if the command has been rejected, None otherwise.
+    """
+    def runCommand(self, command):
+        arguments = shlex.split(command)
+        if arguments and arguments[0] == 'sudo':
+            arguments = arguments[1:]
+        script = arguments[0].split('/')[-1] if arguments else ''
+
+        error = None
+        if script == 'update_htdigest.sh':
+            # update_htdigest.sh user realm password, the realm being the URI of the resource by default
+            if len(arguments) != 4:
+                error = 'Usage : update_htdigest.sh user realm password'
+            elif arguments[1] not in self.passwords:
+                error = 'Unknown htdigest user [{}]'.format(arguments[1])
+            elif arguments[2] != self.uri:
+                error = 'Unknown htdigest realm [{}]'.format(arguments[2])
+        elif script != 'rollback_htdigest.sh' or len(arguments) != 1:
+            error = 'Unknown command [{}]'.format(command)
+
+        with self.lock:
+            self.commands[script] += 1
+            if error:
+                self.rejectedCommands.append(command)
+            elif script == 'update_htdigest.sh':
+                self.passwords[arguments[1]] = arguments[3]
+        return error
+
+    def __acceptConnections(self):
+        while True:
+            connection, address = self.socket.accept()
+            threading.Thread(target=self.__handleConnection, args=(connection,), daemon=True).start()
+
+    def __handleConnection(self, connection):
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(self.hostKey)
+        try:
+            transport.start_server(server=FakeSSHInterface(self))
+            # Keep the transport open until the client closes it. Channels are closed when garbage collected, so a
+            # reference to them is kept for the lifetime of the connection
+            channels = []
+            while transport.is_active():
+                channels.append(transport.accept(1))
+        except (paramiko.SSHException, EOFError) as e:
+            self.logger.debug('SSH connection failed : [{}]'.format(e))
+        finally:
+            transport.close()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import paramiko
+
+benchmarksDir = os.path.dirname(os.path.abspath(__file__))
+repositoryDir = os.path.dirname(benchmarksDir)
+# Appended so that the toolbox modules do not shadow standard modules, such as resource
+sys.path.append(os.path.join(repositoryDir, 'toolbox'))
+
+from dataset import Dataset  # noqa: E402
+from fakepassbolt import FakePassboltServer  # noqa: E402
+from fakeservices import FakeSSHServer  # noqa: E402
+from fakeservices import FakeXWikiServer  # noqa: E402
+
+"""
+Offline benchmark of the toolbox : the toolbox is run against local stand-ins of Passbolt, XWiki and an SSH server,
+with a synthetic dataset, and the throughput, the number of Passbolt API calls per resource and the peak memory of each
+scenario are compared to the stored baselines.
+"""
+
+SCENARIOS = ['renew', 'import']
+# Metric -> True if a higher value is better
+MEASUREMENTS = {
+    'resourcesPerSecond': True,
+    'apiCallsPerResource': False,
+    'peakRSSMB': False
+}
+
+
+class BenchmarkRunner:
+    logger = logging.getLogger('BenchmarkRunner')
+
+    def __init__(self, args):
+        self.args = args
+        self.dataset = Dataset(users=args.users, groups=args.groups, resources=args.resources,
+                               groupSize=args.group_size)
+        self.workDir = tempfile.mkdtemp(prefix='passbolt-toolbox-benchmark-')
+        self.configDir = os.path.join(self.workDir, '.config', 'passbolt-toolbox')
+        self.metricsFilePath = os.path.join(self.workDir, 'metrics.json')
+        self.passboltServer = None
+        self.xwikiServer = None
+
+    @property
+    def parameters(self):
+        return {'users': self.args.users, 'groups': self.args.groups, 'resources': self.args.resources,
+                'groupSize': self.args.group_size, 'workers': self.args.workers, 'backend': self.args.backend}
+
+    def setUp(self):
+        self.sshServer = FakeSSHServer(self.dataset.servicePasswords, latency=self.args.latency)
+        self.xwikiServer = FakeXWikiServer(self.dataset.servicePasswords, latency=self.args.latency)
+
+        self.logger.info('Generating the dataset in [{}]'.format(self.workDir))
+        self.dataset.generate(os.path.join(self.workDir, 'dataset-gnupg'), self.xwikiServer.uri, self.sshServer.uri)
+        self.passboltServer = FakePassboltServer(self.dataset)
+
+        for server in [self.passboltServer, self.xwikiServer, self.sshServer]:
+            server.start()
+
+        self.__writeConfiguration()
+        self.__importKeys()
+
+        # Key used by the HtdigestConnector, the fake SSH server accepts any key
+        os.makedirs(os.path.join(self.workDir, '.ssh'), mode=0o700)
+        paramiko.RSAKey.generate(2048).write_private_key_file(os.path.join(self.workDir, '.ssh', 'id_rsa'))
+
+    def tearDown(self):
+        for server in [self.passboltServer, self.xwikiServer]:
+            if server is not None:
+                server.shutdown()
+        if self.args.keepWorkDir:
+            self.logger.info('The working directory has been kept in [{}]'.format(self.workDir))
+        else:
+            shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def __writeConfiguration(self):
+        with open(os.path.join(repositoryDir, 'toolbox', 'templates', 'config.json'), 'r') as templateFile:
+            config = json.load(templateFile)
+
+        config['server'] = {'uri': self.passboltServer.uri, 'fingerprint': self.dataset.serverKey.fingerprint,
+                            'verifyCert': False}
+        config['user'] = {'fingerprint': self.dataset.currentUserKey.fingerprint}
+        config['parameters']['crypto']['backend'] = self.args.backend
+        config['parameters']['metrics']['json-file'] = self.metricsFilePath
+        config['connectors']['htdigest'].update({'username': 'benchmark', 'script-directory': '/srv',
+                                                 'use-sudo': False})
+
+        os.makedirs(os.path.join(self.configDir, 'gnupg'), mode=0o700)
+        with open(os.path.join(self.configDir, 'config.json'), 'w') as configFile:
+            json.dump(config, configFile, indent=4)
+
+    def __importKeys(self):
+        keyringDir = os.path.join(self.configDir, 'gnupg')
+        with open(os.path.join(keyringDir, 'gpg.conf'), 'w') as gpgConfigFile:
+            gpgConfigFile.write('trust-model always\n')
+
+        for armoredKey in [self.dataset.currentUserKey.armoredSecretKey, self.dataset.serverKey.armoredPublicKey]:
+            subprocess.run(['gpg', '--homedir', keyringDir, '--batch', '--import'], input=armoredKey.encode('utf-8'),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+    """
+    Run the toolbox with the given arguments and measure its wall time and peak memory usage.
+    """
+    def __runToolbox(self, arguments):
+        self.passboltServer.resetCounts()
+        if os.path.exists(self.metricsFilePath):
+            os.remove(self.metricsFilePath)
+
+        environment = dict(os.environ, HOME=self.workDir)
+        startTime = time.monotonic()
+        with open(os.path.join(self.workDir, 'toolbox.log'), 'a') as logFile:
+            process = subprocess.Popen([sys.executable, 'toolbox/main.py'] + arguments, cwd=repositoryDir,
+                                       env=environment, stdout=logFile, stderr=subprocess.STDOUT)
+            pid, status, usage = os.wait4(process.pid, 0)
+        duration = time.monotonic() - startTime
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        if process.returncode != 0:
+            self.logger.error('The toolbox exited with status [{}], see [{}]'
+                              .format(process.returncode, os.path.join(self.workDir, 'toolbox.log')))
+        apiCalls = sum(count for endpoint, count in self.passboltServer.requestCounts.items()
+                       if ' /auth/' not in endpoint)
+        # ru_maxrss is expressed in kilobytes on Linux
+        return duration, apiCalls, usage.ru_maxrss / 1024
+
+    def runRenew(self):
+        duration, apiCalls, peakRSS = self.__runToolbox(['renew', '-g', 'Benchmark', '-w', str(self.args.workers)])
+
+        if self.sshServer.rejectedCommands:
+            self.logger.error('The fake SSH server rejected [{}] commands, first one : [{}]'
+                              .format(len(self.sshServer.rejectedCommands), self.sshServer.rejectedCommands[0]))
+
+        renewedResources = 0
+        if os.path.exists(self.metricsFilePath):
+            with open(self.metricsFilePath, 'r') as metricsFile:
+                renewedResources = json.load(metricsFile)['items'].get('success', 0)
+        return self.__measurements(renewedResources, duration, apiCalls, peakRSS)
+
+    def runImport(self):
+        importFilePath = os.path.join(self.workDir, 'import.csv')
+        self.dataset.writeImportFile(importFilePath, [x['Group']['name'] for x in self.dataset.groups])
+
+        resourceCount = len(self.passboltServer.resourcesByID)
+        duration, apiCalls, peakRSS = self.__runToolbox(['import', '--auto-create-groups',
+                                                         '-w', str(self.args.workers), importFilePath])
+        return self.__measurements(len(self.passboltServer.resourcesByID) - resourceCount, duration, apiCalls,
+                                   peakRSS)
+
+    def __measurements(self, resources, duration, apiCalls, peakRSS):
+        return {
+            'resources': resources,
+            'durationSeconds': round(duration, 3),
+            'resourcesPerSecond': round(resources / duration, 3),
+            'apiCallsPerResource': round(apiCalls / resources, 3) if resources else None,
+            'peakRSSMB': round(peakRSS, 1)
+        }
+
+
+"""
+Compare the measurements of a scenario to its baseline. Returns the list of regressions.
+"""
+
+
+def compareToBaseline(scenario, measurements, baseline, tolerance):
+    regressions = []
+    for name, higherIsBetter in MEASUREMENTS.items():
+        value = measurements.get(name)
+        reference = baseline.get(name)
+        if value is None or reference is None:
+            continue
+
+        if higherIsBetter:
+            regressed = value < reference * (1 - tolerance)
+        else:
+            regressed = value > reference * (1 + tolerance)
+        print('  {:<22} {:>10} (baseline {:>10}){}'.format(name, value, reference, '  REGRESSION' if regressed else ''))
+        if regressed:
+            regressions.append('{} : {}'.format(scenario, name))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the Passbolt toolbox.')
+    parser.add_argument('--users', type=int, default=50, help='number of users')
+    parser.add_argument('--groups', type=int, default=5, help='number of groups')
+    parser.add_argument('--resources', type=int, default=200, help='number of resources')
+    parser.add_argument('--group-size', type=int, default=20, help='number of members of each group')
+    parser.add_argument('--workers', type=int, default=4, help='number of workers of the renewal')
+    parser.add_argument('--backend', default='gnupg', choices=['gnupg', 'openpgp'], help='crypto backend to use')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='time in seconds taken by the fake services to update a password')
+    parser.add_argument('--scenario', default='all', choices=SCENARIOS + ['all'], help='scenario to run')
+    parser.add_argument('--baselines', default=os.path.join(benchmarksDir, 'baselines.json'),
+                        help='path to the file of baselines')
+    parser.add_argument('--save-baseline', dest='saveBaseline', action='store_true',
+                        help='store the measurements as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative difference to the baselines tolerated before reporting a regression')
+    parser.add_argument('--keep-work-dir', dest='keepWorkDir', action='store_true',
+                        help='keep the configuration and the logs of the toolbox after the benchmark')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+    logging.getLogger('paramiko').setLevel(logging.WARNING)
+
+    baselines = {}
+    if os.path.isfile(args.baselines):
+        with open(args.baselines, 'r') as baselinesFile:
+            baselines = json.load(baselinesFile)
+
+    runner = BenchmarkRunner(args)
+    results = {}
+    try:
+        runner.setUp()
+        for scenario in (SCENARIOS if args.scenario == 'all' else [args.scenario]):
+            logging.info('Running scenario [{}]'.format(scenario))
+            results[scenario] = dict(getattr(runner, 'run' + scenario.capitalize())(), parameters=runner.parameters)
+    finally:
+        runner.tearDown()
+
+    regressions = []
+    for scenario, measurements in results.items():
+        print('{} : {} resources in {}s'.format(scenario, measurements['resources'], measurements['durationSeconds']))
+        baseline = baselines.get(scenario)
+        if args.saveBaseline:
+            baselines[scenario] = measurements
+        elif baseline is None:
+            print('  No baseline for this scenario')
+        elif baseline.get('parameters') != measurements['parameters']:
+            print('  The baseline has been measured with other parameters : [{}]'.format(baseline.get('parameters')))
+        else:
+            regressions += compareToBaseline(scenario, measurements, baseline, args.tolerance)
+
+    if args.saveBaseline:
+        with open(args.baselines, 'w') as baselinesFile:
+            json.dump(baselines, baselinesFile, indent=4, sort_keys=True)
+            baselinesFile.write('\n')
+        print('Baselines saved in [{}]'.format(args.baselines))
+
+    if any(x['resources'] == 0 for x in results.values()):
+        print('No resource has been processed in some scenarios')
+        return 1
+    if regressions:
+        print('Regressions found : {}'.format(', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import bisect
+
+"""
+In-memory catalog of resources with secondary indexes.
+
+Indexes are maintained as resources are added or removed, so that selecting the resources of a group, of a connector,
+updatable by the current user or last updated in a given period is done with set operations instead of going through
+the permissions of every resource.
+"""
+
+# Permission types allowing to update a resource : UPDATE and OWNER
+# https://github.com/passbolt/passbolt_api/blob/master/src/Model/Entity/Permission.php
+WRITE_PERMISSION_TYPES = frozenset([7, 15])
+OWNER_PERMISSION_TYPE = 15
+
+
+def splitPermissions(permissions):
+    """Returns a map of group ID -> permission type and a map of user ID -> permission type."""
+    groupPermissions = {}
+    userPermissions = {}
+    for permission in permissions:
+        if permission['aro'] == 'Group':
+            groupPermissions[permission['aro_foreign_key']] = permission['type']
+        elif permission['aro'] == 'User':
+            userPermissions[permission['aro_foreign_key']] = permission['type']
+    return groupPermissions, userPermissions
+
+
+def isWritableBy(resource, userID, groupIDs):
+    """Returns True if the given user, member of the given set of groups, can update the resource."""
+    if resource.userPermissions.get(userID) in WRITE_PERMISSION_TYPES:
+        return True
+    return any(permissionType in WRITE_PERMISSION_TYPES
+               for groupID, permissionType in resource.groupPermissions.items() if groupID in groupIDs)
+
+
+class ResourceCatalog:
+    """
+    Holds resources exposing the properties of a Resource (connectorType, lastUpdateDate, groupPermissions and
+    userPermissions), such as Resource or IndexedResource objects.
+    """
+
+    def __init__(self, resources=()):
+        # Resource ID -> resource
+        self.resources = {}
+        # Connector alias -> IDs of the resources
+        self.idsByConnector = {}
+        # Group ID -> IDs of the resources shared with the group
+        self.idsByGroup = {}
+        # Group or user ID -> IDs of the resources that the group or user can update
+        self.writableIDsByGroup = {}
+        self.writableIDsByUser = {}
+        # User ID -> IDs of the resources owned by the user
+        self.ownedIDsByUser = {}
+        self.neverUpdatedIDs = set()
+        # Sorted last update dates and IDs of the matching resources, rebuilt on the first query following a change
+        self.updateDates = []
+        self.updateDateIDs = []
+        self.updateDatesValid = True
+
+        for resource in resources:
+            self.add(resource)
+
+    def __len__(self):
+        return len(self.resources)
+
+    def __contains__(self, resourceID):
+        return resourceID in self.resources
+
+    def get(self, resourceID):
+        return self.resources.get(resourceID)
+
+    def values(self):
+        return self.resources.values()
+
+    def add(self, resource):
+        resourceID = resource['Resource']['id']
+        self.remove(resourceID)
+        self.resources[resourceID] = resource
+
+        self.__index(self.idsByConnector, resource.connectorType, resourceID)
+        for groupID, permissionType in resource.groupPermissions.items():
+            self.__index(self.idsByGroup, groupID, resourceID)
+            if permissionType in WRITE_PERMISSION_TYPES:
+                self.__index(self.writableIDsByGroup, groupID, resourceID)
+        for userID, permissionType in resource.userPermissions.items():
+            if permissionType in WRITE_PERMISSION_TYPES:
+                self.__index(self.writableIDsByUser, userID, resourceID)
+            if permissionType == OWNER_PERMISSION_TYPE:
+                self.__index(self.ownedIDsByUser, userID, resourceID)
+
+        if resource.lastUpdateDate is None:
+            self.neverUpdatedIDs.add(resourceID)
+        else:
+            self.updateDatesValid = False
+
+    def remove(self, resourceID):
+        resource = self.resources.pop(resourceID, None)
+        if resource is None:
+            return
+
+        self.__unindex(self.idsByConnector, resource.connectorType, resourceID)
+        for groupID in resource.groupPermissions:
+            self.__unindex(self.idsByGroup, groupID, resourceID)
+            self.__unindex(self.writableIDsByGroup, groupID, resourceID)
+        for userID in resource.userPermissions:
+            self.__unindex(self.writableIDsByUser, userID, resourceID)
+            self.__unindex(self.ownedIDsByUser, userID, resourceID)
+
+        if resource.lastUpdateDate is None:
+            self.neverUpdatedIDs.discard(resourceID)
+        else:
+            self.updateDatesValid = False
+
+    def __index(self, index, key, resourceID):
+        index.setdefault(key, set()).add(resourceID)
+
+    def __unindex(self, index, key, resourceID):
+        resourceIDs = index.get(key)
+        if resourceIDs is not None:
+            resourceIDs.discard(resourceID)
+            if not resourceIDs:
+                del index[key]
+
+    def withConnector(self, connectorType):
+        return set(self.idsByConnector.get(connectorType, ()))
+
+    def sharedWithGroups(self, groupIDs):
+        return set().union(*[self.idsByGroup.get(x, ()) for x in groupIDs])
+
+    def ownedBy(self, userID):
+        return set(self.ownedIDsByUser.get(userID, ()))
+
+    """
+    Returns the IDs of the resources that the given user, member of the given groups, can update.
+    """
+    def writableBy(self, userID, groupIDs):
+        writableIDs = set(self.writableIDsByUser.get(userID, ()))
+        return writableIDs.union(*[self.writableIDsByGroup.get(x, ()) for x in groupIDs])
+
+    """
+    Returns the IDs of the resources last updated between the given dates, included. Resources that have never been
+    updated are not part of the result.
+    """
+    def updatedBetween(self, after=None, before=None):
+        if not self.updateDatesValid:
+            sortedDates = sorted((x.lastUpdateDate, resourceID) for resourceID, x in self.resources.items()
+                                 if x.lastUpdateDate is not None)
+            self.updateDates = [x[0] for x in sortedDates]
+            self.updateDateIDs = [x[1] for x in sortedDates]
+            self.updateDatesValid = True
+
+        start = bisect.bisect_left(self.updateDates, after) if after else 0
+        end = bisect.bisect_right(self.updateDates, before) if before else len(self.updateDates)
+        return set(self.updateDateIDs[start:end])
+
+    def neverUpdated(self):
+        return set(self.neverUpdatedIDs)
+
+    """
+    Returns the resources having the given IDs, sorted by last update date, the resources never updated first.
+    """
+    def resolve(self, resourceIDs):
+        resources = [self.resources[x] for x in resourceIDs if x in self.resources]
+        resources.sort(key=lambda x: (x.lastUpdateDate is not None, x.lastUpdateDate or 0))
+        return resources
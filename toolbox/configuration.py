@@ -11,6 +11,14 @@ class Environment:
     configFilePath = '{}/config.json'.format(configDir)
     keyringDir = '{}/gnupg'.format(configDir)
     privateKeysDir = '{}/private-keys-v1.d'.format(keyringDir)
+    journalFilePath = '{}/renewal-journal.jsonl'.format(configDir)
+    indexFilePath = '{}/resource-index.json'.format(configDir)
+    metadataCacheFilePath = '{}/metadata-cache.json'.format(configDir)
+    metadataStoreFilePath = '{}/renewal-metadata.sqlite'.format(configDir)
+    metricsFilePath = '{}/renewal-metrics.json'.format(configDir)
+    daemonSocketPath = '{}/daemon.sock'.format(configDir)
+    sessionsDir = '{}/sessions'.format(configDir)
+    importManifestsDir = '{}/imports'.format(configDir)
 
 
 class ConfigManager:
@@ -23,7 +31,8 @@ class ConfigManager:
         self.__loadConfig()
 
     def __ensureExistingFolders(self):
-        foldersToCheck = [Environment.configDir, Environment.keyringDir, Environment.privateKeysDir]
+        foldersToCheck = [Environment.configDir, Environment.keyringDir, Environment.privateKeysDir,
+                          Environment.sessionsDir, Environment.importManifestsDir]
 
         for folder in foldersToCheck:
             self.logger.debug('Checking if directory [{}] is present'.format(folder))
@@ -33,6 +42,9 @@ class ConfigManager:
 
     def __ensureFolderPermissions(self):
         os.chmod(Environment.privateKeysDir, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+        # The saved sessions allow to act on the behalf of the user without the private key
+        os.chmod(Environment.sessionsDir, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+        os.chmod(Environment.importManifestsDir, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
 
     # Make sure that the trust model of GnuPG is well set so that every imported key get ultimate trust and
     # can be used for encryption / decryption
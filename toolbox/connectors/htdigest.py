@@ -1,7 +1,11 @@
 import logging
 import paramiko
+import shlex
+
+from urllib.parse import urlparse
 
 from .meta import Connector
+from .meta import PasswordUpdateError
 
 
 class HtdigestConnector(Connector):
@@ -18,44 +22,61 @@ class HtdigestConnector(Connector):
         super(HtdigestConnector, self).__init__(configManager, resource, oldPassword, newPassword)
 
         # Get the htdigest connector configuration
-        self.config = self.defaultConfig
+        self.config = dict(self.defaultConfig)
         if 'htdigest' in self.configManager.connectors().keys():
             self.config.update(self.configManager.connectors()['htdigest'])
 
         # Compute the domain to use, default on the URI of the server
         if self.config['domain']:
-            domain = self.config['domain']
+            self.domain = self.config['domain']
         else:
-            domain = resource['Resource']['uri']
+            self.domain = resource['Resource']['uri']
+
+        # The URI of the resource may or may not have a scheme, and may define the SSH port
+        parsedURI = urlparse(self.resourceURI if '://' in self.resourceURI else 'ssh://' + self.resourceURI)
+        self.host = parsedURI.hostname
+        self.port = parsedURI.port or 22
 
         self.client = paramiko.SSHClient()
         self.client.set_missing_host_key_policy(paramiko.WarningPolicy())
 
     def updatePassword(self):
         # Connect to the server
-        self.client.connect(resource['Resource']['uri'], username=self.config['username'])
+        self.client.connect(self.host, port=self.port, username=self.config['username'])
 
         if self.config['use-sudo']:
-            command = 'sudo {}/./update_htdigest.sh "{}" "{}" "{}"'
+            command = 'sudo {}/./update_htdigest.sh {} {} {}'
         else:
-            command = '{}/./update_htdigest.sh "{}" "{}" "{}"'
+            command = '{}/./update_htdigest.sh {} {} {}'
 
-        stdin, stdout, stderr = client.exec_command(
+        # The script expects : user, realm, password. The username of the resource can be edited by any user having
+        # access to it, so every argument is quoted for the shell
+        stdin, stdout, stderr = self.client.exec_command(
             command.format(self.config['script-directory'],
-                           resource['Resource']['username'],
-                           self.newPassword))
+                           shlex.quote(self.resource['Resource']['username']),
+                           shlex.quote(self.domain),
+                           shlex.quote(self.newPassword)))
+        self.__checkExitStatus(stdout, stderr)
 
         self.client.close()
 
     def rollbackPasswordUpdate(self):
-        self.client.connect(resource['Resource']['uri'], username=self.config['username'])
+        self.client.connect(self.host, port=self.port, username=self.config['username'])
 
         if self.config['use-sudo']:
             command = 'sudo {}/./rollback_htdigest.sh'
         else:
             command = '{}/./rollback_htdigest.sh'
 
-        stdin, stdout, stderr = client.exec_command(
+        stdin, stdout, stderr = self.client.exec_command(
             command.format(self.config['script-directory']))
+        self.__checkExitStatus(stdout, stderr)
 
         self.client.close()
+
+    def __checkExitStatus(self, stdout, stderr):
+        exitStatus = stdout.channel.recv_exit_status()
+        if exitStatus != 0:
+            self.client.close()
+            raise PasswordUpdateError('The script returned an invalid exit status : [{}] [{}]'
+                                      .format(exitStatus, stderr.read().decode('utf-8', 'replace').strip()))
@@ -31,6 +31,16 @@ class Connector:
     def updatePassword(self):
         raise NotImplementedError("Please implement this method")
 
+    """
+    Check whether the given password is the current password on the related service, without changing anything on it.
+    Connectors that cannot check a password without updating it keep this default implementation.
+
+    @return True or False, or None if the connector cannot tell
+    @throws PasswordUpdateError if the service could not be reached
+    """
+    def checkPassword(self, password):
+        return None
+
     """
     Rollback the previously updated password.
     This method will always be called after #updatePassword(), thus it can take advantage of connector attributes
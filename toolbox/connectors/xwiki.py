@@ -48,6 +48,37 @@ class XWikiConnector(Connector):
             raise PasswordUpdateError('Communication with the XWiki server failed : [{}]'.format(e))
 
     def updatePassword(self):
+        self.__resolveRESTRootURL()
+        return self.__sendPasswordUpdateRequest(self.oldPassword, self.newPassword)
+
+    """
+    Authenticate as the user of the resource on its own page, which fails if the password is not its current one.
+    """
+    def checkPassword(self, password):
+        self.__resolveRESTRootURL()
+        try:
+            result = requests.get(
+                '{}/wikis/xwiki/spaces/XWiki/pages/{}'.format(self.restRootURL, self.resourceUsername),
+                auth=HTTPBasicAuth(self.resourceUsername, password),
+                verify=False,
+                headers={'Accept': 'application/json'})
+        except RequestException as e:
+            raise PasswordUpdateError('Communication with the XWiki server failed : [{}]'.format(e))
+
+        if result.status_code == 200:
+            return True
+        elif result.status_code in (401, 403):
+            return False
+        self.logger.debug('Unexpected status code [{}] while checking the password'.format(result.status_code))
+        return None
+
+    """
+    Find the REST root URL of the XWiki instance from the page given as URI of the resource, once per connector.
+    """
+    def __resolveRESTRootURL(self):
+        if getattr(self, 'restRootURL', None) is not None:
+            return
+
         self.resourceUsername = self.resource['Resource']['username']
         self.logger.debug('Resource username : [{}]'.format(self.resourceUsername))
 
@@ -71,8 +102,6 @@ class XWikiConnector(Connector):
 
             # Store the root URL in case we need it in #rollbackPasswordUpdate()
             self.restRootURL = baseURL + restRootPath
-
-            return self.__sendPasswordUpdateRequest(self.oldPassword, self.newPassword)
         except RequestException as e:
             raise PasswordUpdateError('Communication with the XWiki server failed : [{}]'.format(e))
 
@@ -0,0 +1,263 @@
+import getpass
+import logging
+import metrics
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import openpgp
+
+
+class CryptoError(Exception):
+    """Error thrown when a message could not be encrypted or decrypted."""
+    pass
+
+
+class GnuPGBackend:
+    """Runs every operation through a gpg process, using the GnuPG keyring of the tool."""
+
+    name = 'gnupg'
+    logger = logging.getLogger('GnuPGBackend')
+
+    def __init__(self, keyring):
+        self.keyring = keyring
+        # Key ID as given by the caller -> IDs of the primary key and of the subkeys of the key
+        self.keyIDsCache = {}
+        self.keyIDsLock = threading.Lock()
+
+    def encrypt(self, plaintext, keyID):
+        result = self.keyring.encrypt(plaintext, keyID)
+        if not result.ok:
+            raise CryptoError('Failed to encrypt for key [{}] : [{}]'.format(keyID, result.status))
+        return result.data.decode('utf-8')
+
+    def decrypt(self, ciphertext):
+        result = self.keyring.decrypt(ciphertext)
+        if not result.ok:
+            raise CryptoError('Failed to decrypt message : [{}]'.format(result.status))
+        return str(result)
+
+    """
+    Encrypt the plaintext for every key with a single gpg call, then split the resulting message into one message
+    per key. Returns a map of key ID -> armored message.
+    """
+    def encryptShared(self, plaintext, keyIDs):
+        result = self.keyring.encrypt(plaintext, keyIDs, armor=False)
+        if not result.ok:
+            raise CryptoError('Failed to encrypt for keys [{}] : [{}]'.format(keyIDs, result.status))
+
+        messagesBySubkey = openpgp.splitMessage(result.data)
+        messages = {}
+        for keyID, subkeyIDs in self.__resolveKeyIDs(keyIDs).items():
+            matchingSubkeys = [x for x in subkeyIDs if x in messagesBySubkey]
+            if not matchingSubkeys:
+                raise openpgp.UnsupportedError('No session key found for key [{}]'.format(keyID))
+            messages[keyID] = messagesBySubkey[matchingSubkeys[0]]
+        return messages
+
+    def __resolveKeyIDs(self, keyIDs):
+        missingKeyIDs = [x for x in keyIDs if x not in self.keyIDsCache]
+        if missingKeyIDs:
+            keys = self.keyring.list_keys(keys=missingKeyIDs)
+            with self.keyIDsLock:
+                for keyID in missingKeyIDs:
+                    for key in keys:
+                        if key['fingerprint'].endswith(keyID.upper()) or key['keyid'].endswith(keyID.upper()):
+                            self.keyIDsCache[keyID] = [key['keyid']] + [x[0] for x in key['subkeys']]
+        return {keyID: self.keyIDsCache.get(keyID, []) for keyID in keyIDs}
+
+
+class OpenPGPBackend:
+    """
+    Runs operations in-process. The keys of the GnuPG keyring are exported once and kept in memory, keys imported
+    through the KeyringManager afterwards are loaded as they are imported. Messages or keys using OpenPGP features that
+    are not supported in-process are handled by the fallback backend.
+
+    Signatures of keys are not verified in-process : the validity of each key (revoked, expired, bindings that do not
+    verify) is taken from gpg when the key is loaded, so that secrets are only encrypted for keys gpg would accept.
+    """
+
+    name = 'openpgp'
+    logger = logging.getLogger('OpenPGPBackend')
+
+    def __init__(self, configManager, keyringManager, fallback):
+        self.configManager = configManager
+        self.keyring = keyringManager.keyring
+        self.fallback = fallback
+        self.keyStore = openpgp.KeyStore()
+        self.__loadKeyring(list(keyringManager.fingerprints))
+        keyringManager.addImportListener(self.addKeys)
+
+    def __loadKeyring(self, fingerprints):
+        if fingerprints:
+            self.__addCertificates(openpgp.parseCertificates(openpgp.dearmor(self.keyring.export_keys(fingerprints))))
+
+        userFingerprint = self.configManager.user()['fingerprint']
+        if userFingerprint:
+            passphrase = self.configManager.parameters().get('crypto', {}).get('passphrase')
+            exportedKey = self.keyring.export_keys(userFingerprint, secret=True, passphrase=passphrase,
+                                                   expect_passphrase=passphrase is not None)
+            if not exportedKey:
+                self.logger.warning('Could not export the secret key [{}], decryption will use gpg'
+                                    .format(userFingerprint))
+                return
+
+            certificates = openpgp.parseCertificates(openpgp.dearmor(exportedKey))
+            for certificate in certificates:
+                for key in certificate.keys():
+                    if key.isSecret():
+                        self.__unlockKey(key, passphrase)
+            self.__addCertificates(certificates)
+
+        self.logger.debug('Loaded [{}] keys in memory'.format(len(fingerprints)))
+
+    def __unlockKey(self, key, passphrase):
+        try:
+            if key.isProtected() and passphrase is None:
+                passphrase = getpass.getpass('Passphrase for the key [{}] : '.format(key.keyID))
+            key.unlock(passphrase)
+        except openpgp.UnsupportedError as e:
+            self.logger.warning('Secret key [{}] cannot be used in-process : [{}]'.format(key.keyID, e))
+        except openpgp.OpenPGPError as e:
+            raise CryptoError('Failed to unlock the secret key [{}] : [{}]'.format(key.keyID, e))
+
+    """
+    Load the given armored public keys, freshly imported in the keyring. Keys that cannot be parsed are exported from
+    the keyring on first use instead.
+    """
+    def addKeys(self, armoredKeys):
+        for armoredKey in armoredKeys:
+            try:
+                self.__addCertificates(openpgp.parseCertificates(openpgp.dearmor(armoredKey)))
+            except (openpgp.OpenPGPError, ValueError) as e:
+                self.logger.debug('Could not load an imported key in memory : [{}]'.format(e))
+
+    def __getCertificate(self, keyID):
+        certificate = self.keyStore.get(keyID)
+        if certificate is None:
+            # The key has probably been imported in the keyring after it was loaded
+            exportedKey = self.keyring.export_keys(keyID)
+            if not exportedKey:
+                raise CryptoError('Key [{}] is not present in the keyring'.format(keyID))
+            self.__addCertificates(openpgp.parseCertificates(openpgp.dearmor(exportedKey)))
+            certificate = self.keyStore.get(keyID)
+        return certificate
+
+    """
+    Set the validity computed by gpg on every key of the given certificates, listed with a single gpg call, then add
+    them to the key store. Keys unknown to gpg, such as subkeys whose binding signature has been rejected on import,
+    are invalid.
+    """
+    def __addCertificates(self, certificates):
+        if not certificates:
+            return
+
+        validities = {}
+        for listedKey in self.keyring.list_keys(keys=[x.fingerprint for x in certificates]):
+            keyValidities = {listedKey['keyid']: listedKey['trust']}
+            keyValidities.update({keyID: info['trust'] for keyID, info in listedKey.get('subkey_info', {}).items()})
+            validities[listedKey['fingerprint']] = keyValidities
+
+        for certificate in certificates:
+            keyValidities = validities.get(certificate.fingerprint, {})
+            for key in certificate.keys():
+                key.validity = keyValidities.get(key.keyID, 'i')
+        self.keyStore.add(certificates)
+
+    def encrypt(self, plaintext, keyID):
+        try:
+            return openpgp.encryptMessage(plaintext.encode('utf-8'), [self.__getCertificate(keyID)])
+        except openpgp.UnsupportedError as e:
+            self.logger.debug('Falling back on [{}] to encrypt for [{}] : [{}]'.format(self.fallback.name, keyID, e))
+            return self.fallback.encrypt(plaintext, keyID)
+        except openpgp.OpenPGPError as e:
+            raise CryptoError('Failed to encrypt for key [{}] : [{}]'.format(keyID, e))
+
+    """
+    Encrypt the plaintext once, and wrap its session key for each of the keys.
+    Returns a map of key ID -> armored message.
+    """
+    def encryptShared(self, plaintext, keyIDs):
+        certificates = [self.__getCertificate(keyID) for keyID in keyIDs]
+        return dict(zip(keyIDs, openpgp.encryptMessages(plaintext.encode('utf-8'), certificates)))
+
+    def decrypt(self, ciphertext):
+        try:
+            return openpgp.decryptMessage(ciphertext, self.keyStore).decode('utf-8')
+        except openpgp.UnsupportedError as e:
+            self.logger.debug('Falling back on [{}] to decrypt : [{}]'.format(self.fallback.name, e))
+            return self.fallback.decrypt(ciphertext)
+        except openpgp.OpenPGPError as e:
+            raise CryptoError('Failed to decrypt message : [{}]'.format(e))
+
+
+class CryptoService:
+    """
+    Encrypts and decrypts secrets using the keyring of the KeyringManager, through the backend selected by the
+    "backend" crypto parameter : "gnupg" (default) or "openpgp" for in-process cryptography.
+
+    Operations are run by a pool of workers so that encrypting a secret for a large group of users is spread across
+    every available core. With the gnupg backend, every operation still starts its own gpg process : the workers only
+    allow several of them to run at once. Encryptions for several keys are batched in a single gpg call by
+    #encryptMany, unless the session key is not shared.
+    """
+
+    logger = logging.getLogger('CryptoService')
+
+    def __init__(self, configManager, keyringManager):
+        self.configManager = configManager
+        self.keyringManager = keyringManager
+
+        cryptoConfig = self.configManager.parameters().get('crypto', {})
+        self.workers = cryptoConfig.get('workers') or os.cpu_count() or 1
+        self.sharedSessionKey = cryptoConfig.get('shared-session-key', True)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crypto')
+        self.backend = self.__createBackend(cryptoConfig.get('backend', GnuPGBackend.name))
+        self.logger.debug('Using the [{}] backend with [{}] crypto workers'.format(self.backend.name, self.workers))
+
+    def __createBackend(self, backendName):
+        gnupgBackend = GnuPGBackend(self.keyringManager.keyring)
+        if backendName == GnuPGBackend.name:
+            return gnupgBackend
+        elif backendName == OpenPGPBackend.name:
+            return OpenPGPBackend(self.configManager, self.keyringManager, gnupgBackend)
+        else:
+            raise ValueError('Unknown crypto backend [{}].'.format(backendName))
+
+    def encrypt(self, plaintext, keyID):
+        with metrics.registry.timer('crypto_operation_duration_seconds', operation='encrypt',
+                                    backend=self.backend.name):
+            return self.backend.encrypt(plaintext, keyID)
+
+    def decrypt(self, ciphertext):
+        with metrics.registry.timer('crypto_operation_duration_seconds', operation='decrypt',
+                                    backend=self.backend.name):
+            return self.backend.decrypt(ciphertext)
+
+    """
+    Encrypt the same plaintext for each of the given keys.
+    Returns a map of key ID -> armored message.
+
+    Unless the "shared-session-key" crypto parameter is disabled, the plaintext is symmetrically encrypted only once,
+    and each message only differs by its session key packet. Otherwise, each key gets a fully separate encryption.
+    """
+    def encryptMany(self, plaintext, keyIDs):
+        keyIDs = list(keyIDs)
+        if self.sharedSessionKey and len(keyIDs) > 1:
+            try:
+                with metrics.registry.timer('crypto_operation_duration_seconds', operation='encrypt-shared',
+                                            backend=self.backend.name):
+                    return self.backend.encryptShared(plaintext, keyIDs)
+            except openpgp.UnsupportedError as e:
+                self.logger.debug('Encrypting separately for each key : [{}]'.format(e))
+
+        messages = self.executor.map(lambda keyID: self.encrypt(plaintext, keyID), keyIDs)
+        return dict(zip(keyIDs, messages))
+
+    """
+    Decrypt each of the given messages.
+    Returns the list of plaintexts, in the same order as the messages.
+    """
+    def decryptMany(self, ciphertexts):
+        return list(self.executor.map(self.decrypt, ciphertexts))
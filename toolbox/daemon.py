@@ -0,0 +1,397 @@
+import argparse
+import json
+import logging
+import metrics
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+
+from configuration import Environment
+from datetime import datetime
+from datetime import timedelta
+from index import ResourceIndex
+from renew import RenewHelper
+
+"""
+Long-running renewal process.
+
+The daemon authenticates once and keeps its session, its directory of users and groups, its keyring and its resource
+index in memory. Instead of renewing every resource at once, it renews resources progressively, following the rotation
+policy of their connector : resources whose password is older than the maximum age of the policy are renewed, at most
+at the rate defined by the policy.
+
+A control socket allows to query the status of the daemon, to renew resources on demand, or to stop the daemon.
+"""
+
+
+class RotationPolicy:
+    """Maximum age of the passwords of a connector, and rate at which they can be renewed."""
+
+    """
+    @param alias : the alias of the connector
+    @param maxAge : the number of days after which a password needs to be renewed
+    @param rate : the maximum number of passwords renewed per minute
+    """
+    def __init__(self, alias, maxAge, rate):
+        self.alias = alias
+        self.maxAge = timedelta(days=maxAge)
+        self.rate = rate
+        # Renewals can be spread over time, but never burst above one minute worth of renewals
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.lastRefill = time.monotonic()
+
+    """
+    Returns the number of renewals that can be started now, out of the given number of candidates.
+    """
+    def take(self, candidates):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.rate / 60)
+        self.lastRefill = now
+
+        allowed = min(candidates, int(self.tokens))
+        self.tokens -= allowed
+        return allowed
+
+
+class RenewalDaemon:
+    logger = logging.getLogger('RenewalDaemon')
+
+    def __init__(self, configManager, keyringManager, cryptoService, passboltServer):
+        self.configManager = configManager
+        self.passboltServer = passboltServer
+        self.renewHelper = RenewHelper(configManager, keyringManager, cryptoService, passboltServer)
+
+        daemonConfig = self.configManager.parameters().get('daemon', {})
+        self.tickInterval = daemonConfig.get('tick-interval', 60)
+        self.syncInterval = daemonConfig.get('sync-interval', 300)
+        self.directoryRefreshInterval = daemonConfig.get('directory-refresh-interval', 3600)
+        self.retryDelay = daemonConfig.get('retry-delay', 3600)
+        self.socketPath = daemonConfig.get('socket') or Environment.daemonSocketPath
+
+        indexConfig = self.configManager.parameters().get('index', {})
+        self.index = ResourceIndex(self.passboltServer, fullSyncInterval=indexConfig.get('full-sync-interval', 7))
+        self.policies = self.__buildPolicies()
+
+        # On-demand renewals received on the control socket
+        self.requests = queue.Queue()
+        self.stopped = threading.Event()
+        # Resource ID -> time before which the renewal of the resource is not attempted again
+        self.retryTimes = {}
+        self.lastSync = None
+        self.lastDirectoryRefresh = None
+        self.startTime = time.time()
+        # Connector alias -> number of resources due at the last tick
+        self.dueCounts = {}
+        self.totals = {'success': 0, 'failures': 0, 'rollback': 0, 'errors': 0}
+
+    def __buildPolicies(self):
+        policies = {}
+        for connectorName, connector in self.configManager.connectors().items():
+            rotation = connector.get('rotation')
+            if rotation:
+                policies[connector['alias']] = RotationPolicy(connector['alias'], rotation.get('max-age', 90),
+                                                              rotation.get('rate', 1))
+                self.logger.info('Renewing [{}] passwords older than [{}] days, at most [{}] per minute'
+                                 .format(connector['alias'], rotation.get('max-age', 90), rotation.get('rate', 1)))
+        return policies
+
+    def run(self, args):
+        self.args = args
+        if not self.passboltServer.authenticate():
+            self.logger.error('Failed to authenticate to the Passbolt server.')
+            return
+
+        if not self.policies:
+            self.logger.warning('No connector has a rotation policy, resources will only be renewed on demand')
+
+        # Stop cleanly when asked to by the service manager, in the same way as with Ctrl+C
+        signal.signal(signal.SIGTERM, signal.getsignal(signal.SIGINT))
+        controlServer = self.__startControlServer()
+        if controlServer is None:
+            return
+
+        self.index.load()
+        try:
+            self.__refresh()
+            # Finish the renewal interrupted when the daemon was last stopped, if any
+            self.__renew(resume=True)
+
+            while not self.stopped.is_set():
+                try:
+                    self.__refresh()
+                    self.__renewDueResources()
+                except KeyboardInterrupt:
+                    raise
+                except Exception as e:
+                    # The server or a service may be temporarily unavailable, try again at the next tick
+                    self.logger.exception('Scheduled renewal failed : [{}]'.format(e))
+                self.__waitForRequests()
+        except KeyboardInterrupt:
+            self.logger.info('Interrupted, stopping the daemon')
+        finally:
+            # Release the clients still waiting for an on-demand renewal
+            while not self.requests.empty():
+                self.requests.get().done.set()
+            controlServer.shutdown()
+            controlServer.server_close()
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
+            if self.index.lastSync is not None:
+                self.index.save()
+
+    """
+    Refresh the directory and synchronize the resource index when they are older than their refresh interval.
+    """
+    def __refresh(self):
+        now = time.monotonic()
+        if self.lastDirectoryRefresh is None or now - self.lastDirectoryRefresh >= self.directoryRefreshInterval:
+            self.passboltServer.ensureAuthenticated()
+            self.passboltServer.reloadDirectory()
+            self.lastDirectoryRefresh = now
+
+        if self.lastSync is None or now - self.lastSync >= self.syncInterval:
+            self.passboltServer.ensureAuthenticated()
+            self.index.sync()
+            self.lastSync = now
+
+    """
+    Returns a map of connector alias -> resources of this connector that need to be renewed, oldest first.
+    """
+    def __dueResources(self):
+        catalog = self.index.catalog
+        now = datetime.now()
+        monotonicNow = time.monotonic()
+
+        self.passboltServer.fetchCurrentUserGroups()
+        candidateIDs = catalog.writableBy(self.passboltServer.cachedUserID, self.passboltServer.cachedGroupIDs)
+        if self.args.group:
+            groupIDs = [x['Group']['id'] for x in self.passboltServer.resolveGroupsByName(self.args.group)]
+            candidateIDs &= catalog.sharedWithGroups(groupIDs)
+        candidateIDs -= set(resourceID for resourceID, retryTime in self.retryTimes.items() if retryTime > monotonicNow)
+
+        dueResources = {}
+        for connectorType, policy in self.policies.items():
+            dueIDs = catalog.neverUpdated() | catalog.updatedBetween(before=now - policy.maxAge)
+            resources = catalog.resolve(candidateIDs & catalog.withConnector(connectorType) & dueIDs)
+            if resources:
+                dueResources[connectorType] = resources
+        return dueResources
+
+    def __renewDueResources(self):
+        dueResources = self.__dueResources()
+        self.dueCounts = {connectorType: len(resources) for connectorType, resources in dueResources.items()}
+
+        selectedIDs = []
+        for connectorType, resources in dueResources.items():
+            allowed = self.policies[connectorType].take(len(resources))
+            self.logger.debug('[{}] resources of connector [{}] are due, renewing [{}] of them'
+                              .format(len(resources), connectorType, allowed))
+            selectedIDs += [x['Resource']['id'] for x in resources[:allowed]]
+
+        if selectedIDs:
+            self.__renew(resourceIDs=selectedIDs)
+
+    """
+    Wait for on-demand renewals until the next tick.
+    """
+    def __waitForRequests(self):
+        deadline = time.monotonic() + self.tickInterval
+        while not self.stopped.is_set():
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                return
+
+            if not request.resourceIDs:
+                request.done.set()
+                continue
+            try:
+                request.result = self.__renew(resourceIDs=request.resourceIDs)
+            except KeyboardInterrupt:
+                raise
+            except Exception as e:
+                self.logger.exception('On-demand renewal failed : [{}]'.format(e))
+                request.result = {'error': str(e)}
+            finally:
+                request.done.set()
+
+    """
+    Renew the given resources, or finish the last renewal if it has been interrupted.
+    Returns the number of renewed resources by result.
+    """
+    def __renew(self, resourceIDs=None, resume=False):
+        self.passboltServer.ensureAuthenticated()
+        args = argparse.Namespace(personal=False, group=None, resources=resourceIDs or [], resume=resume,
+                                  before=None, after=None, limit=0, workers=self.args.workers,
+                                  mailReportRecipient=None, dryRun=self.args.dryRun)
+        # The metrics reported at the end of a renewal only cover this renewal, as they would for a single run
+        metrics.registry.reset()
+        renewalStats = self.renewHelper.renew(args)
+        if self.renewHelper.interrupted:
+            raise KeyboardInterrupt()
+        if renewalStats is None:
+            return {}
+
+        retryTime = time.monotonic() + self.retryDelay
+        renewedIDs = set()
+        for category, items in renewalStats['items'].items():
+            self.totals[category] += len(items)
+            for item in items:
+                resource = item['resource']
+                if category == 'success' and not self.args.dryRun:
+                    # Keep the index up to date until the next synchronization fetches the resource again
+                    self.index.update(resource)
+                    self.retryTimes.pop(resource['Resource']['id'], None)
+                    renewedIDs.add(resource['Resource']['id'])
+                else:
+                    self.retryTimes[resource['Resource']['id']] = retryTime
+
+        # Resources that could not be fetched have been deleted, or are not shared with the user anymore
+        for resourceID in self.renewHelper.missingResourceIDs:
+            self.index.remove(resourceID)
+        # Selected resources may also not have been renewed without any result (skipped, or not updatable anymore).
+        # They are not selected again before the retry delay, so that they do not take the place of due resources
+        for resourceID in resourceIDs or []:
+            if resourceID not in renewedIDs:
+                self.retryTimes[resourceID] = retryTime
+        self.index.save()
+        return {category: len(items) for category, items in renewalStats['items'].items()}
+
+    def status(self):
+        return {
+            'startTime': datetime.fromtimestamp(self.startTime).isoformat(),
+            'indexedResources': len(self.index.catalog),
+            'lastSync': self.index.lastSync.isoformat() if self.index.lastSync else None,
+            'dueResources': self.dueCounts,
+            'pendingRetries': len([x for x in list(self.retryTimes.values()) if x > time.monotonic()]),
+            'renewedResources': self.totals
+        }
+
+    def __startControlServer(self):
+        if os.path.exists(self.socketPath):
+            # Make sure that no other daemon is running before taking over its socket
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as clientSocket:
+                    clientSocket.connect(self.socketPath)
+                self.logger.error('Another daemon is already listening on [{}].'.format(self.socketPath))
+                return None
+            except ConnectionRefusedError:
+                os.remove(self.socketPath)
+
+        # The socket is created with restricted permissions, so that it is never reachable by other users, even
+        # between its creation and a chmod
+        previousUmask = os.umask(0o177)
+        try:
+            controlServer = ControlServer(self.socketPath, self)
+        finally:
+            os.umask(previousUmask)
+        threading.Thread(target=controlServer.serve_forever, name='daemon-control', daemon=True).start()
+        self.logger.info('Listening for commands on [{}]'.format(self.socketPath))
+        return controlServer
+
+    def requestRenewal(self, resourceIDs):
+        request = RenewalRequest(resourceIDs)
+        self.requests.put(request)
+        return request
+
+    def stop(self):
+        self.stopped.set()
+        # Wake up the scheduler
+        self.requests.put(RenewalRequest([]))
+
+
+class RenewalRequest:
+    """On-demand renewal, waiting to be processed by the scheduler of the daemon."""
+
+    def __init__(self, resourceIDs):
+        self.resourceIDs = resourceIDs
+        self.done = threading.Event()
+        self.result = None
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """
+    Handles the commands sent to the control socket. Each command is a JSON object on a single line, answered with a
+    JSON object on a single line :
+    * {"action": "status"}
+    * {"action": "renew", "resources": ["<resource ID>", ...]}, answered once the resources have been renewed
+    * {"action": "stop"}
+    """
+
+    def handle(self):
+        daemon = self.server.daemon
+        line = self.rfile.readline()
+        if not line:
+            # The client closed the connection without sending anything, as done to check if the daemon is running
+            return
+
+        try:
+            command = json.loads(line.decode('utf-8'))
+            if command.get('action') == 'status':
+                response = daemon.status()
+            elif command.get('action') == 'renew' and command.get('resources'):
+                request = daemon.requestRenewal(command['resources'])
+                request.done.wait()
+                response = ({'renewedResources': request.result} if request.result is not None
+                            else {'error': 'The daemon has been stopped before renewing the resources'})
+            elif command.get('action') == 'stop':
+                daemon.stop()
+                response = {'stopping': True}
+            else:
+                response = {'error': 'Invalid command [{}]'.format(command)}
+        except ValueError as e:
+            response = {'error': 'Invalid command : [{}]'.format(e)}
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socketPath, daemon):
+        super(ControlServer, self).__init__(socketPath, ControlHandler)
+        self.daemon = daemon
+
+
+class DaemonClient:
+    """Sends the commands given on the command line to the running daemon."""
+
+    logger = logging.getLogger('DaemonClient')
+
+    def __init__(self, configManager):
+        daemonConfig = configManager.parameters().get('daemon', {})
+        self.socketPath = daemonConfig.get('socket') or Environment.daemonSocketPath
+
+    """
+    Returns the exit status of the command.
+    """
+    def run(self, args):
+        if args.status:
+            command = {'action': 'status'}
+        elif args.stop:
+            command = {'action': 'stop'}
+        else:
+            command = {'action': 'renew', 'resources': args.renewResources}
+
+        try:
+            response = self.send(command)
+        except (FileNotFoundError, ConnectionRefusedError):
+            self.logger.error('The daemon is not running (no socket listening on [{}]).'.format(self.socketPath))
+            return 1
+
+        print(json.dumps(response, indent=2))
+        return 1 if 'error' in response else 0
+
+    def send(self, command):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as clientSocket:
+            clientSocket.connect(self.socketPath)
+            clientSocket.sendall((json.dumps(command) + '\n').encode('utf-8'))
+            with clientSocket.makefile('rb') as responseFile:
+                return json.loads(responseFile.readline().decode('utf-8'))
@@ -0,0 +1,156 @@
+import logging
+import threading
+
+from metadatacache import MetadataCache
+
+"""
+In-memory directory of the users and groups of a Passbolt server.
+
+Users and groups are fetched in bulk once per run, and then resolved locally by ID instead of calling the API for
+every resource that needs to be encrypted for a set of users. Unless parameters.metadata-cache is disabled, they are
+loaded through a MetadataCache, so that only the public keys modified since the previous run are downloaded.
+"""
+
+
+class Directory:
+    logger = logging.getLogger('Directory')
+
+    def __init__(self, passboltServer):
+        self.passboltServer = passboltServer
+        self.lock = threading.Lock()
+        self.loaded = False
+
+        # User ID -> user JSON, including its Profile and its Gpgkey
+        self.usersByID = {}
+        # Group ID -> group JSON
+        self.groupsByID = {}
+        # Group ID -> IDs of the users in the group
+        self.groupMemberIDs = {}
+        # Lowered group name -> group ID
+        self.groupIDsByName = {}
+        self.currentUserID = None
+
+        cacheConfig = passboltServer.configManager.parameters().get('metadata-cache', {})
+        self.cache = (MetadataCache(passboltServer, maxKeys=cacheConfig.get('max-keys', 5000))
+                      if cacheConfig.get('enabled', True) else None)
+
+    """
+    Fetch every user (with their public key) and every group (with their members) from the server.
+    """
+    def load(self):
+        if self.cache is not None:
+            if self.cache.lastSync is None:
+                self.cache.load()
+            self.cache.revalidate()
+            self.cache.save()
+            users = self.cache.users()
+            groups = self.cache.groups()
+        else:
+            api = self.passboltServer.api
+            users = api.users.get()
+            groups = [(x['Group'], [y['user_id'] for y in x.get('GroupUser', [])])
+                      for x in api.groups.get(params={'contain[group_user]': 1})]
+
+        with self.lock:
+            self.usersByID = {}
+            self.groupsByID = {}
+            self.groupMemberIDs = {}
+            self.groupIDsByName = {}
+
+            for user in users:
+                self.__addUser(user)
+
+            for group, memberIDs in groups:
+                self.__addGroup(group, memberIDs)
+
+            self.loaded = True
+
+        self.logger.info('Loaded [{}] users and [{}] groups from the server'
+                         .format(len(self.usersByID), len(self.groupsByID)))
+
+    def __addUser(self, user):
+        self.usersByID[user['User']['id']] = user
+        # Users whose key has been evicted from the metadata cache are loaded without their key
+        if user.get('Gpgkey', {}).get('fingerprint') == self.passboltServer.configManager.user()['fingerprint']:
+            self.currentUserID = user['User']['id']
+
+    def __addGroup(self, group, memberIDs):
+        self.groupsByID[group['id']] = group
+        self.groupMemberIDs[group['id']] = memberIDs
+        if not group.get('deleted', False):
+            self.groupIDsByName[group['name'].lower()] = group['id']
+
+    """
+    Register a group that has been created after the directory was loaded.
+    """
+    def addGroup(self, group, memberIDs):
+        with self.lock:
+            self.__addGroup(group, memberIDs)
+
+    """
+    Returns the user with the given ID, with its Gpgkey. Users created after the directory was loaded, or whose key
+    is not in the metadata cache, are fetched from the server.
+    """
+    def getUser(self, userID):
+        user = self.usersByID.get(userID)
+        if user is None or 'Gpgkey' not in user:
+            self.logger.debug('User [{}] or its key is not in the directory, fetching it'.format(userID))
+            user = self.passboltServer.api.users.get(userID)
+            with self.lock:
+                self.__addUser(user)
+                if self.cache is not None:
+                    self.cache.putKey(userID, user['Gpgkey'])
+        elif self.cache is not None:
+            self.cache.markKeyUsed(userID)
+        return user
+
+    """
+    Save the keys fetched and used during the run in the metadata cache.
+    """
+    def saveCache(self):
+        if self.cache is not None:
+            with self.lock:
+                self.cache.save()
+
+    """
+    Returns the users whose public key is known, without fetching the missing keys.
+    """
+    def usersWithKeys(self):
+        with self.lock:
+            return [x for x in self.usersByID.values() if 'Gpgkey' in x]
+
+    def getGroup(self, groupID):
+        return self.groupsByID.get(groupID)
+
+    def getGroupIDByName(self, groupName):
+        return self.groupIDsByName.get(groupName.lower())
+
+    def getGroupMemberIDs(self, groupID):
+        memberIDs = self.groupMemberIDs.get(groupID)
+        if memberIDs is None:
+            self.logger.debug('Group [{}] is not in the directory, fetching it'.format(groupID))
+            group = self.passboltServer.api.groups.get(groupID)
+            memberIDs = [x['user_id'] for x in group['GroupUser']]
+            self.addGroup(group['Group'], memberIDs)
+        return memberIDs
+
+    """
+    Returns the IDs of the groups the given user is a member of.
+    """
+    def getUserGroupIDs(self, userID):
+        return [groupID for groupID, memberIDs in self.groupMemberIDs.items() if userID in memberIDs]
+
+    """
+    Returns a map of user ID -> user JSON for every user being part of the given groups, or directly given.
+    """
+    def resolveRecipients(self, groupIDs, userIDs):
+        recipients = {}
+        for groupID in groupIDs:
+            for userID in self.getGroupMemberIDs(groupID):
+                recipients[userID] = self.getUser(userID)
+
+        for userID in userIDs:
+            # The user might also be in a group, in that case, it's useless to add it twice
+            if userID not in recipients:
+                recipients[userID] = self.getUser(userID)
+        return recipients
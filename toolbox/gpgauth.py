@@ -1,19 +1,54 @@
+import hashlib
+import logging
 import os
+import tempfile
+import threading
 
 from http.cookiejar import MozillaCookieJar
 
+from configuration import Environment
 from requests_gpgauthlib import GPGAuthSession
-
-from requests_gpgauthlib.utils import get_workdir
+from requests_gpgauthlib.gpgauth_api import check_session_is_valid
+from requests_gpgauthlib.exceptions import GPGAuthException
 
 """
 Wraps the GPGAuthSession provided by the gpgauthlib package to allow
 requests to be sent to the Passbolt instance with an incomplete certificate (verify=False)
+
+The cookies of the session are kept between runs, so that a session opened by a previous run can be re-used as long as
+it is valid on the server, instead of going through the whole GPGAuth handshake again.
 """
 
 
+class SessionCookieJar(MozillaCookieJar):
+    """Cookie jar only readable by the current user, and not saved at all if it has no file."""
+
+    lock = threading.Lock()
+
+    def save(self, filename=None, ignore_discard=False, ignore_expires=False):
+        filename = filename or self.filename
+        if filename is None:
+            return
+
+        # Write the cookies atomically, in a file that is never readable by other users
+        with self.lock:
+            fileDescriptor, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.cookies-')
+            os.close(fileDescriptor)
+            try:
+                super(SessionCookieJar, self).save(temporaryPath, ignore_discard, ignore_expires)
+                os.replace(temporaryPath, filename)
+            except BaseException:
+                os.remove(temporaryPath)
+                raise
+
+
 class GPGAuthSessionWrapper(GPGAuthSession):
-    def __init__(self, gpg, server_url, user_fingerprint, verify, **kwargs):
+    logger = logging.getLogger('GPGAuthSessionWrapper')
+
+    """
+    @param cookieFile : the file in which the cookies of the session are kept between runs, None to not keep them
+    """
+    def __init__(self, gpg, server_url, user_fingerprint, verify, cookieFile=None, **kwargs):
         # Skip GPGAuthSession.__init__
         super(GPGAuthSession, self).__init__(**kwargs)
 
@@ -24,9 +59,56 @@ class GPGAuthSessionWrapper(GPGAuthSession):
         self.user_specified_fingerprint = user_fingerprint
         self.verify = verify
 
-        self._cookie_filename = os.path.join(get_workdir(), 'gpgauth_session_cookies')
-        self.cookies = MozillaCookieJar(self._cookie_filename)
-        try:
-            self.cookies.load(ignore_discard=True)
-        except FileNotFoundError:
-            pass
+        self._cookie_filename = cookieFile
+        self.cookies = SessionCookieJar(self._cookie_filename)
+        if cookieFile:
+            try:
+                self.cookies.load(ignore_discard=True)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning('Ignoring the invalid session file [{}] : [{}]'.format(cookieFile, e))
+
+    """
+    Returns the file in which the session of the given user on the given server is kept. Sessions are kept apart for
+    each server and user, so that a session is never re-used with another configuration.
+    """
+    @staticmethod
+    def cookieFilePath(serverURL, userFingerprint):
+        sessionKey = '{}|{}'.format(serverURL.rstrip('/'), userFingerprint).encode('utf-8')
+        return '{}/{}.cookies'.format(Environment.sessionsDir, hashlib.sha256(sessionKey).hexdigest()[:32])
+
+    """
+    Builds the session of the configured user on the configured server. The session is kept between runs unless
+    parameters.session.reuse is disabled.
+    """
+    @classmethod
+    def forConfiguration(cls, configManager, keyring):
+        server = configManager.server()
+        userFingerprint = configManager.user()['fingerprint']
+        cookieFile = None
+        if configManager.parameters().get('session', {}).get('reuse', True):
+            cookieFile = cls.cookieFilePath(server['uri'], userFingerprint)
+        return cls(gpg=keyring, server_url=server['uri'], user_fingerprint=userFingerprint,
+                   verify=server['verifyCert'], cookieFile=cookieFile)
+
+    """
+    Returns True if the session kept from a previous run is still valid on the server, at the cost of one request.
+    """
+    def isSessionValid(self):
+        return check_session_is_valid(self)
+
+    """
+    Re-use the session kept from a previous run if it is still valid, or open a new one with the GPGAuth handshake.
+    The identity of the server is verified against the given fingerprint before opening a new session.
+    """
+    def resumeOrAuthenticate(self, serverFingerprint):
+        if self.isSessionValid():
+            self.logger.info('Re-using the session opened by a previous run')
+            return True
+
+        self.cookies.clear()
+        if self.server_fingerprint != serverFingerprint:
+            raise GPGAuthException('The server fingerprint [{}] does not match the configured fingerprint [{}].'
+                                   .format(self.server_fingerprint, serverFingerprint))
+        return self.authenticate()
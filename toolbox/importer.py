@@ -1,148 +1,502 @@
 import csv
 import json
 import logging
+import threading
 
+from collections import Counter
+
+from catalog import splitPermissions
+from keyring import KeyImportError
+from manifest import IDENTITY_COLUMNS
+from manifest import STATE_CREATED
+from manifest import STATE_IMPORTED
+from manifest import ImportManifest
 from passboltapi.meta import PassboltAPIError
+from pipeline import Pipeline
+
+"""
+Import of resources from a CSV file, each line being : name, username, password, uri, description, group.
+
+Lines are read one by one and streamed through a pipeline of stages connected by bounded queues, so that the memory
+used by the import does not depend on the size of the file, and the plaintext password of a line is dropped as soon
+as its resource has been created and shared. Resources are created and shared by [--workers] concurrent workers.
+
+Imported lines are recorded in an ImportManifest, so that importing the same file again only sends the new and the
+changed lines to the server.
+
+The file is read a first time, without keeping any password, to plan the import : lines are counted by action and by
+group, so that the groups can be created and their members and keys resolved once, before the first line is imported.
+"""
+
+CSV_COLUMNS = ['name', 'username', 'password', 'uri', 'description', 'group']
+
+# Actions planned for a line of the CSV file
+ACTION_INVALID = 'invalid'
+ACTION_DUPLICATE = 'duplicate'
+ACTION_EXISTS = 'exists'
+ACTION_UNCHANGED = 'unchanged'
+ACTION_CREATE = 'create'
+ACTION_UPDATE = 'update'
+ACTION_SHARE = 'share'
+# Actions sending the line to the server
+WRITE_ACTIONS = [ACTION_CREATE, ACTION_UPDATE, ACTION_SHARE]
+
+
+class ImportTask:
+    """Line of the CSV file going through the import pipeline."""
+
+    def __init__(self, lineNumber, row):
+        self.lineNumber = lineNumber
+        self.row = row
+        # Map of CSV column -> value, set once the line has been validated
+        self.resource = None
+        self.resourceID = None
+        self.groupID = None
+        # Values of the identity columns of the line, number of lines with the same identity earlier in the file, and
+        # hash of its content, see ImportManifest
+        self.identity = None
+        self.occurrence = 0
+        self.contentHash = None
+        # ID of the resource created for this line by a previous import, when the line changed since then
+        self.previousResourceID = None
+        # IDs of the users already having the secret of the resource, that it does not need to be shared with
+        self.sharedUserIDs = set()
+        # User ID -> password encrypted for the members of the group, when encrypted along the password of the owner
+        self.groupMessages = None
+
+    def dropSecret(self):
+        self.row = None
+        self.groupMessages = None
+        if self.resource is not None:
+            self.resource['password'] = None
+
+
+class ImportPlan:
+    """Summary of the lines of a CSV file to import, computed before anything is sent to the server."""
+
+    def __init__(self):
+        self.lines = 0
+        # Action -> number of lines
+        self.actions = Counter()
+        # Group name -> (action -> number of lines), for the lines sent to the server
+        self.groupActions = {}
+        # Names of the groups missing on the server
+        self.missingGroups = []
+
+    def addLine(self, action, groupName):
+        self.lines += 1
+        self.actions[action] += 1
+        if action in WRITE_ACTIONS and groupName:
+            self.groupActions.setdefault(groupName, Counter())[action] += 1
 
 
 class ImportHelper:
-    logger = logging.getLogger('RenewHelper')
+    logger = logging.getLogger('ImportHelper')
+    # Number of processed lines between two progress reports
+    progressInterval = 100
 
-    def __init__(self, configManager, keyringManager, passboltServer):
+    def __init__(self, configManager, keyringManager, cryptoService, passboltServer):
         self.configManager = configManager
         self.keyringManager = keyringManager
+        self.cryptoService = cryptoService
         self.passboltServer = passboltServer
-
-        self.cachedUserID = None
-
-        self.groups = None
-        self.groupNames = None
+        self.directory = passboltServer.directory
 
     def run(self, args):
         # First try to authenticate
-        if self.passboltServer.api.authenticate(self.keyringManager.keyring,
-                                                self.configManager.user()['fingerprint'],
-                                                self.configManager.server()['fingerprint']):
-            # Parse the CSV
-            csvResources = []
-            with open(args.file) as csvFile:
-                spamReader = csv.reader(csvFile, delimiter=',')
-                for row in spamReader:
-                    self.logger.debug('Registering entry {}'.format(row))
-                    csvResources.append({
-                        'name': row[0],
-                        'username': row[1],
-                        'password': row[2],
-                        'uri': row[3],
-                        'description': row[4],
-                        'group': row[5]
-                    })
-
-            # Get a list of existing groups
-            self.groups = self.passboltServer.api.groups.get()
-            self.__generateGroupNames()
-
-            if args.skipIfExists:
-                # Get a list of existing resources
-                existingResources = self.passboltServer.api.resources.get()
-                existingResourcesNames = [r['Resource']['Name'] for r in existingResources]
-
-                resources = []
-                for resource in csvResources:
-                    if resource['name'] not in existingResourcesNames:
-                        resources.append(resource)
-                    else:
-                        self.logger.info('Skipping resource [{}] as it is already on the server'
-                                         .format(resource['name']))
-            else:
-                resources = csvResources
-
-            # For each line, we have the ressource, a name that can be computed, a password, a username, an url
-            # and a description
-
-            for resource in resources:
-                # Check if the group of the resource exists or not
-                if resource['group'] and resource['group'] not in self.groupNames and args.autoCreateGroups:
-                    # We need to create a group
-                    groupExists = self.__createGroup(resource['group'], args)
-                else:
-                    groupExists = args.autoCreateGroups
-
-                if groupExists:
-                    resourceID = self.__createResource(resource)
-
-                    # Resolve users in the given groups
-                    # TODO : Add group cache
-                    groupID = self.__getGroupIDFromName(resource['group'])
-                    if groupID:
-                        group = self.passboltServer.api.groups.get(groupID)
-                        self.keyringManager.maybeImportGroupUsers(group['GroupUser'])
-                        resourceUsersMap = {}
-                        for groupUser in group['GroupUser']:
-                            resourceUsersMap[groupUser['User']['id']] = groupUser['User']['Gpgkey']['key_id']
-
-                        # We now have a map of user IDs with their key ID, that way we can proceed to
-                        # the encryption of the new password.
-                        secretsPayload = []
-                        for userID in resourceUsersMap.keys():
-                            # Encrypt the password for the new group users
-                            # We don't need to encrypt using our key
-                            if userID != self.__getCurrentUserID():
-                                userKeyID = resourceUsersMap[userID]
-                                self.logger.debug('Encrypting password for user [{}] ({})'.format(userID, userKeyID))
-                                secretsPayload.append({
-                                    'user_id': userID,
-                                    'resource_id': resourceID,
-                                    'data': self.keyringManager.keyring.encrypt(resource['password'], userKeyID)
-                                                .data.decode('utf-8')
-                                })
-
-                        # Share with a group with type "Manage"
-                        # TODO: Be able to customize the share type :
-                        # 1 : Read only
-                        # 7 : Read / Write
-                        # 15 : Manage
-                        if not self.__shareResource(resourceID, groupID, 15, secretsPayload):
-                            self.logger.error('Failed to share resource [{}] ({}) with group [{}] ({})'
-                                              .format(resource['name'], resourceID, resource['group'], groupID))
-                    else:
-                        self.logger.error('Error while retrieving the group to share the resource with.')
-                elif not args.autoCreateGroups:
-                    self.logger.warning('Skipping resource [{}] as group [{}] is not already present on the server.'
-                                        .format(resource['name'], resource['group']))
-                else:
-                    self.logger.error('Error while creating the group [{}]. Skipping resource [{}].'
-                                      .format(resource['group'], resource['name']))
-
+        if not self.passboltServer.authenticate():
+            self.logger.error('Failed to authenticate to the Passbolt server.')
+            return
+
+        # Each worker of the create and share stages sends its own requests
+        self.passboltServer.transport.ensurePoolSize(2 * args.workers + 1)
+
+        # Get the existing users and groups
+        self.directory.load()
+        self.keyringManager.maybeImportUsers(self.directory.usersWithKeys())
+
+        self.args = args
+        self.importStats = {'lines': 0, 'imported': 0, 'skipped': 0, 'failures': 0}
+        self.statsLock = threading.Lock()
+        self.identityColumns = IDENTITY_COLUMNS[args.identity]
+        self.currentUserID = self.__getCurrentUserID()
+        self.userFingerprint = self.configManager.user()['fingerprint']
+        # Identities of the resources on the server, only listed with --skip-if-exists, once a line that has never
+        # been imported has to be checked
+        self.serverIdentities = None
+        # Group ID -> map of user ID -> key fingerprint of the members of the group, without the current user
+        self.groupRecipients = {}
+        # Names of the groups that could not be created, or whose members cannot be encrypted for
+        self.failedGroups = set()
+
+        # Nothing is written with --plan, not even the manifest
+        self.manifest = ImportManifest.forImport(self.configManager, args.file)
+        self.manifest.open(readOnly=args.plan)
+        try:
+            plan = self.__planImport()
+            if args.plan:
+                self.__printPlan(plan)
                 return
+            self.__prepareGroups(plan)
+            self.__runPipeline()
+        finally:
+            self.manifest.close()
+
+        # Keep the keys fetched during the import for the next runs
+        self.directory.saveCache()
+        self.logger.info('Import finished : [{lines}] lines read, [{imported}] resources imported, '
+                         '[{skipped}] skipped, [{failures}] failed'.format(**self.importStats))
+
+    """
+    Read the whole file, without keeping the passwords, and count its lines by action and by group.
+    """
+    def __planImport(self):
+        plan = ImportPlan()
+        self.identityCounts = Counter()
+        with open(self.args.file, newline='') as csvFile:
+            for lineNumber, row in enumerate(csv.reader(csvFile, delimiter=','), start=1):
+                task = ImportTask(lineNumber, row)
+                action = self.__classifyTask(task)
+                plan.addLine(action, task.resource['group'] if task.resource else None)
+
+        plan.missingGroups = sorted(x for x in plan.groupActions if self.directory.getGroupIDByName(x) is None)
+        self.logger.info('Planned the import of [{}] lines : [{}] to create, [{}] to update, [{}] to share, '
+                         '[{}] to skip'.format(plan.lines, plan.actions[ACTION_CREATE], plan.actions[ACTION_UPDATE],
+                                               plan.actions[ACTION_SHARE],
+                                               plan.lines - sum(plan.actions[x] for x in WRITE_ACTIONS)))
+        return plan
+
+    """
+    Create the missing groups of the plan (with --auto-create-groups), then resolve the members of each group and
+    import their keys, once for all the lines of the group.
+    """
+    def __prepareGroups(self, plan):
+        if self.args.autoCreateGroups:
+            for groupName in plan.missingGroups:
+                if not self.__createGroup(groupName, self.args):
+                    self.logger.error('Error while creating the group [{}], its [{}] lines will not be imported'
+                                      .format(groupName, sum(plan.groupActions[groupName].values())))
+                    self.failedGroups.add(groupName)
+
+        for groupName in plan.groupActions:
+            groupID = self.directory.getGroupIDByName(groupName)
+            if groupID is None or groupName in self.failedGroups:
+                continue
+            try:
+                self.groupRecipients[groupID] = self.__resolveGroupRecipients(groupID)
+            except KeyImportError as e:
+                self.logger.error('Error while resolving the members of the group [{}], its [{}] lines will not be '
+                                  'imported : [{}]'.format(groupName, sum(plan.groupActions[groupName].values()), e))
+                self.failedGroups.add(groupName)
+
+    def __resolveGroupRecipients(self, groupID):
+        recipients = self.directory.resolveRecipients([groupID], [])
+        self.keyringManager.importUsers(recipients.values())
+        recipientsMap = {userID: user['Gpgkey']['fingerprint'] for userID, user in recipients.items()}
+        # We don't need to share with ourselves
+        recipientsMap.pop(self.currentUserID, None)
+        return recipientsMap
+
+    """
+    Print the lines of the plan, and the API calls and encryptions expected to import them. Lines to update are
+    counted as shared with their group, as the users that already have access to them are only known once updated.
+    """
+    def __printPlan(self, plan):
+        createdGroups = plan.missingGroups if self.args.autoCreateGroups else []
+        lines = Counter(dict((action, plan.actions[action]) for action in WRITE_ACTIONS))
+        shares = 0
+        messages = 0
+        for groupName, actions in plan.groupActions.items():
+            if groupName in plan.missingGroups and not self.args.autoCreateGroups:
+                # The lines of the missing groups are skipped
+                lines.subtract(actions)
+                continue
+            shares += sum(actions.values())
+            messages += sum(actions.values()) * self.__countGroupRecipients(groupName)
+        # Lines to create and to update are also encrypted for the current user
+        messages += lines[ACTION_CREATE] + lines[ACTION_UPDATE]
+
+        print('Import plan of [{}]'.format(self.args.file))
+        print('  Lines : {} read, {} to create, {} to update, {} to share, {} unchanged since the previous import, '
+              '{} already on the server, {} duplicated, {} invalid, {} in missing groups'
+              .format(plan.lines, lines[ACTION_CREATE], lines[ACTION_UPDATE], lines[ACTION_SHARE],
+                      plan.actions[ACTION_UNCHANGED], plan.actions[ACTION_EXISTS], plan.actions[ACTION_DUPLICATE],
+                      plan.actions[ACTION_INVALID], sum(plan.actions[x] for x in WRITE_ACTIONS) - sum(lines.values())))
+        for groupName, actions in sorted(plan.groupActions.items()):
+            status = ''
+            if groupName in createdGroups:
+                status = ' (to create)'
+            elif groupName in plan.missingGroups:
+                status = ' (missing, lines skipped)'
+            print('  Group [{}]{} : {} lines, {} recipients'
+                  .format(groupName, status, sum(actions.values()), self.__countGroupRecipients(groupName)))
+        print('  Expected API calls : {} group creations, {} resource creations, {} resource updates, {} shares, '
+              '{} resource listings'
+              .format(len(createdGroups), lines[ACTION_CREATE], lines[ACTION_UPDATE], shares,
+                      lines[ACTION_UPDATE] + (0 if self.serverIdentities is None else 1)))
+        print('  Expected encryptions : {} operations, {} messages'.format(sum(lines.values()), messages))
+
+    """
+    Returns the number of members of the given group the passwords are encrypted for, the current user excluded.
+    """
+    def __countGroupRecipients(self, groupName):
+        groupID = self.directory.getGroupIDByName(groupName)
+        if groupID is not None:
+            memberIDs = self.directory.getGroupMemberIDs(groupID)
         else:
-            self.logger.error('Failed to authenticate to the Passbolt server.')
+            # Groups are created with the default admins and members
+            memberIDs = self.args.defaultGroupAdmins + self.args.defaultGroupMembers
+        return len(set(memberIDs) - set([self.currentUserID]))
+
+    def __runPipeline(self):
+        self.identityCounts = Counter()
+        pipeline = self.__buildPipeline()
+        pipeline.start()
+        try:
+            with open(self.args.file, newline='') as csvFile:
+                for lineNumber, row in enumerate(csv.reader(csvFile, delimiter=','), start=1):
+                    if not pipeline.feed(ImportTask(lineNumber, row)):
+                        break
+                    with self.statsLock:
+                        self.importStats['lines'] += 1
+            pipeline.close()
+        except KeyboardInterrupt:
+            self.logger.info('Interrupted, finishing the import of the resources already created, then exiting ...')
+            pipeline.stop()
+            pipeline.close()
+
+    """
+    Each line goes through the following stages :
+    * validate : parse the line, skip it if it has not changed since a previous import, or if a resource with the
+      same identity exists and --skip-if-exists is set, and find the group to share the resource with
+    * create : create the resource, encrypted at once for the current user and the members of the group, or update
+      the resource of a line that changed since a previous import, with [--workers] threads
+    * share : share the resource with the group, with [--workers] threads
+    Groups have all been created and resolved by #__prepareGroups before the pipeline starts. Lines are validated by a
+    single worker, so that duplicated lines are detected in the order of the file.
+    """
+    def __buildPipeline(self):
+        pipelineConfig = self.configManager.parameters().get('pipeline', {})
+        pipeline = Pipeline(queueSize=pipelineConfig.get('queue-size', 16),
+                            reportInterval=pipelineConfig.get('report-interval', 30))
+        pipeline.addStage('validate', self.__validateTask,
+                          workers=1,
+                          cancellable=True,
+                          errorHandler=self.__handleTaskError)
+        pipeline.addStage('create', self.__createTask,
+                          workers=self.args.workers,
+                          cancellable=True,
+                          errorHandler=self.__handleTaskError)
+        pipeline.addStage('share', self.__shareTask,
+                          workers=self.args.workers,
+                          errorHandler=self.__handleTaskError)
+        return pipeline
+
+    """
+    Returns the set of identities of the resources on the server, listed on the first call.
+    """
+    def __fetchServerIdentities(self):
+        if self.serverIdentities is None:
+            # Resources are listed without their secret, and only their identity columns are kept
+            self.serverIdentities = set(tuple(x['Resource'].get(column) or '' for column in self.identityColumns)
+                                        for x in self.passboltServer.streamResources())
+        return self.serverIdentities
+
+    """
+    Parse the line of the given task, and returns the action to take for it. Nothing is logged nor written, as lines
+    are classified both when planning and when importing them.
+    """
+    def __classifyTask(self, task):
+        if len(task.row) < len(CSV_COLUMNS) or not task.row[0]:
+            return ACTION_INVALID
+
+        task.resource = dict(zip(CSV_COLUMNS, task.row))
+        task.identity = [task.resource[column] for column in self.identityColumns]
+        task.contentHash = self.manifest.contentHash(task.row[:len(CSV_COLUMNS)])
+        task.row = None
+
+        # Lines sharing an identity are told apart by their order in the file, so that each one keeps its own resource
+        task.occurrence = self.identityCounts[tuple(task.identity)]
+        self.identityCounts[tuple(task.identity)] += 1
+        if self.args.skipIfExists and task.occurrence > 0:
+            return ACTION_DUPLICATE
+
+        record = self.manifest.get(task.identity, task.occurrence)
+        if record is not None and record['hash'] == task.contentHash:
+            if record['state'] == STATE_IMPORTED:
+                return ACTION_UNCHANGED
+            # The resource has been created by a previous run, interrupted before sharing it
+            task.resourceID = record['resource']
+            return ACTION_SHARE
+        elif record is not None:
+            # The line changed since the previous import, its resource is updated instead of created again
+            task.previousResourceID = record['resource']
+            return ACTION_UPDATE
+        elif self.args.skipIfExists and tuple(task.identity) in self.__fetchServerIdentities():
+            return ACTION_EXISTS
+        return ACTION_CREATE
+
+    def __validateTask(self, task):
+        action = self.__classifyTask(task)
+        resource = task.resource
+        if action == ACTION_INVALID:
+            self.logger.error('Skipping line [{}] : expected the columns [{}]'
+                              .format(task.lineNumber, ', '.join(CSV_COLUMNS)))
+            return self.__skip(task)
+        elif action == ACTION_DUPLICATE:
+            self.logger.info('Skipping resource [{}] as it is already present earlier in the file'
+                             .format(resource['name']))
+            return self.__skip(task)
+        elif action == ACTION_EXISTS:
+            self.logger.info('Skipping resource [{}] as it is already on the server'.format(resource['name']))
+            return self.__skip(task)
+        elif action == ACTION_UNCHANGED:
+            self.logger.debug('Skipping resource [{}] as it has been imported by a previous run'
+                              .format(resource['name']))
+            return self.__skip(task)
+
+        self.logger.debug('Registering entry [{}] from line [{}]'.format(resource['name'], task.lineNumber))
+        if not resource['group']:
+            # The resource is only created for the current user
+            return task
+
+        task.groupID = self.directory.getGroupIDByName(resource['group'])
+        if resource['group'] in self.failedGroups:
+            self.logger.error('Line [{}] : error while preparing the group [{}]. Skipping resource [{}].'
+                              .format(task.lineNumber, resource['group'], resource['name']))
+            return self.__fail(task)
+        elif task.groupID is None:
+            self.logger.warning('Skipping resource [{}] as group [{}] is not already present on the server.'
+                                .format(resource['name'], resource['group']))
+            return self.__skip(task)
+        return task
+
+    def __createTask(self, task):
+        if task.previousResourceID is not None:
+            return self.__updateTask(task)
+
+        if task.resourceID is None:
+            # The password is encrypted for the members of the group along the one of the owner
+            recipients = self.groupRecipients.get(task.groupID, {})
+            messages = self.cryptoService.encryptMany(task.resource['password'],
+                                                      set(recipients.values()) | set([self.userFingerprint]))
+            task.groupMessages = {userID: messages[fingerprint] for userID, fingerprint in recipients.items()}
+            task.resourceID = self.__createResource(task.resource, messages[self.userFingerprint])
+            if task.resourceID is None:
+                self.logger.error('Line [{}] : failed to create resource [{}]'
+                                  .format(task.lineNumber, task.resource['name']))
+                return self.__fail(task)
+            self.manifest.record(task.identity, task.occurrence, STATE_CREATED, task.contentHash, task.resourceID,
+                                 task.groupID)
+
+        if task.groupID is None:
+            return self.__succeed(task)
+        return task
+
+    """
+    Update the resource created by a previous import for a line that changed since then. The password is encrypted
+    again for every user having access to the resource, and the resource is then shared with the group of the line if
+    it does not have access yet.
+    """
+    def __updateTask(self, task):
+        resource = task.resource
+        previousResources = list(self.passboltServer.streamResourcesByIDs([task.previousResourceID],
+                                                                          withSecrets=False))
+        if not previousResources:
+            self.logger.warning('Line [{}] : resource [{}] imported by a previous run is not on the server anymore, '
+                                'creating it again'.format(task.lineNumber, task.previousResourceID))
+            task.previousResourceID = None
+            return self.__createTask(task)
+
+        groupPermissions, userPermissions = splitPermissions(previousResources[0].get('Permission', []))
+        recipients = self.directory.resolveRecipients(groupPermissions, userPermissions)
+        self.keyringManager.importUsers(recipients.values())
+        resourceUsersMap = {userID: user['Gpgkey']['fingerprint'] for userID, user in recipients.items()}
+
+        self.logger.info('Updating resource [{}] as line [{}] changed since the previous import'
+                         .format(resource['name'], task.lineNumber))
+        messages = self.cryptoService.encryptMany(resource['password'], set(resourceUsersMap.values()))
+        secretsPayload = [{'user_id': userID, 'data': messages[userKeyID]}
+                          for userID, userKeyID in resourceUsersMap.items()]
+        fields = {'name': resource['name'], 'username': resource['username'], 'uri': resource['uri']}
+        if not self.passboltServer.updateResource(task.previousResourceID, resource['description'], secretsPayload,
+                                                  fields=fields):
+            self.logger.error('Line [{}] : failed to update resource [{}] ({})'
+                              .format(task.lineNumber, resource['name'], task.previousResourceID))
+            return self.__fail(task)
+
+        task.resourceID = task.previousResourceID
+        self.manifest.record(task.identity, task.occurrence, STATE_CREATED, task.contentHash, task.resourceID,
+                             task.groupID)
+        if task.groupID is None or task.groupID in groupPermissions:
+            return self.__succeed(task)
+        task.sharedUserIDs = set(resourceUsersMap)
+        return task
+
+    def __shareTask(self, task):
+        resource = task.resource
+
+        if task.groupMessages is None:
+            # The members of the group are resolved once for all the lines of the group, see #__prepareGroups
+            recipients = {userID: fingerprint for userID, fingerprint in self.groupRecipients[task.groupID].items()
+                          if userID not in task.sharedUserIDs}
+            self.logger.debug('Encrypting password for users [{}]'.format(list(recipients.keys())))
+            messages = self.cryptoService.encryptMany(resource['password'], set(recipients.values()))
+            task.groupMessages = {userID: messages[fingerprint] for userID, fingerprint in recipients.items()}
+        secretsPayload = [{'user_id': userID, 'resource_id': task.resourceID, 'data': message}
+                          for userID, message in task.groupMessages.items()]
+
+        # Share with a group with type "Manage"
+        # TODO: Be able to customize the share type :
+        # 1 : Read only
+        # 7 : Read / Write
+        # 15 : Manage
+        if not self.__shareResource(task.resourceID, task.groupID, 15, secretsPayload):
+            self.logger.error('Line [{}] : failed to share resource [{}] ({}) with group [{}] ({})'
+                              .format(task.lineNumber, resource['name'], task.resourceID, resource['group'],
+                                      task.groupID))
+            return self.__fail(task)
+        return self.__succeed(task)
+
+    def __handleTaskError(self, task, exception):
+        self.logger.error('Line [{}] : failed to import the resource : [{}]'.format(task.lineNumber, exception))
+        self.__fail(task)
+
+    def __succeed(self, task):
+        self.manifest.record(task.identity, task.occurrence, STATE_IMPORTED, task.contentHash, task.resourceID,
+                             task.groupID)
+        self.__finishTask(task, 'imported')
+
+    def __skip(self, task):
+        self.__finishTask(task, 'skipped')
+
+    def __fail(self, task):
+        self.__finishTask(task, 'failures')
+
+    """
+    Drop the plaintext password of a line whose import is over, and report the progress of the import.
+    Always returns None, so that the task leaves the pipeline.
+    """
+    def __finishTask(self, task, category):
+        task.dropSecret()
+        with self.statsLock:
+            self.importStats[category] += 1
+            processed = self.importStats['imported'] + self.importStats['skipped'] + self.importStats['failures']
+            if processed % self.progressInterval == 0:
+                self.logger.info('Progress : [{}] lines processed, [{}] resources imported, [{}] skipped, [{}] failed'
+                                 .format(processed, self.importStats['imported'], self.importStats['skipped'],
+                                         self.importStats['failures']))
+        return None
 
     def __getCurrentUserID(self):
-        if self.cachedUserID:
-            return self.cachedUserID
-        else:
-            users = self.passboltServer.api.users.get()
-
-            for user in users:
-                if user['Gpgkey']['fingerprint'] == self.configManager.user()['fingerprint']:
-                    self.logger.debug(user)
-                    self.cachedUserID = user['User']['id']
-                    return self.cachedUserID
-
+        if self.directory.currentUserID is None:
             self.logger.error('Failed to fetch the ID of the current user')
+        return self.directory.currentUserID
 
-    def __generateGroupNames(self):
-        self.groupNames = [g['Group']['name'] for g in self.groups if g['Group']['deleted'] is False]
-
-    def __getGroupIDFromName(self, groupName):
-        for group in self.groups:
-            if group['Group']['name'] == groupName:
-                return group['Group']['id']
-
-        return None
-
-    def __createResource(self, resource):
+    """
+    @param secret : the password of the resource, encrypted for the current user
+    """
+    def __createResource(self, resource, secret):
         self.logger.info('Creating resource [{}]'.format(resource['name']))
 
         payload = {
@@ -151,14 +505,14 @@ class ImportHelper:
             'username': resource['username'],
             'uri': resource['uri'],
             'secrets': [{
-                'user_id': self.__getCurrentUserID(),
-                'data': self.keyringManager.keyring.encrypt(resource['password'], self.configManager.user()['fingerprint']).data.decode('utf-8')
+                'user_id': self.currentUserID,
+                'data': secret
             }]
         }
 
         try:
-            result = self.passboltServer.api.resources.post(data=payload)
-            self.logger.info(result)
+            result = self.passboltServer.api.resources.post(data=json.dumps(payload))
+            self.logger.debug(result)
             return result['id']
         except PassboltAPIError as e:
             self.logger.debug(e)
@@ -180,7 +534,7 @@ class ImportHelper:
 
         try:
             self.logger.debug(payload)
-            result = self.passboltServer.api.share.put(resourceID, data=payload)
+            self.passboltServer.api.share.put(resourceID, data=json.dumps(payload))
             return True
         except PassboltAPIError as e:
             self.logger.debug(e)
@@ -224,11 +578,10 @@ class ImportHelper:
 
         try:
             self.logger.debug(payload)
-            response = self.passboltServer.api.groups.post(data=payload)
+            response = self.passboltServer.api.groups.post(data=json.dumps(payload))
 
-            # Update the local group list to add the newly created group
-            self.groups.append({'Group': response['Group']})
-            self.__generateGroupNames()
+            # Update the directory to add the newly created group
+            self.directory.addGroup(response['Group'], args.defaultGroupAdmins + args.defaultGroupMembers)
             return True
         except PassboltAPIError as e:
             self.logger.debug(e)
@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+from catalog import ResourceCatalog
+from catalog import splitPermissions
+from configuration import Environment
+from resource import Resource
+
+"""
+Local index of the resources of a Passbolt server, kept between runs.
+
+The index records, for each resource, the metadata needed to select the resources to renew : its permissions and the
+properties parsed from its description. Each run only fetches the resources modified since the last synchronization
+and merges them into the index, so that the selection of resources can be done locally.
+"""
+
+
+class IndexedResource:
+    """Metadata of a resource, exposing the same properties as a Resource."""
+
+    def __init__(self, resourceID, name, modified, permissions, lastUpdateDate, updateCount, connectorType):
+        self.resourceJSON = {
+            'Resource': {'id': resourceID, 'name': name, 'modified': modified},
+            'Permission': permissions
+        }
+        self.lastUpdateDate = lastUpdateDate
+        self.updateCount = updateCount
+        self.connectorType = connectorType
+        self.groupPermissions, self.userPermissions = splitPermissions(permissions)
+
+    def __getitem__(self, key):
+        return self.resourceJSON[key]
+
+    @classmethod
+    def fromResource(cls, resource):
+        return cls(resource['Resource']['id'],
+                   resource['Resource']['name'],
+                   resource['Resource'].get('modified'),
+                   [{'aro': x['aro'], 'aro_foreign_key': x['aro_foreign_key'], 'type': x['type']}
+                    for x in resource['Permission']],
+                   resource.lastUpdateDate,
+                   resource.updateCount,
+                   resource.connectorType)
+
+    @classmethod
+    def fromJSON(cls, resourceID, entry):
+        return cls(resourceID,
+                   entry['name'],
+                   entry['modified'],
+                   entry['permissions'],
+                   datetime.fromisoformat(entry['lastUpdateDate']) if entry['lastUpdateDate'] else None,
+                   entry['updateCount'],
+                   entry['connectorType'])
+
+    def toJSON(self):
+        return {
+            'name': self['Resource']['name'],
+            'modified': self['Resource']['modified'],
+            'permissions': self['Permission'],
+            'lastUpdateDate': self.lastUpdateDate.isoformat() if self.lastUpdateDate else None,
+            'updateCount': self.updateCount,
+            'connectorType': self.connectorType
+        }
+
+
+class ResourceIndex:
+    logger = logging.getLogger('ResourceIndex')
+    # Resources are fetched from a bit before the last synchronization, to cover clock differences with the server
+    syncMargin = timedelta(minutes=10)
+    timestampFormat = '%Y-%m-%dT%H:%M:%S+00:00'
+
+    """
+    @param fullSyncInterval : the number of days after which the whole index is fetched again, so that resources
+    deleted or not shared anymore with the current user are removed from the index
+    """
+    def __init__(self, passboltServer, path=Environment.indexFilePath, fullSyncInterval=7):
+        self.passboltServer = passboltServer
+        self.path = path
+        self.fullSyncInterval = timedelta(days=fullSyncInterval)
+        self.lastSync = None
+        self.lastFullSync = None
+        # Catalog of IndexedResource
+        self.catalog = ResourceCatalog()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        try:
+            with open(self.path, 'r') as indexFile:
+                indexJSON = json.load(indexFile)
+        except ValueError as e:
+            self.logger.warning('Ignoring invalid resource index [{}] : [{}]'.format(self.path, e))
+            return
+
+        # The index is only valid for the server and the user it has been built for
+        if (indexJSON.get('server') != self.passboltServer.configManager.server()['uri']
+           or indexJSON.get('user') != self.passboltServer.configManager.user()['fingerprint']):
+            self.logger.info('The resource index has been built for another server or user, ignoring it')
+            return
+
+        self.lastSync = datetime.fromisoformat(indexJSON['lastSync'])
+        self.lastFullSync = datetime.fromisoformat(indexJSON['lastFullSync'])
+        self.catalog = ResourceCatalog(IndexedResource.fromJSON(resourceID, entry)
+                                       for resourceID, entry in indexJSON['resources'].items())
+        self.logger.debug('Loaded [{}] resources from the index'.format(len(self.catalog)))
+
+    def save(self):
+        indexJSON = {
+            'server': self.passboltServer.configManager.server()['uri'],
+            'user': self.passboltServer.configManager.user()['fingerprint'],
+            'lastSync': self.lastSync.isoformat(),
+            'lastFullSync': self.lastFullSync.isoformat(),
+            'resources': {resource['Resource']['id']: resource.toJSON() for resource in self.catalog.values()}
+        }
+
+        # Write the index atomically, so that an interrupted run cannot leave a truncated index
+        temporaryPath = '{}.tmp'.format(self.path)
+        fileDescriptor = os.open(temporaryPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fileDescriptor, 'w') as indexFile:
+            json.dump(indexJSON, indexFile)
+        os.replace(temporaryPath, self.path)
+
+    """
+    Fetch the resources modified since the last synchronization and merge them in the index. The whole index is
+    rebuilt if it is empty or if the last full synchronization is too old.
+    """
+    def sync(self):
+        syncTime = datetime.now(timezone.utc)
+        params = {'contain[permissions.group]': 1,
+                  'contain[permission.user.profile]': 1}
+
+        fullSync = self.lastSync is None or syncTime - self.lastFullSync > self.fullSyncInterval
+        if fullSync:
+            self.logger.info('Fetching every resource to build the resource index')
+            self.catalog = ResourceCatalog()
+        else:
+            modifiedAfter = (self.lastSync - self.syncMargin).astimezone(timezone.utc)
+            self.logger.info('Fetching the resources modified since [{}]'.format(modifiedAfter.isoformat()))
+            params['filter[modified-after]'] = modifiedAfter.strftime(self.timestampFormat)
+
+        fetchedResources = 0
+        for rawResource in self.passboltServer.streamResources(params=params):
+            self.update(Resource(rawResource))
+            fetchedResources += 1
+
+        self.lastSync = syncTime
+        if fullSync:
+            self.lastFullSync = syncTime
+        self.save()
+        self.logger.info('Merged [{}] resources in the index, which now holds [{}] resources'
+                         .format(fetchedResources, len(self.catalog)))
+
+    def update(self, resource):
+        self.catalog.add(IndexedResource.fromResource(resource))
+
+    def remove(self, resourceID):
+        self.catalog.remove(resourceID)
+
+    def values(self):
+        return self.catalog.values()
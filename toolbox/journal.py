@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import threading
+import uuid
+
+from datetime import datetime
+
+from configuration import Environment
+
+"""
+Append-only journal of the renewal of resources.
+
+Every state transition of a resource is written and synced to disk before the renewal moves on, so that a renewal
+that died halfway can be resumed : resources that were updated on their service but not committed to Passbolt can
+then be committed or rolled back.
+"""
+
+STATE_SELECTED = 'selected'
+STATE_DECRYPTED = 'decrypted'
+STATE_SERVICE_UPDATED = 'service-updated'
+STATE_COMMITTED = 'committed'
+STATE_ROLLED_BACK = 'rolled-back'
+STATE_FAILED = 'failed'
+STATE_SKIPPED = 'skipped'
+STATE_ERROR = 'error'
+
+# States after which there is nothing left to do on a resource
+FINAL_STATES = [STATE_COMMITTED, STATE_ROLLED_BACK, STATE_FAILED, STATE_SKIPPED, STATE_ERROR]
+# States in which the password of a resource may differ between its service and Passbolt
+UNSAFE_STATES = [STATE_DECRYPTED, STATE_SERVICE_UPDATED]
+
+EVENT_RUN_STARTED = 'run-started'
+EVENT_RUN_FINISHED = 'run-finished'
+
+
+class RenewalJournal:
+    logger = logging.getLogger('RenewalJournal')
+
+    """
+    @param enabled : when False (for example during dry-runs), nothing is written
+    """
+    def __init__(self, path=Environment.journalFilePath, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.file = None
+        self.runID = None
+
+    """
+    Read the journal of the last run.
+    Returns the record that started the run (or None if there is no journal), whether the run finished,
+    and a map of resource ID -> last record of this resource. The last record of a resource carries the last secret
+    journaled for it, even if the record itself has been written without it.
+    """
+    def loadLastRun(self):
+        runRecord = None
+        finished = False
+        resourceRecords = {}
+
+        if not os.path.isfile(self.path):
+            return runRecord, finished, resourceRecords
+
+        with open(self.path, 'r') as journalFile:
+            for line in journalFile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete if the process died while writing it
+                    self.logger.warning('Ignoring invalid journal line [{}]'.format(line.strip()))
+                    continue
+
+                if record.get('event') == EVENT_RUN_STARTED:
+                    runRecord = record
+                    finished = False
+                    resourceRecords = {}
+                elif record.get('event') == EVENT_RUN_FINISHED:
+                    finished = True
+                elif 'resource' in record:
+                    previousRecord = resourceRecords.get(record['resource'])
+                    if previousRecord is not None and 'secret' in previousRecord and 'secret' not in record:
+                        # Only the records of the decryption hold the new password, which is still the one set on
+                        # the service in the following states
+                        record['secret'] = previousRecord['secret']
+                    resourceRecords[record['resource']] = record
+
+        return runRecord, finished, resourceRecords
+
+    """
+    Returns the IDs of the resources that were left in an unsafe state by an unfinished run.
+    """
+    def unsafeResources(self):
+        runRecord, finished, resourceRecords = self.loadLastRun()
+        if runRecord is None or finished:
+            return []
+        return [x for x, record in resourceRecords.items() if record['state'] in UNSAFE_STATES]
+
+    """
+    Start a new run. The journal of the previous run is kept as a backup.
+    """
+    def startRun(self, options):
+        if not self.enabled:
+            return
+
+        if os.path.isfile(self.path):
+            os.replace(self.path, '{}.previous'.format(self.path))
+
+        self.runID = str(uuid.uuid4())
+        self.__open()
+        self.__write({'event': EVENT_RUN_STARTED, 'options': options})
+
+    """
+    Continue the run recorded in the journal.
+    """
+    def resumeRun(self, runRecord):
+        if not self.enabled:
+            return
+
+        self.runID = runRecord['run']
+        self.__open()
+        if self.file.tell() > 0:
+            with open(self.path, 'rb') as journalFile:
+                journalFile.seek(-1, os.SEEK_END)
+                if journalFile.read(1) != b'\n':
+                    # Terminate the incomplete line left by the previous run
+                    self.file.write('\n')
+
+    def finishRun(self):
+        if not self.enabled:
+            return
+
+        self.__write({'event': EVENT_RUN_FINISHED})
+        self.file.close()
+        self.file = None
+
+    def record(self, resourceID, state, **data):
+        if not self.enabled:
+            return
+
+        record = {'resource': resourceID, 'state': state}
+        record.update(data)
+        self.__write(record)
+
+    def __open(self):
+        # Create the journal with restricted permissions, as it references secrets
+        fileDescriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.file = os.fdopen(fileDescriptor, 'a')
+
+    def __write(self, record):
+        record['time'] = datetime.now().isoformat()
+        record['run'] = self.runID
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
@@ -0,0 +1,127 @@
+import codecs
+import json
+
+"""
+Incremental parsing of JSON documents received in chunks.
+
+Responses of the Passbolt API are objects of the form {"header": {...}, "body": [...]}. When listing resources, the
+body can weigh hundreds of MB; parsing it incrementally allows to handle each item as soon as it has been received,
+without ever holding the whole document, or the whole list of decoded items, in memory.
+"""
+
+
+class JSONStreamError(ValueError):
+    """Error thrown when the streamed document is not valid JSON, or does not have the expected structure."""
+    pass
+
+
+class ArrayStreamParser:
+    decoder = json.JSONDecoder()
+    whitespace = ' \t\n\r'
+
+    """
+    @param chunks : iterable of bytes (UTF-8 encoded) or str chunks making up the JSON document
+    @param key : the key, in the top-level object, of the array to stream
+    """
+    def __init__(self, chunks, key):
+        self.chunks = iter(chunks)
+        self.key = key
+        self.textDecoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.exhausted = False
+        # The other members of the top-level object, available once the document has been entirely parsed
+        self.members = {}
+
+    """
+    Yields the items of the array one by one.
+    """
+    def items(self):
+        self.__expect('{')
+        if self.__peek() == '}':
+            self.position += 1
+        else:
+            while True:
+                memberKey = self.__readValue()
+                self.__expect(':')
+                if memberKey == self.key and self.__peek() == '[':
+                    yield from self.__readArray()
+                else:
+                    self.members[memberKey] = self.__readValue()
+
+                if self.__peek() == ',':
+                    self.position += 1
+                else:
+                    self.__expect('}')
+                    break
+
+        if self.__peek() is not None:
+            raise JSONStreamError('Unexpected data after the end of the document')
+
+    def __readArray(self):
+        self.__expect('[')
+        if self.__peek() == ']':
+            self.position += 1
+            return
+
+        while True:
+            yield self.__readValue()
+            if self.__peek() == ',':
+                self.position += 1
+            else:
+                self.__expect(']')
+                return
+
+    def __readValue(self):
+        self.__peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A value ending with the buffer may be truncated (for example a number), unless nothing follows
+                if end < len(self.buffer) or self.exhausted:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.exhausted:
+                    raise JSONStreamError('Invalid JSON document : [{}]'.format(e))
+
+            self.__fill()
+
+    """
+    Returns the next non-whitespace character without consuming it, or None at the end of the document.
+    """
+    def __peek(self):
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in self.whitespace:
+                self.position += 1
+
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            elif self.exhausted:
+                return None
+            self.__fill()
+
+    def __expect(self, character):
+        nextCharacter = self.__peek()
+        if nextCharacter != character:
+            raise JSONStreamError('Expected [{}] but found [{}]'.format(character, nextCharacter))
+        self.position += 1
+
+    def __fill(self):
+        # Drop the data that has already been parsed
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.buffer += self.textDecoder.decode(b'', final=True)
+            self.exhausted = True
+        elif isinstance(chunk, bytes):
+            self.buffer += self.textDecoder.decode(chunk)
+        else:
+            self.buffer += chunk
+
+
+# Shortcut yielding the items of the array stored under the given key of the streamed document
+def iterArray(chunks, key='body'):
+    return ArrayStreamParser(chunks, key).items()
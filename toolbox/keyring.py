@@ -1,4 +1,10 @@
 import logging
+import threading
+
+
+class KeyImportError(Exception):
+    """Error thrown when the keys needed to encrypt a secret could not be imported in the keyring."""
+    pass
 
 
 # Manages the local keyring
@@ -7,34 +13,88 @@ class KeyringManager:
 
     def __init__(self, keyring):
         self.keyring = keyring
+        # Keys can be imported from several renewal workers at the same time
+        self.importLock = threading.Lock()
+
+        # Fingerprints of the keys present in the keyring. The keyring is only listed once, the fingerprints of the
+        # keys imported afterwards are added from the result of the import
+        self.fingerprints = set(x['fingerprint'] for x in self.keyring.list_keys())
+        # Fingerprints of the keys that could not be imported, that are not imported again
+        self.failedFingerprints = set()
+        # Functions called with the list of armored keys imported in the keyring
+        self.importListeners = []
 
-        # Use to manage which keys are part of the local keyring
-        self.addedKeysCache = []
-        # Get the keys currently in the keyring
-        self.keysInKeyring = [x['keyid'][-8:] for x in self.keyring.list_keys()]
-
-    def maybeImportKey(self, armoredKey, keyID, firstName, lastName):
-        if (keyID not in self.keysInKeyring
-                and keyID not in self.addedKeysCache):
-            self.logger.info('Importing missing public key for {} {} ({})'
-                             .format(firstName, lastName, keyID))
-            importResult = self.keyring.import_keys(armoredKey)
-            if importResult:
-                self.addedKeysCache.append(keyID)
-            else:
-                self.logger.error('Failed to import key [{}] in the keyring'.format(keyID))
-                # TODO : Do something, throw an error ?
+    def addImportListener(self, listener):
+        self.importListeners.append(listener)
+
+    def hasKey(self, fingerprint):
+        return fingerprint.upper() in self.fingerprints
+
+    def maybeImportKey(self, armoredKey, fingerprint, firstName, lastName):
+        return self.__importMissingKeys([(armoredKey, fingerprint, '{} {}'.format(firstName, lastName))])
 
     def maybeImportUser(self, user):
-        self.maybeImportKey(user['Gpgkey']['armored_key'],
-                            user['Gpgkey']['key_id'],
-                            user['Profile']['first_name'],
-                            user['Profile']['last_name'])
+        return self.maybeImportUsers([user])
+
+    """
+    Make sure that the keys of the given users are present in the keyring. Missing keys are imported with a single
+    gpg call.
+    Returns the set of fingerprints of the keys that could not be imported, which cannot be encrypted for.
+    """
+    def maybeImportUsers(self, users):
+        return self.__importMissingKeys([(user['Gpgkey']['armored_key'],
+                                          user['Gpgkey']['fingerprint'],
+                                          '{} {}'.format(user['Profile']['first_name'], user['Profile']['last_name']))
+                                         for user in users])
 
     # Make sure that the given Users are present in the local keyring
     def maybeImportGroupUsers(self, groupUsers):
-        for groupUser in groupUsers:
-            self.maybeImportKey(groupUser['User']['Gpgkey']['armored_key'],
-                                groupUser['User']['Gpgkey']['key_id'],
-                                groupUser['User']['Profile']['first_name'],
-                                groupUser['User']['Profile']['last_name'])
+        return self.maybeImportUsers([groupUser['User'] for groupUser in groupUsers])
+
+    """
+    Make sure that the keys of the given users are present in the keyring.
+    @throws KeyImportError if some of the keys could not be imported
+    """
+    def importUsers(self, users):
+        failedFingerprints = self.maybeImportUsers(users)
+        if failedFingerprints:
+            raise KeyImportError('Failed to import the keys [{}] in the keyring'
+                                 .format(', '.join(sorted(failedFingerprints))))
+
+    """
+    @param keys : list of (armored key, fingerprint, name of the owner of the key)
+    Returns the set of fingerprints of the given keys that could not be imported.
+    """
+    def __importMissingKeys(self, keys):
+        # Checked without the lock first, as the keys are present most of the time
+        if all(fingerprint.upper() in self.fingerprints for armoredKey, fingerprint, name in keys):
+            return set()
+
+        with self.importLock:
+            missingKeys = {}
+            failedFingerprints = set()
+            for armoredKey, fingerprint, name in keys:
+                if fingerprint.upper() in self.failedFingerprints:
+                    failedFingerprints.add(fingerprint.upper())
+                elif fingerprint.upper() not in self.fingerprints:
+                    missingKeys[fingerprint.upper()] = (armoredKey, name)
+            if not missingKeys:
+                return failedFingerprints
+
+            for fingerprint, (armoredKey, name) in missingKeys.items():
+                self.logger.info('Importing missing public key for {} ({})'.format(name, fingerprint))
+            armoredKeys = [armoredKey for armoredKey, name in missingKeys.values()]
+            importResult = self.keyring.import_keys('\n'.join(armoredKeys))
+
+            # Listeners are notified before the keys are marked as present, so that other threads cannot use them
+            # before the listeners know them
+            for listener in self.importListeners:
+                listener(armoredKeys)
+            self.fingerprints.update(importResult.fingerprints)
+
+            for fingerprint in missingKeys:
+                if fingerprint not in self.fingerprints:
+                    self.logger.error('Failed to import key [{}] in the keyring'.format(fingerprint))
+                    failedFingerprints.add(fingerprint)
+            self.failedFingerprints.update(failedFingerprints)
+            return failedFingerprints
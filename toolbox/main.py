@@ -1,31 +1,49 @@
 #!/usr/bin/env python3
 
 import logging
+import sys
 import urllib3
 
 from gnupg import GPG
 
 from configuration import ConfigManager
 from configuration import Environment
+from crypto import CryptoService
+from daemon import DaemonClient
+from daemon import RenewalDaemon
 from keyring import KeyringManager
 from passbolt import PassboltServer
 from importer import ImportHelper
 from setup import SetupHelper
 from renew import RenewHelper
+from stale import StaleHelper
 
 from utils import init_logger
 from utils import parse_args
 from utils import test_configuration
 
 args = parse_args()
-init_logger(args.verbose)
+# The output of stale --ids is meant to be given to another command, keep the logs out of it
+init_logger(args.verbose, stream=sys.stderr if args.action == 'stale' and args.ids else sys.stdout)
 logger = logging.getLogger('Main')
 
 logger.debug('Arguments : [{}]'.format(args))
 
 configManager = ConfigManager()
+
+if args.action == 'daemon' and (args.status or args.stop or args.renewResources):
+    # Commands are handled by the running daemon, which already holds the session and the keys
+    sys.exit(DaemonClient(configManager).run(args))
+
+if args.action == 'stale' and not args.rebuild:
+    # Answered from the local metadata store, without contacting the server
+    sys.exit(StaleHelper(configManager).run(args))
+
 keyring = GPG(gnupghome=Environment.keyringDir)
+# Secrets are UTF-8 encoded, whatever the crypto backend in use
+keyring.encoding = 'utf-8'
 keyringManager = KeyringManager(keyring)
+cryptoService = CryptoService(configManager, keyringManager)
 passboltServer = PassboltServer(configManager, keyring)
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -38,6 +56,10 @@ if args.action == 'setup':
 elif args.action == 'test':
     test_configuration(logger, configManager, keyring)
 elif args.action == 'renew':
-    RenewHelper(configManager, keyringManager, passboltServer).run(args)
+    RenewHelper(configManager, keyringManager, cryptoService, passboltServer).run(args)
+elif args.action == 'daemon':
+    RenewalDaemon(configManager, keyringManager, cryptoService, passboltServer).run(args)
 elif args.action == 'import':
-    ImportHelper(configManager, keyringManager, passboltServer).run(args)
+    ImportHelper(configManager, keyringManager, cryptoService, passboltServer).run(args)
+elif args.action == 'stale':
+    sys.exit(StaleHelper(configManager, passboltServer).run(args))
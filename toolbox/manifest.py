@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from configuration import Environment
+
+"""
+Local manifest of the lines imported from a CSV file.
+
+Each line that has been imported is recorded with its identity (the columns identifying its resource, see
+IDENTITY_COLUMNS) and its occurrence (the number of lines with the same identity before it in the file), a hash of its
+content and the ID of the resource created for it. When the same file is imported
+again, lines whose content did not change are not sent to the server again, lines that changed update their resource
+instead of creating a new one, and lines that were created but not shared by an interrupted run are only shared.
+
+The manifest is an append-only file, written and flushed line by line, in which the last record of a line wins.
+Content hashes are salted with a random value kept in the manifest, so that they cannot be compared to the hashes of
+known passwords.
+"""
+
+STATE_CREATED = 'created'
+STATE_IMPORTED = 'imported'
+
+# Identity name -> columns of the CSV file identifying a resource
+IDENTITY_COLUMNS = {
+    'name': ['name'],
+    'name-username-uri': ['name', 'username', 'uri']
+}
+
+
+class ImportManifest:
+    logger = logging.getLogger('ImportManifest')
+
+    """
+    @param enabled : when False, nothing is read nor written, and every line is imported as a new one
+    """
+    def __init__(self, path, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.file = None
+        self.salt = None
+        # Identity and occurrence key -> last record of this line
+        self.records = {}
+
+    """
+    Returns the manifest of the given CSV file imported by the given user on the given server. Manifests are kept
+    apart for each file, server and user.
+    """
+    @staticmethod
+    def manifestFilePath(serverURL, userFingerprint, csvPath):
+        manifestKey = '{}|{}|{}'.format(serverURL.rstrip('/'), userFingerprint, os.path.abspath(csvPath))
+        return '{}/{}.jsonl'.format(Environment.importManifestsDir,
+                                    hashlib.sha256(manifestKey.encode('utf-8')).hexdigest()[:32])
+
+    """
+    Builds the manifest of the given CSV file for the configured server and user, disabled if
+    parameters.import.manifest is disabled.
+    """
+    @classmethod
+    def forImport(cls, configManager, csvPath):
+        path = cls.manifestFilePath(configManager.server()['uri'], configManager.user()['fingerprint'], csvPath)
+        return cls(path, enabled=configManager.parameters().get('import', {}).get('manifest', True))
+
+    """
+    Load the records of the previous imports, and open the manifest to record the lines of this one.
+    @param readOnly : if True, the manifest is only loaded
+    """
+    def open(self, readOnly=False):
+        if not self.enabled:
+            return
+
+        if os.path.isfile(self.path):
+            self.__load()
+        if readOnly:
+            return
+
+        # Create the manifest with restricted permissions, as it references the resources of the user
+        fileDescriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.file = os.fdopen(fileDescriptor, 'a')
+        if self.salt is None:
+            self.salt = os.urandom(16).hex()
+            self.__write({'salt': self.salt})
+        elif self.file.tell() > 0:
+            with open(self.path, 'rb') as manifestFile:
+                manifestFile.seek(-1, os.SEEK_END)
+                if manifestFile.read(1) != b'\n':
+                    # Terminate the incomplete line left by an interrupted run
+                    self.file.write('\n')
+
+        if self.records:
+            self.logger.info('Loaded [{}] lines imported by previous runs from [{}]'
+                             .format(len(self.records), self.path))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    """
+    Returns the hash of the content of the given line of the CSV file, None if the manifest is disabled.
+    """
+    def contentHash(self, row):
+        if not self.enabled:
+            return None
+        return hashlib.sha256(json.dumps([self.salt] + list(row)).encode('utf-8')).hexdigest()
+
+    """
+    Returns the last record of the line having the given identity (a list of column values) and occurrence, None if it
+    has never been imported.
+    """
+    def get(self, identity, occurrence=0):
+        return self.records.get(self.__identityKey(identity, occurrence))
+
+    def record(self, identity, occurrence, state, contentHash, resourceID, groupID):
+        if not self.enabled:
+            return
+
+        record = {'identity': list(identity), 'occurrence': occurrence, 'state': state, 'hash': contentHash,
+                  'resource': resourceID, 'group': groupID}
+        with self.lock:
+            self.records[self.__identityKey(identity, occurrence)] = record
+            self.__write(record)
+
+    def __load(self):
+        with open(self.path, 'r') as manifestFile:
+            for line in manifestFile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete if the process died while writing it
+                    self.logger.warning('Ignoring invalid manifest line [{}]'.format(line.strip()))
+                    continue
+
+                if 'salt' in record:
+                    self.salt = record['salt']
+                elif 'identity' in record:
+                    # Records written before occurrences were recorded are the first occurrence of their identity
+                    self.records[self.__identityKey(record['identity'], record.get('occurrence', 0))] = record
+
+    def __identityKey(self, identity, occurrence):
+        return json.dumps([list(identity), occurrence])
+
+    def __write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
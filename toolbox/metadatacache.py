@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import time
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+from configuration import Environment
+
+"""
+Local cache of the users, groups and public keys of a Passbolt server, kept between runs.
+
+Users and groups are listed again on each run, without the armored public keys of the users, which make up most of the
+size of the directory. Public keys are then revalidated incrementally : only the keys modified since the previous run
+are fetched, the other ones are read from the cache. The least recently used keys are evicted once the cache holds
+more than [max-keys] keys, and fetched again when they are needed.
+"""
+
+
+class MetadataCache:
+    logger = logging.getLogger('MetadataCache')
+    # Keys are fetched from a bit before the last synchronization, to cover clock differences with the server
+    syncMargin = timedelta(minutes=10)
+    timestampFormat = '%Y-%m-%dT%H:%M:%S+00:00'
+
+    """
+    @param maxKeys : the maximum number of public keys kept in the cache
+    """
+    def __init__(self, passboltServer, path=Environment.metadataCacheFilePath, maxKeys=5000):
+        self.passboltServer = passboltServer
+        self.path = path
+        self.maxKeys = maxKeys
+        self.lastSync = None
+
+        # User ID -> user JSON, without its Gpgkey
+        self.usersByID = {}
+        # Group ID -> {'Group': group JSON, 'memberIDs': IDs of the members of the group}
+        self.groupsByID = {}
+        # User ID -> Gpgkey JSON of the user
+        self.keysByUserID = {}
+        # User ID -> time at which the key of the user has last been used
+        self.keysLastUsed = {}
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        try:
+            with open(self.path, 'r') as cacheFile:
+                cacheJSON = json.load(cacheFile)
+        except ValueError as e:
+            self.logger.warning('Ignoring invalid metadata cache [{}] : [{}]'.format(self.path, e))
+            return
+
+        # The cache is only valid for the server and the user it has been built for
+        if (cacheJSON.get('server') != self.passboltServer.configManager.server()['uri']
+           or cacheJSON.get('user') != self.passboltServer.configManager.user()['fingerprint']):
+            self.logger.info('The metadata cache has been built for another server or user, ignoring it')
+            return
+
+        self.lastSync = datetime.fromisoformat(cacheJSON['lastSync'])
+        self.usersByID = cacheJSON['users']
+        self.groupsByID = cacheJSON['groups']
+        self.keysByUserID = {userID: entry['key'] for userID, entry in cacheJSON['keys'].items()}
+        self.keysLastUsed = {userID: entry['lastUsed'] for userID, entry in cacheJSON['keys'].items()}
+        self.logger.debug('Loaded [{}] users, [{}] groups and [{}] keys from the metadata cache'
+                          .format(len(self.usersByID), len(self.groupsByID), len(self.keysByUserID)))
+
+    def save(self):
+        if self.lastSync is None:
+            return
+
+        self.__evictKeys()
+        cacheJSON = {
+            'server': self.passboltServer.configManager.server()['uri'],
+            'user': self.passboltServer.configManager.user()['fingerprint'],
+            'lastSync': self.lastSync.isoformat(),
+            'users': self.usersByID,
+            'groups': self.groupsByID,
+            'keys': {userID: {'key': key, 'lastUsed': self.keysLastUsed.get(userID, 0)}
+                     for userID, key in list(self.keysByUserID.items())}
+        }
+
+        # Write the cache atomically, so that an interrupted run cannot leave a truncated cache
+        temporaryPath = '{}.tmp'.format(self.path)
+        fileDescriptor = os.open(temporaryPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fileDescriptor, 'w') as cacheFile:
+            json.dump(cacheJSON, cacheFile)
+        os.replace(temporaryPath, self.path)
+
+    """
+    List the users and groups of the server, and fetch the public keys modified since the last synchronization.
+    Every key is fetched if the cache is empty.
+    """
+    def revalidate(self):
+        syncTime = datetime.now(timezone.utc)
+        api = self.passboltServer.api
+
+        users = api.users.get(params={'contain[gpgkey]': 0})
+        groups = api.groups.get(params={'contain[group_user]': 1})
+        if self.lastSync is None:
+            self.logger.info('Fetching every public key to build the metadata cache')
+            keys = self.passboltServer.fetchKeys()
+        else:
+            modifiedAfter = (self.lastSync - self.syncMargin).astimezone(timezone.utc)
+            keys = self.passboltServer.fetchKeys(modifiedAfter=modifiedAfter.strftime(self.timestampFormat))
+
+        modifiedUsers = 0
+        usersByID = {}
+        for user in users:
+            userID = user['User']['id']
+            # Some servers return the keys even when they are not asked for
+            key = user.pop('Gpgkey', None)
+            if key:
+                self.keysByUserID[userID] = key
+            cachedUser = self.usersByID.get(userID)
+            if cachedUser is None or cachedUser['User'].get('modified') != user['User'].get('modified'):
+                modifiedUsers += 1
+            usersByID[userID] = user
+        self.usersByID = usersByID
+
+        for key in keys:
+            # Depending on the API version, the key may or may not be wrapped
+            key = key.get('Gpgkey', key)
+            if key.get('deleted', False):
+                self.keysByUserID.pop(key['user_id'], None)
+            else:
+                self.keysByUserID[key['user_id']] = key
+
+        # Forget the keys of the users that do not exist anymore
+        for userID in [x for x in self.keysByUserID if x not in self.usersByID]:
+            del self.keysByUserID[userID]
+            self.keysLastUsed.pop(userID, None)
+
+        self.groupsByID = {}
+        for group in groups:
+            self.groupsByID[group['Group']['id']] = {'Group': group['Group'],
+                                                     'memberIDs': [x['user_id'] for x in group.get('GroupUser', [])]}
+
+        self.lastSync = syncTime
+        self.logger.info('Revalidated the metadata cache : [{}] new or modified users, [{}] modified keys'
+                         .format(modifiedUsers, len(keys)))
+
+    """
+    Returns the users, with their Gpgkey if it is in the cache.
+    """
+    def users(self):
+        return [dict(user, Gpgkey=self.keysByUserID[userID]) if userID in self.keysByUserID else dict(user)
+                for userID, user in self.usersByID.items()]
+
+    """
+    Returns a list of (group JSON, IDs of the members of the group).
+    """
+    def groups(self):
+        return [(x['Group'], x['memberIDs']) for x in self.groupsByID.values()]
+
+    def putKey(self, userID, key):
+        self.keysByUserID[userID] = key
+        self.markKeyUsed(userID)
+
+    def markKeyUsed(self, userID):
+        self.keysLastUsed[userID] = time.time()
+
+    def __evictKeys(self):
+        excessKeys = len(self.keysByUserID) - self.maxKeys
+        if excessKeys <= 0:
+            return
+
+        userFingerprint = self.passboltServer.configManager.user()['fingerprint']
+        evictableUserIDs = [userID for userID, key in self.keysByUserID.items()
+                            if key.get('fingerprint') != userFingerprint]
+        evictableUserIDs.sort(key=lambda x: self.keysLastUsed.get(x, 0))
+        for userID in evictableUserIDs[:excessKeys]:
+            del self.keysByUserID[userID]
+            self.keysLastUsed.pop(userID, None)
+        self.logger.debug('Evicted [{}] keys from the metadata cache'.format(min(excessKeys, len(evictableUserIDs))))
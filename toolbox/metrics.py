@@ -0,0 +1,199 @@
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+
+"""
+In-process metrics of a run : counters, gauges and latency histograms, identified by a name and a set of labels.
+
+Metrics are recorded in the shared registry of this module, in the same way log lines are sent to shared loggers, so
+that any part of the tool can be instrumented without having to pass a registry around. At the end of a run, the
+registry is exported by the reporters (see reports.py).
+"""
+
+# Upper bounds (in seconds) of the buckets of the latency histograms
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucketCounts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucketCounts[i] += 1
+                break
+
+    """
+    Returns the cumulative count of observations for each bucket, as expected by Prometheus.
+    """
+    def cumulativeCounts(self):
+        cumulativeCounts = []
+        total = 0
+        for count in self.bucketCounts:
+            total += count
+            cumulativeCounts.append(total)
+        return cumulativeCounts
+
+    """
+    Estimate the given quantile from the buckets, the same way Prometheus does.
+    """
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        lowerBound = 0.0
+        for bound, cumulativeCount, count in zip(self.buckets, self.cumulativeCounts(), self.bucketCounts):
+            if cumulativeCount >= rank:
+                return lowerBound + (bound - lowerBound) * (count - (cumulativeCount - rank)) / count
+            lowerBound = bound
+        return self.max
+
+
+class MetricsRegistry:
+    """Thread-safe store of the metrics of a run."""
+
+    def __init__(self, prefix='passbolt_toolbox'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        self.reset()
+
+    """
+    Clear the recorded values, to start a new run. Descriptions are kept.
+    """
+    def reset(self):
+        with self.lock:
+            # (name, labels) -> value or Histogram, labels being a sorted tuple of (label, value)
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+    def describe(self, name, description):
+        self.descriptions[name] = description
+
+    def increment(self, name, value=1, **labels):
+        key = (name, self.__labelsKey(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def setGauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, self.__labelsKey(labels))] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, self.__labelsKey(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    """
+    Context manager measuring the duration of the enclosed block in the histogram of the given name.
+    The "outcome" label is set to "success", or to "error" if the block raises an exception.
+    """
+    @contextmanager
+    def timer(self, name, **labels):
+        startTime = time.monotonic()
+        outcome = 'success'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            self.observe(name, time.monotonic() - startTime, outcome=outcome, **labels)
+
+    def __labelsKey(self, labels):
+        return tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    """
+    Render the metrics in the Prometheus text exposition format.
+    """
+    def toPrometheus(self):
+        lines = []
+        with self.lock:
+            self.__renderPrometheusSamples(lines, self.counters, 'counter')
+            self.__renderPrometheusSamples(lines, self.gauges, 'gauge')
+
+            for name in sorted(set(name for name, labels in self.histograms)):
+                fullName = '{}_{}'.format(self.prefix, name)
+                self.__renderPrometheusHeader(lines, name, fullName, 'histogram')
+                for (metricName, labels), histogram in sorted(self.histograms.items()):
+                    if metricName != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.cumulativeCounts()):
+                        lines.append('{}_bucket{} {}'.format(fullName, self.__renderLabels(labels + (('le', bound),)),
+                                                             count))
+                    lines.append('{}_bucket{} {}'.format(fullName, self.__renderLabels(labels + (('le', '+Inf'),)),
+                                                         histogram.count))
+                    lines.append('{}_sum{} {}'.format(fullName, self.__renderLabels(labels), histogram.sum))
+                    lines.append('{}_count{} {}'.format(fullName, self.__renderLabels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def __renderPrometheusSamples(self, lines, samples, metricType):
+        for name in sorted(set(name for name, labels in samples)):
+            fullName = '{}_{}'.format(self.prefix, name)
+            self.__renderPrometheusHeader(lines, name, fullName, metricType)
+            for (metricName, labels), value in sorted(samples.items()):
+                if metricName == name:
+                    lines.append('{}{} {}'.format(fullName, self.__renderLabels(labels), value))
+
+    def __renderPrometheusHeader(self, lines, name, fullName, metricType):
+        if name in self.descriptions:
+            lines.append('# HELP {} {}'.format(fullName, self.descriptions[name]))
+        lines.append('# TYPE {} {}'.format(fullName, metricType))
+
+    def __renderLabels(self, labels):
+        if not labels:
+            return ''
+        return '{{{}}}'.format(','.join('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                        for label, value in labels))
+
+    """
+    Returns a JSON-serializable summary of the metrics.
+    """
+    def toJSON(self):
+        with self.lock:
+            return {
+                'counters': [dict(labels, name=name, value=value)
+                             for (name, labels), value in sorted(self.counters.items())],
+                'gauges': [dict(labels, name=name, value=value)
+                           for (name, labels), value in sorted(self.gauges.items())],
+                'histograms': [dict(labels, name=name, count=histogram.count, sum=round(histogram.sum, 6),
+                                    max=round(histogram.max, 6),
+                                    p50=self.__round(histogram.quantile(0.5)),
+                                    p95=self.__round(histogram.quantile(0.95)),
+                                    p99=self.__round(histogram.quantile(0.99)))
+                               for (name, labels), histogram in sorted(self.histograms.items())]
+            }
+
+    def __round(self, value):
+        return None if value is None else round(value, 6)
+
+    def dumpJSON(self):
+        return json.dumps(self.toJSON(), indent=2)
+
+
+# The registry shared by the whole tool
+registry = MetricsRegistry()
+
+registry.describe('api_request_duration_seconds', 'Duration of the requests sent to the Passbolt API.')
+registry.describe('api_request_retries_total', 'Number of requests sent again to the Passbolt API, by reason.')
+registry.describe('crypto_operation_duration_seconds', 'Duration of the encryption and decryption of secrets.')
+registry.describe('connector_operation_duration_seconds', 'Duration of the password updates and rollbacks on services.')
+registry.describe('resource_update_duration_seconds', 'Duration of the updates of renewed resources on Passbolt.')
+registry.describe('renewed_resources_total', 'Number of resources processed by the renewal, by result.')
+registry.describe('run_duration_seconds', 'Duration of the last run.')
+registry.describe('run_timestamp_seconds', 'Time at which the last run finished.')
@@ -0,0 +1,749 @@
+import base64
+import bz2
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import x25519
+from cryptography.hazmat.primitives.ciphers import Cipher
+from cryptography.hazmat.primitives.ciphers import algorithms
+from cryptography.hazmat.primitives.ciphers import modes
+from cryptography.hazmat.primitives.keywrap import aes_key_unwrap
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap
+from cryptography.hazmat.primitives import serialization
+
+"""
+Minimal in-process implementation of the OpenPGP message format (RFC 4880 and RFC 6637), covering what the toolbox
+needs to encrypt and decrypt secrets without spawning gpg :
+* RSA, ECDH Curve25519 and ECDH NIST P-256 / P-384 / P-521 public key encryption
+* AES symmetrically encrypted and integrity protected data packets (SEIPD version 1)
+* Uncompressed, ZIP, ZLIB and BZip2 compressed literal data
+
+Anything outside of this scope raises an UnsupportedError, so that callers can fall back on gpg.
+"""
+
+TAG_PKESK = 1
+TAG_SIGNATURE = 2
+TAG_SECRET_KEY = 5
+TAG_PUBLIC_KEY = 6
+TAG_SECRET_SUBKEY = 7
+TAG_COMPRESSED = 8
+TAG_LITERAL = 11
+TAG_PUBLIC_SUBKEY = 14
+TAG_SEIPD = 18
+TAG_MDC = 19
+
+ALGO_RSA = (1, 2)
+ALGO_ECDH = 18
+
+# Symmetric algorithm ID -> key size
+SYMMETRIC_KEY_SIZES = {7: 16, 8: 24, 9: 32}
+SESSION_KEY_ALGORITHM = 9
+
+HASH_ALGORITHMS = {2: 'sha1', 8: 'sha256', 9: 'sha384', 10: 'sha512', 11: 'sha224'}
+
+CURVE25519_OID = bytes.fromhex('2b060104019755010501')
+NIST_CURVES = {
+    bytes.fromhex('2a8648ce3d030107'): ec.SECP256R1,
+    bytes.fromhex('2b81040022'): ec.SECP384R1,
+    bytes.fromhex('2b81040023'): ec.SECP521R1
+}
+
+KEY_FLAGS_ENCRYPT = 0x04 | 0x08
+# Validities of the gpg colon listing of keys that must not be encrypted for : revoked, expired, invalid, disabled
+INVALID_VALIDITIES = ('r', 'e', 'i', 'd')
+
+
+class OpenPGPError(Exception):
+    """Error thrown when an OpenPGP message or key is invalid."""
+    pass
+
+
+class UnsupportedError(OpenPGPError):
+    """Error thrown when an OpenPGP feature is valid, but not implemented here."""
+    pass
+
+
+# Armoring
+
+
+def _buildCRC24Table():
+    table = []
+    for i in range(256):
+        crc = i << 16
+        for j in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+        table.append(crc & 0xFFFFFF)
+    return table
+
+
+_CRC24_TABLE = _buildCRC24Table()
+
+
+def crc24(data):
+    crc = 0xB704CE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ _CRC24_TABLE[(crc >> 16) ^ byte]
+    return crc
+
+
+def armor(data, blockType='MESSAGE'):
+    encoded = base64.b64encode(data).decode('ascii')
+    lines = ['-----BEGIN PGP {}-----'.format(blockType), '']
+    lines += [encoded[i:i + 64] for i in range(0, len(encoded), 64)]
+    lines.append('=' + base64.b64encode(struct.pack('>I', crc24(data))[1:]).decode('ascii'))
+    lines.append('-----END PGP {}-----'.format(blockType))
+    return '\n'.join(lines) + '\n'
+
+
+# Returns the binary content of every armored block found in the given text.
+def dearmor(text):
+    if isinstance(text, bytes):
+        text = text.decode('ascii', 'replace')
+
+    data = bytearray()
+    inBlock = False
+    inHeaders = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('-----BEGIN PGP'):
+            inBlock = True
+            inHeaders = True
+        elif line.startswith('-----END PGP'):
+            inBlock = False
+        elif inBlock and inHeaders:
+            # Armor headers end with an empty line
+            if not line:
+                inHeaders = False
+            elif ':' not in line:
+                inHeaders = False
+                data += base64.b64decode(line)
+        elif inBlock and line and not line.startswith('='):
+            data += base64.b64decode(line)
+
+    if not data:
+        raise OpenPGPError('No armored data found')
+    return bytes(data)
+
+
+# Packets
+
+
+def readPackets(data):
+    packets = []
+    position = 0
+    while position < len(data):
+        header = data[position]
+        position += 1
+        if not header & 0x80:
+            raise OpenPGPError('Invalid packet header at offset [{}]'.format(position - 1))
+
+        if header & 0x40:
+            # New packet format, possibly with partial body lengths
+            tag = header & 0x3F
+            body = bytearray()
+            while True:
+                first = data[position]
+                partial = False
+                if first < 192:
+                    length = first
+                    position += 1
+                elif first < 224:
+                    length = ((first - 192) << 8) + data[position + 1] + 192
+                    position += 2
+                elif first == 255:
+                    length = struct.unpack('>I', data[position + 1:position + 5])[0]
+                    position += 5
+                else:
+                    length = 1 << (first & 0x1F)
+                    position += 1
+                    partial = True
+                body += data[position:position + length]
+                position += length
+                if not partial:
+                    break
+            body = bytes(body)
+        else:
+            tag = (header >> 2) & 0x0F
+            lengthType = header & 0x03
+            if lengthType == 0:
+                length = data[position]
+                position += 1
+            elif lengthType == 1:
+                length = struct.unpack('>H', data[position:position + 2])[0]
+                position += 2
+            elif lengthType == 2:
+                length = struct.unpack('>I', data[position:position + 4])[0]
+                position += 4
+            else:
+                length = len(data) - position
+            body = data[position:position + length]
+            position += length
+
+        packets.append((tag, body))
+    return packets
+
+
+def writePacket(tag, body):
+    length = len(body)
+    if length < 192:
+        header = bytes([0xC0 | tag, length])
+    elif length < 8384:
+        length -= 192
+        header = bytes([0xC0 | tag, (length >> 8) + 192, length & 0xFF])
+    else:
+        header = bytes([0xC0 | tag, 255]) + struct.pack('>I', length)
+    return header + body
+
+
+def _readMPI(data, position):
+    bits = struct.unpack('>H', data[position:position + 2])[0]
+    end = position + 2 + (bits + 7) // 8
+    return data[position + 2:end], end
+
+
+def _writeMPI(value):
+    if isinstance(value, int):
+        value = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    value = value.lstrip(b'\x00')
+    bits = (len(value) - 1) * 8 + value[0].bit_length() if value else 0
+    return struct.pack('>H', bits) + value
+
+
+def _toInt(data):
+    return int.from_bytes(data, 'big')
+
+
+def _xor(left, right):
+    length = min(len(left), len(right))
+    return (_toInt(left[:length]) ^ _toInt(right[:length])).to_bytes(length, 'big')
+
+
+# Symmetric encryption
+
+
+def _aesECB(key):
+    return Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend()).encryptor()
+
+
+def cfbEncrypt(key, iv, data):
+    ecb = _aesECB(key)
+    output = bytearray()
+    previous = iv
+    for i in range(0, len(data), 16):
+        block = _xor(data[i:i + 16], ecb.update(previous))
+        output += block
+        previous = block
+    return bytes(output)
+
+
+def cfbDecrypt(key, iv, data):
+    # Every key stream block only depends on the previous cipher block, so they can all be computed at once
+    fullBlocks = (len(data) - 1) // 16 * 16 if data else 0
+    keyStream = _aesECB(key).update(iv + data[:fullBlocks])
+    return _xor(data, keyStream)
+
+
+def _checksum(data):
+    return struct.pack('>H', sum(data) % 65536)
+
+
+# Keys
+
+
+class Key:
+    """A primary key or a subkey, with its secret material when available."""
+
+    def __init__(self, body, isSubkey):
+        self.isSubkey = isSubkey
+        self.version = body[0]
+        if self.version != 4:
+            raise UnsupportedError('Unsupported key version [{}]'.format(self.version))
+
+        self.creationTime = struct.unpack('>I', body[1:5])[0]
+        self.algorithm = body[5]
+        self.publicLength = self.__parsePublicMaterial(body, 6)
+        self.fingerprint = hashlib.sha1(
+            b'\x99' + struct.pack('>H', self.publicLength) + body[:self.publicLength]).hexdigest().upper()
+        self.keyID = self.fingerprint[-16:]
+
+        # Properties coming from the signatures of the key. Signatures are not verified in-process, see #validity
+        self.flags = None
+        self.expirationTime = None
+        self.revoked = False
+        # Validity of the key as computed by gpg, which verifies the signatures of the key : one of the validity
+        # letters of the colon listing (r : revoked, e : expired, i : invalid, d : disabled, ...), None if unknown
+        self.validity = None
+
+        self.secretBody = body[self.publicLength:] if len(body) > self.publicLength else None
+        self.privateKey = None
+
+    def __parsePublicMaterial(self, body, position):
+        if self.algorithm in ALGO_RSA:
+            n, position = _readMPI(body, position)
+            e, position = _readMPI(body, position)
+            self.publicKey = rsa.RSAPublicNumbers(_toInt(e), _toInt(n)).public_key(default_backend())
+        elif self.algorithm == ALGO_ECDH:
+            oidLength = body[position]
+            self.curveOID = body[position + 1:position + 1 + oidLength]
+            point, position = _readMPI(body, position + 1 + oidLength)
+            kdfLength = body[position]
+            self.kdfHash = body[position + 2]
+            self.kdfAlgorithm = body[position + 3]
+            position += 1 + kdfLength
+            self.publicKey = self.__loadECDHPublicKey(point)
+        elif self.algorithm in (19, 22):
+            # ECDSA and EdDSA signing keys, only their length matters here
+            oidLength = body[position]
+            point, position = _readMPI(body, position + 1 + oidLength)
+            self.publicKey = None
+        elif self.algorithm in (16, 17):
+            # ElGamal and DSA keys
+            for i in range(3 if self.algorithm == 16 else 4):
+                value, position = _readMPI(body, position)
+            self.publicKey = None
+        else:
+            raise UnsupportedError('Unsupported public key algorithm [{}]'.format(self.algorithm))
+        return position
+
+    def __loadECDHPublicKey(self, point):
+        if self.curveOID == CURVE25519_OID:
+            if point[0] != 0x40:
+                raise OpenPGPError('Invalid Curve25519 point')
+            return x25519.X25519PublicKey.from_public_bytes(point[1:])
+        elif self.curveOID in NIST_CURVES:
+            return ec.EllipticCurvePublicKey.from_encoded_point(NIST_CURVES[self.curveOID](), point)
+        else:
+            return None
+
+    def isExpired(self, now=None):
+        return bool(self.expirationTime) and self.creationTime + self.expirationTime < (now or time.time())
+
+    def canEncrypt(self, now=None):
+        if self.revoked or self.publicKey is None or self.validity in INVALID_VALIDITIES:
+            return False
+        if self.algorithm not in ALGO_RSA and self.algorithm != ALGO_ECDH:
+            return False
+        if self.flags is not None and not self.flags & KEY_FLAGS_ENCRYPT:
+            return False
+        if self.isExpired(now):
+            return False
+        return True
+
+    def isSecret(self):
+        return self.secretBody is not None
+
+    def isProtected(self):
+        return self.secretBody is not None and self.secretBody[0] != 0
+
+    def isUnlocked(self):
+        return self.privateKey is not None
+
+    """
+    Decrypt the secret material of the key using the given passphrase.
+    """
+    def unlock(self, passphrase=None):
+        if self.secretBody is None:
+            raise OpenPGPError('Key [{}] has no secret material'.format(self.keyID))
+        if self.algorithm not in ALGO_RSA and self.algorithm != ALGO_ECDH:
+            # Signing keys are never used to decrypt messages
+            return
+
+        usage = self.secretBody[0]
+        if usage == 0:
+            material = self.secretBody[1:-2]
+            if _checksum(material) != self.secretBody[-2:]:
+                raise OpenPGPError('Invalid checksum for the secret key [{}]'.format(self.keyID))
+        elif usage in (254, 255):
+            symmetricAlgorithm = self.secretBody[1]
+            if symmetricAlgorithm not in SYMMETRIC_KEY_SIZES:
+                raise UnsupportedError('Unsupported secret key cipher [{}]'.format(symmetricAlgorithm))
+            key, position = _deriveS2K(self.secretBody, 2, passphrase, SYMMETRIC_KEY_SIZES[symmetricAlgorithm])
+            iv = self.secretBody[position:position + 16]
+            decrypted = cfbDecrypt(key, iv, self.secretBody[position + 16:])
+            if usage == 254:
+                material = decrypted[:-20]
+                if hashlib.sha1(material).digest() != decrypted[-20:]:
+                    raise OpenPGPError('Bad passphrase for the secret key [{}]'.format(self.keyID))
+            else:
+                material = decrypted[:-2]
+                if _checksum(material) != decrypted[-2:]:
+                    raise OpenPGPError('Bad passphrase for the secret key [{}]'.format(self.keyID))
+        else:
+            raise UnsupportedError('Unsupported secret key protection [{}]'.format(usage))
+
+        self.privateKey = self.__loadPrivateKey(material)
+
+    def __loadPrivateKey(self, material):
+        if self.algorithm in ALGO_RSA:
+            d, position = _readMPI(material, 0)
+            p, position = _readMPI(material, position)
+            q, position = _readMPI(material, position)
+            d, p, q = _toInt(d), _toInt(p), _toInt(q)
+            return rsa.RSAPrivateNumbers(
+                p, q, d, rsa.rsa_crt_dmp1(d, p), rsa.rsa_crt_dmq1(d, q), rsa.rsa_crt_iqmp(p, q),
+                self.publicKey.public_numbers()).private_key(default_backend())
+        elif self.algorithm == ALGO_ECDH and self.curveOID == CURVE25519_OID:
+            # The secret scalar is stored in big-endian, while X25519 works with its little-endian form
+            scalar, position = _readMPI(material, 0)
+            return x25519.X25519PrivateKey.from_private_bytes(scalar.rjust(32, b'\x00')[::-1])
+        elif self.algorithm == ALGO_ECDH and self.curveOID in NIST_CURVES:
+            scalar, position = _readMPI(material, 0)
+            return ec.derive_private_key(_toInt(scalar), NIST_CURVES[self.curveOID](), default_backend())
+        else:
+            raise UnsupportedError('Unsupported secret key algorithm [{}]'.format(self.algorithm))
+
+
+def _deriveS2K(data, position, passphrase, keyLength):
+    s2kType = data[position]
+    hashName = HASH_ALGORITHMS.get(data[position + 1])
+    if s2kType == 101:
+        raise UnsupportedError('The secret key is not available (GnuPG stub)')
+    if hashName is None:
+        raise UnsupportedError('Unsupported S2K hash algorithm [{}]'.format(data[position + 1]))
+
+    passphrase = (passphrase or '').encode('utf-8')
+    if s2kType == 0:
+        salted = passphrase
+        count = len(salted)
+        position += 2
+    elif s2kType == 1:
+        salted = data[position + 2:position + 10] + passphrase
+        count = len(salted)
+        position += 10
+    elif s2kType == 3:
+        salted = data[position + 2:position + 10] + passphrase
+        codedCount = data[position + 10]
+        count = max(len(salted), (16 + (codedCount & 15)) << ((codedCount >> 4) + 6))
+        position += 11
+    else:
+        raise UnsupportedError('Unsupported S2K type [{}]'.format(s2kType))
+
+    # The salted passphrase is hashed repeatedly until [count] bytes have been hashed, feed it by chunks
+    chunk = salted * max(1, 65536 // max(1, len(salted)))
+    key = b''
+    preload = 0
+    while len(key) < keyLength:
+        digest = hashlib.new(hashName)
+        digest.update(b'\x00' * preload)
+        remaining = count
+        while remaining > 0 and chunk:
+            digest.update(chunk[:remaining])
+            remaining -= len(chunk)
+        key += digest.digest()
+        preload += 1
+    return key[:keyLength], position
+
+
+class Certificate:
+    """A transferable key : a primary key, its user IDs and its subkeys."""
+
+    def __init__(self, primaryKey):
+        self.primaryKey = primaryKey
+        self.subkeys = []
+        self.userIDs = []
+
+    @property
+    def fingerprint(self):
+        return self.primaryKey.fingerprint
+
+    def keys(self):
+        return [self.primaryKey] + self.subkeys
+
+    """
+    Whether the certificate can be used at all : the revocation and the expiration of the primary key apply to every
+    subkey of the certificate.
+    """
+    def isValid(self, now=None):
+        primaryKey = self.primaryKey
+        return not (primaryKey.revoked or primaryKey.validity in INVALID_VALIDITIES or primaryKey.isExpired(now))
+
+    """
+    Returns the most recent key of the certificate that can be used for encryption.
+    """
+    def encryptionKey(self):
+        if not self.isValid():
+            raise OpenPGPError('Certificate [{}] is revoked or expired'.format(self.fingerprint))
+        candidates = [key for key in self.keys() if key.canEncrypt()]
+        if not candidates:
+            raise UnsupportedError('No usable encryption key in [{}]'.format(self.fingerprint))
+        return max(candidates, key=lambda key: key.creationTime)
+
+
+def _parseSignature(body):
+    properties = {'type': body[1] if body[0] == 4 else None}
+    if body[0] != 4:
+        return properties
+
+    hashedLength = struct.unpack('>H', body[4:6])[0]
+    subpackets = body[6:6 + hashedLength]
+    position = 0
+    while position < len(subpackets):
+        first = subpackets[position]
+        if first < 192:
+            length = first
+            position += 1
+        elif first < 255:
+            length = ((first - 192) << 8) + subpackets[position + 1] + 192
+            position += 2
+        else:
+            length = struct.unpack('>I', subpackets[position + 1:position + 5])[0]
+            position += 5
+        subpacketType = subpackets[position] & 0x7F
+        content = subpackets[position + 1:position + length]
+        if subpacketType == 27 and content:
+            properties['flags'] = content[0]
+        elif subpacketType == 9:
+            properties['expiration'] = struct.unpack('>I', content)[0]
+        elif subpacketType == 2:
+            properties['created'] = struct.unpack('>I', content)[0]
+        position += length
+    return properties
+
+
+# Parse every certificate found in the given binary data (public or secret keys).
+def parseCertificates(data):
+    certificates = []
+    certificate = None
+    currentKey = None
+    # Only the most recent binding signature of each key is used
+    lastSignatureTime = {}
+
+    for tag, body in readPackets(data):
+        if tag in (TAG_PUBLIC_KEY, TAG_SECRET_KEY):
+            currentKey = Key(body, False)
+            certificate = Certificate(currentKey)
+            certificates.append(certificate)
+        elif tag in (TAG_PUBLIC_SUBKEY, TAG_SECRET_SUBKEY) and certificate:
+            try:
+                currentKey = Key(body, True)
+                certificate.subkeys.append(currentKey)
+            except UnsupportedError:
+                currentKey = None
+        elif tag == 13 and certificate:
+            certificate.userIDs.append(body.decode('utf-8', 'replace'))
+        elif tag == TAG_SIGNATURE and currentKey:
+            signature = _parseSignature(body)
+            if signature['type'] in (0x20, 0x28):
+                currentKey.revoked = True
+            elif signature['type'] in (0x10, 0x11, 0x12, 0x13, 0x18, 0x1F):
+                created = signature.get('created', 0)
+                if created >= lastSignatureTime.get(currentKey.fingerprint, -1):
+                    lastSignatureTime[currentKey.fingerprint] = created
+                    if 'flags' in signature:
+                        currentKey.flags = signature['flags']
+                    if 'expiration' in signature:
+                        currentKey.expirationTime = signature['expiration']
+    return certificates
+
+
+class KeyStore:
+    """In-memory set of certificates, indexed by fingerprint, long key ID and short key ID of every key."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.certificates = {}
+        self.secretKeys = {}
+
+    def add(self, certificates):
+        with self.lock:
+            for certificate in certificates:
+                for key in certificate.keys():
+                    for identifier in (key.fingerprint, key.keyID, key.keyID[-8:]):
+                        # A subkey never hides the primary key having the same short ID
+                        if not key.isSubkey or identifier not in self.certificates:
+                            self.certificates[identifier] = certificate
+                    if key.isSecret():
+                        self.secretKeys[key.keyID] = key
+
+    def get(self, identifier):
+        return self.certificates.get(identifier.upper().replace(' ', ''))
+
+    def getSecretKey(self, keyID):
+        return self.secretKeys.get(keyID)
+
+
+# Messages
+
+
+def _kdfParam(key):
+    return (bytes([len(key.curveOID)]) + key.curveOID + bytes([ALGO_ECDH, 3, 1, key.kdfHash, key.kdfAlgorithm])
+            + b'Anonymous Sender    ' + bytes.fromhex(key.fingerprint))
+
+
+def _kdf(key, sharedSecret):
+    hashName = HASH_ALGORITHMS.get(key.kdfHash)
+    keyLength = SYMMETRIC_KEY_SIZES.get(key.kdfAlgorithm)
+    if hashName is None or keyLength is None:
+        raise UnsupportedError('Unsupported ECDH parameters for key [{}]'.format(key.keyID))
+    return hashlib.new(hashName, b'\x00\x00\x00\x01' + sharedSecret + _kdfParam(key)).digest()[:keyLength]
+
+
+def _ecdhExchange(privateKey, publicKey):
+    if isinstance(privateKey, x25519.X25519PrivateKey):
+        return privateKey.exchange(publicKey)
+    return privateKey.exchange(ec.ECDH(), publicKey)
+
+
+def _encodePoint(publicKey):
+    if isinstance(publicKey, x25519.X25519PublicKey):
+        return b'\x40' + publicKey.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    return publicKey.public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+
+
+# Build a public-key encrypted session key packet, wrapping the given session key for the given key.
+def buildPKESK(key, sessionKey, symmetricAlgorithm=SESSION_KEY_ALGORITHM):
+    message = bytes([symmetricAlgorithm]) + sessionKey + _checksum(sessionKey)
+    header = bytes([3]) + bytes.fromhex(key.keyID) + bytes([key.algorithm])
+
+    if key.algorithm in ALGO_RSA:
+        encrypted = key.publicKey.encrypt(message, padding.PKCS1v15())
+        return writePacket(TAG_PKESK, header + _writeMPI(encrypted))
+    elif key.algorithm == ALGO_ECDH:
+        if isinstance(key.publicKey, x25519.X25519PublicKey):
+            ephemeralKey = x25519.X25519PrivateKey.generate()
+        else:
+            ephemeralKey = ec.generate_private_key(key.publicKey.curve, default_backend())
+        wrappingKey = _kdf(key, _ecdhExchange(ephemeralKey, key.publicKey))
+        # PKCS#5 padding up to a multiple of 8 bytes
+        paddingLength = 8 - len(message) % 8
+        wrapped = aes_key_wrap(wrappingKey, message + bytes([paddingLength]) * paddingLength, default_backend())
+        return writePacket(TAG_PKESK, header + _writeMPI(_encodePoint(ephemeralKey.public_key()))
+                           + bytes([len(wrapped)]) + wrapped)
+    else:
+        raise UnsupportedError('Unsupported encryption algorithm [{}]'.format(key.algorithm))
+
+
+# Build a symmetrically encrypted and integrity protected data packet containing the given data as literal data.
+def buildSEIPD(data, sessionKey):
+    prefix = os.urandom(16)
+    prefix += prefix[-2:]
+    literal = writePacket(TAG_LITERAL, b'b\x00' + struct.pack('>I', int(time.time())) + data)
+    mdcHeader = bytes([0xC0 | TAG_MDC, 20])
+    mdc = hashlib.sha1(prefix + literal + mdcHeader).digest()
+    return writePacket(TAG_SEIPD, b'\x01' + cfbEncrypt(sessionKey, b'\x00' * 16, prefix + literal + mdcHeader + mdc))
+
+
+def generateSessionKey(symmetricAlgorithm=SESSION_KEY_ALGORITHM):
+    return os.urandom(SYMMETRIC_KEY_SIZES[symmetricAlgorithm])
+
+
+# Encrypt the given data for each of the given certificates, as a single armored message.
+def encryptMessage(data, certificates):
+    sessionKey = generateSessionKey()
+    packets = b''.join([buildPKESK(certificate.encryptionKey(), sessionKey) for certificate in certificates])
+    return armor(packets + buildSEIPD(data, sessionKey))
+
+
+# Encrypt the given data once, and return one armored message per certificate. Every message contains the same
+# encrypted data packet, preceded by the session key encrypted for the certificate.
+def encryptMessages(data, certificates):
+    sessionKey = generateSessionKey()
+    encryptedData = buildSEIPD(data, sessionKey)
+    return [armor(buildPKESK(certificate.encryptionKey(), sessionKey) + encryptedData)
+            for certificate in certificates]
+
+
+# Split a message encrypted for several recipients into one message per recipient.
+# Returns a map of key ID -> armored message, the key ID being the one of the key used to encrypt the session key.
+def splitMessage(data):
+    sessionKeyPackets = {}
+    encryptedData = None
+    for tag, body in readPackets(data):
+        if tag == TAG_PKESK:
+            sessionKeyPackets[body[1:9].hex().upper()] = writePacket(tag, body)
+        elif encryptedData is None and tag != 10:
+            encryptedData = writePacket(tag, body)
+        elif tag != 10:
+            raise UnsupportedError('Unexpected packet [{}] in encrypted message'.format(tag))
+
+    if encryptedData is None:
+        raise OpenPGPError('No encrypted data found in the message')
+    return {keyID: armor(packet + encryptedData) for keyID, packet in sessionKeyPackets.items()}
+
+
+def _decryptSessionKey(key, body):
+    position = 10
+    if key.algorithm in ALGO_RSA:
+        encrypted, position = _readMPI(body, position)
+        keySize = (key.publicKey.key_size + 7) // 8
+        message = key.privateKey.decrypt(encrypted.rjust(keySize, b'\x00'), padding.PKCS1v15())
+    elif key.algorithm == ALGO_ECDH:
+        point, position = _readMPI(body, position)
+        if isinstance(key.publicKey, x25519.X25519PublicKey):
+            ephemeralKey = x25519.X25519PublicKey.from_public_bytes(point[1:])
+        else:
+            ephemeralKey = ec.EllipticCurvePublicKey.from_encoded_point(key.publicKey.curve, point)
+        wrappingKey = _kdf(key, _ecdhExchange(key.privateKey, ephemeralKey))
+        wrappedLength = body[position]
+        message = aes_key_unwrap(wrappingKey, body[position + 1:position + 1 + wrappedLength], default_backend())
+        message = message[:-message[-1]]
+    else:
+        raise UnsupportedError('Unsupported encryption algorithm [{}]'.format(key.algorithm))
+
+    symmetricAlgorithm = message[0]
+    sessionKey = message[1:-2]
+    if symmetricAlgorithm not in SYMMETRIC_KEY_SIZES:
+        raise UnsupportedError('Unsupported symmetric algorithm [{}]'.format(symmetricAlgorithm))
+    if _checksum(sessionKey) != message[-2:]:
+        raise OpenPGPError('Invalid session key checksum')
+    return sessionKey
+
+
+def _decryptSEIPD(body, sessionKey):
+    if body[0] != 1:
+        raise UnsupportedError('Unsupported SEIPD version [{}]'.format(body[0]))
+    decrypted = cfbDecrypt(sessionKey, b'\x00' * 16, body[1:])
+    if decrypted[14:16] != decrypted[16:18]:
+        raise OpenPGPError('Invalid session key')
+    if decrypted[-22:-20] != bytes([0xC0 | TAG_MDC, 20]) or hashlib.sha1(decrypted[:-20]).digest() != decrypted[-20:]:
+        raise OpenPGPError('Modification detected in the encrypted message')
+    return decrypted[18:-22]
+
+
+def _extractLiteralData(data):
+    for tag, body in readPackets(data):
+        if tag == TAG_COMPRESSED:
+            compressionAlgorithm = body[0]
+            if compressionAlgorithm == 0:
+                return _extractLiteralData(body[1:])
+            elif compressionAlgorithm == 1:
+                return _extractLiteralData(zlib.decompress(body[1:], -15))
+            elif compressionAlgorithm == 2:
+                return _extractLiteralData(zlib.decompress(body[1:]))
+            elif compressionAlgorithm == 3:
+                return _extractLiteralData(bz2.decompress(body[1:]))
+            raise UnsupportedError('Unsupported compression algorithm [{}]'.format(compressionAlgorithm))
+        elif tag == TAG_LITERAL:
+            fileNameLength = body[1]
+            return body[6 + fileNameLength:]
+    raise OpenPGPError('No literal data found in the message')
+
+
+# Decrypt the given armored message using one of the unlocked secret keys of the key store.
+def decryptMessage(text, keyStore):
+    sessionKey = None
+    for tag, body in readPackets(dearmor(text)):
+        if tag == TAG_PKESK and sessionKey is None:
+            if body[0] != 3:
+                raise UnsupportedError('Unsupported PKESK version [{}]'.format(body[0]))
+            key = keyStore.getSecretKey(body[1:9].hex().upper())
+            if key is not None and key.isUnlocked():
+                sessionKey = _decryptSessionKey(key, body)
+        elif tag == TAG_SEIPD:
+            if sessionKey is None:
+                raise UnsupportedError('No secret key available to decrypt the message')
+            return _extractLiteralData(_decryptSEIPD(body, sessionKey))
+        elif tag not in (TAG_PKESK, 3, 10):
+            # Symmetric-key encrypted session keys and marker packets are ignored
+            raise UnsupportedError('Unsupported packet [{}] in encrypted message'.format(tag))
+    raise OpenPGPError('No encrypted data found in the message')
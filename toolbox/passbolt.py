@@ -1,13 +1,32 @@
+import json
 import logging
+import metrics
+import re
+import tempfile
 
+from catalog import isWritableBy
+from directory import Directory
+from gpgauth import GPGAuthSessionWrapper
+from jsonstream import iterArray
 from passboltapi.meta import PassboltAPI
 from passboltapi.meta import PassboltAPIError
+from requests.utils import dict_from_cookiejar
+from resource import Resource
+from transport import PassboltTransport
+from urllib.parse import urlparse
 
 
 class PassboltServer:
     """Defines a Passbolt instance with its fingerprint, its url, ..."""
 
     logger = logging.getLogger('PassboltServer')
+    # Maximum number of resource IDs sent in a single request
+    resourceIDsChunkSize = 50
+    uuidPattern = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+    # Size of the chunks read when streaming a response
+    streamChunkSize = 64 * 1024
+    # Listings larger than this are spooled to a temporary file instead of memory
+    streamSpoolSize = 16 * 1024 * 1024
 
     """
     Builds and inits the passboltServer
@@ -25,13 +44,59 @@ class PassboltServer:
             'verifyCert': self.configManager.server()['verifyCert']
         })
 
+        # Connection pool shared by the successive sessions opened on the server
+        self.transport = PassboltTransport(configManager)
+
         self.csrfToken = None
         self.cachedUserID = None
         self.cachedGroupIDs = None
 
+        # Users and groups of the server, loaded once authenticated
+        self.directory = Directory(self)
+
     def __str__(self):
         return '> Server URI : {}\n> Server fingerprint : {}\n'.format(self.api.uri, self.fingerprint)
 
+    """
+    Authenticate to the server with the key of the configured user, re-using the session of a previous run if it is
+    still valid. Returns True if the authentication is successful.
+    """
+    def authenticate(self):
+        self.api.session = GPGAuthSessionWrapper.forConfiguration(self.configManager, self.keyring)
+        self.transport.mount(self.api.session)
+        authenticated = self.api.session.resumeOrAuthenticate(self.fingerprint)
+        if authenticated:
+            self.api.session.hooks['response'].append(self.__recordRequestMetrics)
+        return authenticated
+
+    """
+    Make sure that the session is still valid, authenticating again if it has expired. Returns True if the session is
+    valid.
+    """
+    def ensureAuthenticated(self):
+        if self.api.session is None:
+            return self.authenticate()
+        return self.api.session.resumeOrAuthenticate(self.fingerprint)
+
+    """
+    Load the users and groups of the server again, for processes running longer than a single renewal.
+    """
+    def reloadDirectory(self):
+        self.directory.load()
+        # The groups of the current user may have changed as well
+        self.cachedGroupIDs = None
+
+    def __recordRequestMetrics(self, response, *args, **kwargs):
+        # Replace the IDs in the path so that requests to the same endpoint share the same metric
+        endpoint = self.uuidPattern.sub('{id}', urlparse(response.request.url).path.replace('//', '/'))
+        # The latency of the whole call, retries included, is set by the transport
+        latency = getattr(response, 'latency', response.elapsed.total_seconds())
+        self.logger.debug('[{} {}] returned [{}] in [{:.3f}]s after [{}] attempts'
+                          .format(response.request.method, endpoint, response.status_code, latency,
+                                  getattr(response, 'attempts', 1)))
+        metrics.registry.observe('api_request_duration_seconds', latency,
+                                 method=response.request.method, endpoint=endpoint, status=response.status_code)
+
     def fetchServerIdentity(self):
         if not self.api.uri:
             raise ValueError('The server URI is undefined.')
@@ -70,17 +135,21 @@ class PassboltServer:
         self.configManager.persist()
 
     def resolveGroupsByName(self, groupNames):
-        serverGroups = self.api.groups.get()
-        resolvedGroups = []
+        if self.directory.loaded:
+            resolvedGroups = [{'Group': self.directory.getGroup(self.directory.getGroupIDByName(x))}
+                              for x in groupNames if self.directory.getGroupIDByName(x)]
+        else:
+            serverGroups = self.api.groups.get()
+            resolvedGroups = []
 
-        # Lower each of the group names to reduce the risk of failed maching due to bad case
-        groupNames = [x.lower() for x in groupNames]
+            # Lower each of the group names to reduce the risk of failed maching due to bad case
+            groupNames = [x.lower() for x in groupNames]
 
-        for currentGroup in serverGroups:
-            currentGroupName = currentGroup['Group']['name']
-            self.logger.debug('Looking at group [{}]'.format(currentGroupName))
-            if currentGroupName.lower() in groupNames:
-                resolvedGroups.append(currentGroup)
+            for currentGroup in serverGroups:
+                currentGroupName = currentGroup['Group']['name']
+                self.logger.debug('Looking at group [{}]'.format(currentGroupName))
+                if currentGroupName.lower() in groupNames:
+                    resolvedGroups.append(currentGroup)
 
         if len(resolvedGroups) == 0:
             raise ValueError('No group found with name [{}].'.format(groupNames))
@@ -96,24 +165,108 @@ class PassboltServer:
         )
 
     """
-    Will return a list of groups for which the current user is in (as a standard user or as a manager.)
-    This list will only be made from group IDs in a table. Returns None if the group list could not be fetched.
+    Same as #fetchResourcesForGroups, but yields the resources one by one while the response is being received.
+    @param withSecrets : if False, the secrets of the resources are not fetched, see #fetchSecret
+    """
+    def streamResourcesForGroups(self, groupIDs, withSecrets=True):
+        params = {'contain[permissions.group]': 1,
+                  'contain[permission.user.profile]': 1,
+                  'filter[is-shared-with-group]': groupIDs}
+        if withSecrets:
+            params['contain[secret]'] = 1
+        return self.streamResources(params=params)
+
+    """
+    List the resources matching the given parameters, parsing the response incrementally so that the whole list never
+    has to be held in memory. Yields the resources JSON one by one.
+
+    The response is first read into a spool (kept in memory up to [streamSpoolSize], then in a temporary file) and
+    parsed from there, so that the connection is released as soon as the listing has been received instead of being
+    held open for as long as the caller takes to consume the resources.
+    """
+    def streamResources(self, params={}):
+        response = self.api.session.get(
+            self.api.buildURI('/resources.json'),
+            params=params,
+            headers={'Accept': 'application/json'},
+            verify=self.api.verifyCert,
+            stream=True
+        )
+        with tempfile.SpooledTemporaryFile(max_size=self.streamSpoolSize) as spool:
+            with response:
+                cookies = dict_from_cookiejar(self.api.session.cookies)
+                self.api.csrfToken = cookies.get('csrfToken', self.api.csrfToken)
+                if response.status_code != 200:
+                    self.logger.error('Failed to list resources on Passbolt')
+                    self.logger.debug(response)
+                    raise PassboltAPIError(response)
+
+                for chunk in response.iter_content(chunk_size=self.streamChunkSize):
+                    spool.write(chunk)
+
+            spool.seek(0)
+            yield from iterArray(iter(lambda: spool.read(self.streamChunkSize), b''), 'body')
+
+    """
+    Fetch the secret of the current user for the given resource.
+    """
+    def fetchSecret(self, resourceID):
+        secret = self.api.get(self.api.buildURI('/secrets/resource/{}.json'.format(resourceID)))
+        # Depending on the API version, the secret may or may not be wrapped
+        return secret.get('Secret', secret)
+
+    """
+    Fetch the public keys of the users, or only those modified after the given timestamp.
+    """
+    def fetchKeys(self, modifiedAfter=None):
+        params = {'filter[modified-after]': modifiedAfter} if modifiedAfter else {}
+        return self.api.get(self.api.buildURI('/gpgkeys.json'), params=params)
+
+    """
+    Fetch the resources having the given IDs. IDs are sent in chunks to keep the request URLs short.
+    @param wrap : if True, wrap each resource in a Resource object
+    """
+    def fetchResourcesByIDs(self, resourceIDs, wrap=True):
+        resources = list(self.streamResourcesByIDs(resourceIDs))
+        return [Resource(x) for x in resources] if wrap else resources
+
+    """
+    Same as #fetchResourcesByIDs, but yields the resources JSON one by one while they are being received.
+    @param withSecrets : if False, the secrets of the resources are not fetched, see #fetchSecret
+    """
+    def streamResourcesByIDs(self, resourceIDs, withSecrets=True):
+        for i in range(0, len(resourceIDs), self.resourceIDsChunkSize):
+            params = {'contain[permissions.group]': 1,
+                      'contain[permission.user.profile]': 1,
+                      'filter[has-id][]': resourceIDs[i:i + self.resourceIDsChunkSize]}
+            if withSecrets:
+                params['contain[secret]'] = 1
+            yield from self.streamResources(params=params)
+
+    """
+    Will return the set of groups for which the current user is in (as a standard user or as a manager.)
+    This set will only be made from group IDs. Returns None if the group list could not be fetched.
     """
     def fetchCurrentUserGroups(self):
-        if self.cachedGroupIDs:
+        if self.cachedGroupIDs is not None:
+            return self.cachedGroupIDs
+
+        if self.directory.loaded and self.directory.currentUserID:
+            self.cachedUserID = self.directory.currentUserID
+            self.cachedGroupIDs = set(self.directory.getUserGroupIDs(self.cachedUserID))
             return self.cachedGroupIDs
 
         groupsJson = self.api.groups.get(
             params={'contain[my_group_user]': 1}
         )
 
-        self.cachedGroupIDs = []
+        self.cachedGroupIDs = set()
         for element in groupsJson:
             if 'MyGroupUser' in element.keys():
                 # We use also this to cache the current user ID if possible
                 if self.cachedUserID is None:
                     self.cachedUserID = element['MyGroupUser']['user_id']
-                self.cachedGroupIDs.append(element['Group']['id'])
+                self.cachedGroupIDs.add(element['Group']['id'])
         return self.cachedGroupIDs
 
     def filterUpdatableResources(self, resources):
@@ -125,28 +278,29 @@ class PassboltServer:
         if self.cachedUserID is None or self.cachedGroupIDs is None:
             self.fetchCurrentUserGroups()
 
-        filteredResources = []
-        for resource in resources:
-            hasUserWriteAccess = False
-            for permissionSet in resource['Permission']:
-                if (((permissionSet['aro'] == 'Group' and permissionSet['aro_foreign_key'] in self.cachedGroupIDs)
-                    or (permissionSet['aro'] == 'User' and permissionSet['aro_foreign_key'] == self.cachedUserID))
-                    # Check for UPDTATE or OWNER rights
-                   and (permissionSet['type'] == 7 or permissionSet['type'] == 15)):
-                    hasUserWriteAccess = True
+        return [resource for resource in resources if self.isUpdatableResource(resource)]
 
-            # Check for write access and if the resource has a connector defined
-            if hasUserWriteAccess and resource.connectorType is not None:
-                filteredResources.append(resource)
+    """
+    Returns True if the current user can update the given resource, and if the resource has a connector defined.
+    """
+    def isUpdatableResource(self, resource):
+        if self.cachedUserID is None or self.cachedGroupIDs is None:
+            self.fetchCurrentUserGroups()
 
-        return filteredResources
+        # Check if the resource has a connector defined and for write access
+        return (resource.connectorType is not None
+                and isWritableBy(resource, self.cachedUserID, self.cachedGroupIDs))
 
-    def updateResource(self, resourceID, description, secretsPayload):
+    """
+    @param fields : other fields of the resource to update (name, username, uri), if any
+    """
+    def updateResource(self, resourceID, description, secretsPayload, fields=None):
         payload = {'description': description, 'secrets': secretsPayload}
+        payload.update(fields or {})
         self.logger.debug('Will update resource with payload : [{}]'.format(payload))
 
         try:
-            self.api.resources.put(resourceID, data=payload)
+            self.api.resources.put(resourceID, data=json.dumps(payload))
 
             self.logger.debug('Successfully updated resource [{}]'.format(resourceID))
             return True
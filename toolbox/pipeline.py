@@ -0,0 +1,261 @@
+import logging
+import queue
+import threading
+import time
+
+"""
+Minimal producer / consumer pipeline : items fed to the pipeline go through a list of stages, each stage being run
+by its own pool of threads. Stages are connected by bounded queues so that a slow stage applies back-pressure on the
+previous ones instead of letting items pile up in memory.
+"""
+
+# Marks the end of the input of a stage
+_END = object()
+
+
+class Stage:
+    logger = logging.getLogger('Stage')
+
+    """
+    @param name : the name of the stage, used when reporting the stage backlog
+    @param handler : function called with each item, returning the item to pass to the next stage, or None to drop it
+    @param workers : the number of threads running the stage
+    @param queueSize : the maximum number of items waiting in front of the stage
+    @param cancellable : if True, items waiting in front of the stage are dropped once the pipeline is stopped
+    @param errorHandler : function called with the item and the exception when the handler fails
+    @param batchSize : if greater than 1, the handler is called with the list of up to [batchSize] items waiting in
+    front of the stage, and returns the list of items to pass to the next stage. The errorHandler is then called
+    with each item of the batch.
+    """
+    def __init__(self, name, handler, workers=1, queueSize=0, cancellable=False, errorHandler=None, batchSize=1):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.cancellable = cancellable
+        self.errorHandler = errorHandler
+        self.batchSize = max(1, batchSize)
+
+        self.nextStage = None
+        self.threads = []
+        self.finishedWorkers = 0
+        self.statsLock = threading.Lock()
+
+        # Statistics used to find out which stage is the bottleneck
+        self.processed = 0
+        self.dropped = 0
+        self.busyTime = 0.0
+        self.maxBacklog = 0
+
+    def put(self, item):
+        self.queue.put(item)
+        backlog = self.queue.qsize()
+        if backlog > self.maxBacklog:
+            self.maxBacklog = backlog
+
+    def backlog(self):
+        return self.queue.qsize()
+
+    def start(self, stoppedEvent):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.__work, args=(stoppedEvent,),
+                                      name='{}-{}'.format(self.name, i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    """
+    Process the items of the stage until the end of the input. The end of the input is always forwarded to the next
+    stage, even if the worker dies, so that the following stages and Pipeline#join never wait forever.
+    """
+    def __work(self, stoppedEvent):
+        try:
+            if self.batchSize > 1:
+                self.__workInBatches(stoppedEvent)
+            else:
+                self.__workOnItems(stoppedEvent)
+        finally:
+            self.__finishWorker()
+
+    def __workOnItems(self, stoppedEvent):
+        while True:
+            item = self.queue.get()
+            if item is _END:
+                return
+
+            if self.cancellable and stoppedEvent.is_set():
+                self.__count(dropped=1)
+                continue
+
+            startTime = time.monotonic()
+            try:
+                result = self.handler(item)
+            except Exception as e:
+                self.logger.exception('Stage [{}] failed to process an item : [{}]'.format(self.name, e))
+                result = None
+                self.__handleError(item, e)
+            self.__count(processed=1, busyTime=time.monotonic() - startTime)
+
+            if result is not None and self.nextStage:
+                self.nextStage.put(result)
+
+    """
+    Wait for an item, then take the other items already waiting in front of the stage, without waiting for more,
+    and process them together.
+    """
+    def __workInBatches(self, stoppedEvent):
+        finished = False
+        while not finished:
+            batch = []
+            item = self.queue.get()
+            while True:
+                if item is _END:
+                    finished = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batchSize:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch and self.cancellable and stoppedEvent.is_set():
+                self.__count(dropped=len(batch))
+            elif batch:
+                self.__processBatch(batch)
+
+    def __processBatch(self, batch):
+        startTime = time.monotonic()
+        try:
+            results = self.handler(batch) or []
+        except Exception as e:
+            self.logger.exception('Stage [{}] failed to process a batch of [{}] items : [{}]'
+                                  .format(self.name, len(batch), e))
+            results = []
+            for item in batch:
+                self.__handleError(item, e)
+        self.__count(processed=len(batch), busyTime=time.monotonic() - startTime)
+
+        if self.nextStage:
+            for result in results:
+                self.nextStage.put(result)
+
+    """
+    Call the error handler of the stage for the given item. Errors of the handler itself are only logged, so that they
+    never stop the worker.
+    """
+    def __handleError(self, item, exception):
+        if not self.errorHandler:
+            return
+        try:
+            self.errorHandler(item, exception)
+        except Exception as e:
+            self.logger.exception('Stage [{}] failed to handle the error of an item : [{}]'.format(self.name, e))
+
+    def __count(self, processed=0, dropped=0, busyTime=0.0):
+        with self.statsLock:
+            self.processed += processed
+            self.dropped += dropped
+            self.busyTime += busyTime
+
+    def __finishWorker(self):
+        with self.statsLock:
+            self.finishedWorkers += 1
+            lastWorker = self.finishedWorkers == self.workers
+
+        # The last worker to finish forwards the end of the input to the next stage
+        if lastWorker and self.nextStage:
+            self.nextStage.close()
+
+    def close(self):
+        for i in range(self.workers):
+            self.queue.put(_END)
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def isAlive(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+
+class Pipeline:
+    logger = logging.getLogger('Pipeline')
+
+    """
+    @param queueSize : the default maximum number of items waiting in front of each stage
+    @param reportInterval : the number of seconds between two reports of the stage backlogs, 0 to disable them
+    """
+    def __init__(self, queueSize=16, reportInterval=30):
+        self.queueSize = queueSize
+        self.reportInterval = reportInterval
+        self.stages = []
+        self.stopped = threading.Event()
+        self.finished = threading.Event()
+        self.closed = False
+
+    def addStage(self, name, handler, workers=1, cancellable=False, errorHandler=None, queueSize=None, batchSize=1):
+        stage = Stage(name, handler,
+                      workers=workers,
+                      queueSize=self.queueSize if queueSize is None else queueSize,
+                      cancellable=cancellable,
+                      errorHandler=errorHandler,
+                      batchSize=batchSize)
+        if self.stages:
+            self.stages[-1].nextStage = stage
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start(self.stopped)
+
+        if self.reportInterval > 0:
+            threading.Thread(target=self.__reportBacklogs, name='pipeline-monitor', daemon=True).start()
+
+    """
+    Send an item to the first stage of the pipeline. This call blocks while the first stage is full.
+    Returns False if the pipeline has been stopped and the item was not accepted.
+    """
+    def feed(self, item):
+        if self.stopped.is_set():
+            return False
+        self.stages[0].put(item)
+        return True
+
+    """
+    Signal that no more items will be fed, and wait for every stage to finish.
+    """
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.stages[0].close()
+        self.join()
+
+    def join(self):
+        for stage in self.stages:
+            # Join with a timeout so that the main thread stays responsive to KeyboardInterrupt
+            while stage.isAlive():
+                stage.join(0.5)
+        self.finished.set()
+        self.logReport()
+
+    """
+    Stop accepting new items. Items waiting in front of cancellable stages are dropped, while items already past
+    those stages are processed until the end of the pipeline.
+    """
+    def stop(self):
+        self.stopped.set()
+
+    def backlogs(self):
+        return [(stage.name, stage.backlog()) for stage in self.stages]
+
+    def __reportBacklogs(self):
+        while not self.finished.wait(self.reportInterval):
+            self.logger.info('Stage backlogs : {}'.format(
+                ', '.join(['{} [{}]'.format(name, backlog) for name, backlog in self.backlogs()])))
+
+    def logReport(self):
+        for stage in self.stages:
+            self.logger.info('Stage [{}] : processed [{}], dropped [{}], busy [{:.2f}s], max backlog [{}]'
+                             .format(stage.name, stage.processed, stage.dropped, stage.busyTime, stage.maxBacklog))
@@ -1,201 +1,604 @@
 import importlib
 import logging
+import metrics
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from connectors.meta import PasswordUpdateError
-from connectors.xwiki import XWikiConnector
+from index import ResourceIndex
+from itertools import islice
+from journal import FINAL_STATES
+from journal import RenewalJournal
+from journal import STATE_COMMITTED
+from journal import STATE_DECRYPTED
+from journal import STATE_ERROR
+from journal import STATE_FAILED
+from journal import STATE_ROLLED_BACK
+from journal import STATE_SELECTED
+from journal import STATE_SERVICE_UPDATED
+from journal import STATE_SKIPPED
+from pipeline import Pipeline
 from reports import ReportManager
 from resource import Resource
 from secrets import token_urlsafe
+from store import MetadataStore
 
 
 class RenewHelper:
     logger = logging.getLogger('RenewHelper')
+    # State recorded in the journal for each category of the renewal statistics
+    resultStates = {
+        'success': STATE_COMMITTED,
+        'failures': STATE_FAILED,
+        'rollback': STATE_ROLLED_BACK,
+        'errors': STATE_ERROR
+    }
 
-    def __init__(self, configManager, keyringManager, passboltServer):
+    def __init__(self, configManager, keyringManager, cryptoService, passboltServer):
         self.configManager = configManager
         self.keyringManager = keyringManager
+        self.cryptoService = cryptoService
         self.passboltServer = passboltServer
 
+        # Protects the renewal statistics when resources are renewed concurrently
+        self.statsLock = threading.Lock()
+        # Limits the number of concurrent password changes per connector alias
+        self.connectorSemaphores = self.__buildConnectorSemaphores()
+
     def run(self, args):
         # First try to authenticate
-        if self.passboltServer.api.authenticate(self.keyringManager.keyring,
-                                                self.configManager.user()['fingerprint'],
-                                                self.configManager.server()['fingerprint']):
-            resources = self.__fetchResources(args)
-
-            reportManager = ReportManager(self.configManager, args)
-            # Initialize a map that will contain the statistics of the renewal
-            renewalStats = {
-                'foundItems': 0,
-                'renewableItems': 0,
-                'items': {
-                    'success': [],   # Successfully renewed, no problem
-                    'failures': [],  # The service did not accept the renewal
-                    'rollback': [],  # The password was renewed but not committed to passbolt, so it has been rollbacked
-                    'errors': []     # Everything failed, including the rollback of the password
-                }
-            }
-
-            # In the case where we are renewing resources that belong to a group, we will need
-            # to filter which resources are shared with edit rights, and which resources are not shared with
-            # this right
-            if not args.personal:
-                self.logger.info('Found [{}] resources available'.format(len(resources)))
-                renewalStats['foundItems'] = len(resources)
-                resources = self.passboltServer.filterUpdatableResources(resources)
-
-            self.logger.info('Found [{}] resources that can be renewed'.format(len(resources)))
-
-            if args.limit != 0 and len(resources) >= args.limit:
-                self.logger.info('Limiting renewal to the first [{}] resources'.format(args.limit))
-                resources = resources[:len(resources) - args.limit]
-
-            renewalStats['renewableItems'] = len(resources)
+        if self.passboltServer.authenticate():
+            self.passboltServer.directory.load()
+            self.renew(args)
+        else:
+            self.logger.error('Failed to authenticate to the Passbolt server.')
 
-            try:
-                for resource in resources:
-                    self.__renewResource(resource, args, renewalStats)
-            except KeyboardInterrupt:
-                self.logger.info('Interrupted, sending report and exiting ...')
+    """
+    Renew the resources selected by the given arguments, once authenticated to the server and its directory loaded.
+    Returns the statistics of the renewal, or None if the renewal could not start.
+    """
+    def renew(self, args):
+        startTime = time.monotonic()
+        reportManager = ReportManager(self.configManager, args)
+        # Initialize a map that will contain the statistics of the renewal
+        self.renewalStats = {
+            'foundItems': 0,
+            'renewableItems': 0,
+            'items': {
+                'success': [],   # Successfully renewed, no problem
+                'failures': [],  # The service did not accept the renewal
+                'rollback': [],  # The password was renewed but not committed to passbolt, so it has been rollbacked
+                'errors': []     # Everything failed, including the rollback of the password
+            },
+            # Updates of resources sent to Passbolt by the commit stage
+            'commits': {'batches': 0, 'committed': 0, 'failed': 0}
+        }
+        self.args = args
+        # IDs of the resources given with --resources that could not be fetched from the server
+        self.missingResourceIDs = set()
+        # Set when the renewal has been interrupted by the user
+        self.interrupted = False
+        # When enabled, resources are first listed without their secret, and the secrets of the resources selected
+        # for renewal are fetched afterwards
+        self.twoPhaseFetch = self.configManager.parameters().get('pipeline', {}).get('two-phase-fetch', False)
+        indexConfig = self.configManager.parameters().get('index', {})
+        self.index = (ResourceIndex(self.passboltServer, fullSyncInterval=indexConfig.get('full-sync-interval', 7))
+                      if indexConfig.get('enabled', False) else None)
+        self.journal = RenewalJournal(enabled=not args.dryRun)
+        # Records the renewed resources, so that the stale command can select the next ones to renew
+        storeEnabled = self.configManager.parameters().get('metadata-store', {}).get('enabled', True)
+        self.store = MetadataStore(self.configManager) if storeEnabled and not args.dryRun else None
+        # Import the missing keys of every user with a single gpg call, instead of importing them while secrets are
+        # being encrypted
+        self.keyringManager.maybeImportUsers(self.passboltServer.directory.usersWithKeys())
 
-            # At the end of the process, show and / or send a report
-            reportManager.sendReports(renewalStats)
+        if args.resume:
+            tasks = self.__resumeTasks()
         else:
-            self.logger.error('Failed to authenticate to the Passbolt server.')
+            tasks = self.__selectTasks()
 
-    def __renewResource(self, resource, args, renewalStats):
-        resourceID = resource['Resource']['id']
-        resourceName = resource['Resource']['name']
-        self.logger.debug('Renewing resource "{}"'.format(resourceName, resourceID))
+        if tasks is None:
+            return None
 
-        # Generate the new password
-        newPassword = token_urlsafe(32)
+        if self.store is not None:
+            self.store.open()
+        try:
+            if self.__renewTasks(tasks):
+                self.journal.finishRun()
+            else:
+                self.interrupted = True
+        finally:
+            if self.store is not None:
+                self.store.close()
 
-        connector = self.__createConnector(resource, newPassword)
-        if connector:
-            try:
-                if not args.dryRun:
-                    connector.updatePassword()
-
-                self.logger.debug('Renew success ! Updating resource on Passbolt ...')
-                resource.markAsUpdated()
-
-                # Get a map of users having access to the resource + their pubkey
-                resourceUsersMap = {}
-
-                # List the groups to which this resource belongs
-                resourceUserIDs = []
-                resourceGroupIDs = []
-                for permissionSet in resource['Permission']:
-                    if permissionSet['aro'] == 'Group':
-                        resourceGroupIDs.append(permissionSet['aro_foreign_key'])
-                    elif permissionSet['aro'] == 'User':
-                        resourceUserIDs.append(permissionSet['aro_foreign_key'])
-
-                # Resolve users in the given groups
-                # TODO : Add group cache
-                for resourceGroupID in resourceGroupIDs:
-                    group = self.passboltServer.api.groups.get(resourceGroupID)
-                    self.keyringManager.maybeImportGroupUsers(group['GroupUser'])
-                    for groupUser in group['GroupUser']:
-                        resourceUsersMap[groupUser['User']['id']] = groupUser['User']['Gpgkey']['key_id']
-
-                # TODO : Add user cache
-                for resourceUserID in resourceUserIDs:
-                    # The user might also be in a group, in that case, it's useless to add it twice
-                    if resourceUserID not in resourceUsersMap:
-                        user = self.passboltServer.api.users.get(resourceUserID)
-                        self.keyringManager.maybeImportUser(user)
-                        resourceUsersMap[resourceUserID] = user['Gpgkey']['key_id']
-
-                # We now have a map of user IDs with their key ID, that way we can proceed to
-                # the encryption of the new password.
-                secretsPayload = []
-                for userID in resourceUsersMap.keys():
-                    # Encrypt the password, create the secrets payload
-                    userKeyID = resourceUsersMap[userID]
-                    self.logger.debug('Encrypting password for user [{}] ({})'.format(userID, userKeyID))
-                    secretsPayload.append({
-                        'user_id': userID,
-                        'data': self.keyringManager.keyring.encrypt(newPassword, userKeyID).data.decode('utf-8')
-                    })
-
-                if not args.dryRun:
-                    if self.passboltServer.updateResource(resourceID,
-                                                          resource.generateDescription(), secretsPayload):
-                        self.logger.info('Resource [{}] successfully renewed and updated'.format(resourceName))
-                        renewalStats['items']['success'].append({'resource': resource})
-                    else:
-                        self.logger.error('Failed to renew resource "{}" [{}], rolling back ...'
-                                          .format(resourceName, resourceID))
-                        if connector.rollbackPasswordUpdate():
-                            self.logger.info('Password successfully rolled back')
-                            renewalStats['items']['rollback'].append({'resource': resource})
-                        else:
-                            self.logger.error('''*** Heads up ! *** Password has been updated on the service,
-but could not be saved on Passbolt. Password rollback also failed.''')
-                            self.logger.error(secretsPayload)
-                            renewalStats['items']['errors'].append({'resource': resource,
-                                                                    'payload': secretsPayload})
-                else:
-                    self.logger.info('Skipping the update of [{}] on Passbolt as dry-run is activated'
-                                     .format(resourceName))
-                    renewalStats['items']['success'].append({'resource': resource})
-            except PasswordUpdateError as e:
-                self.logger.error('Failed to renew resource [{}] : [{}]'.format(resourceName, e))
-                renewalStats['items']['failures'].append({'resource': resource})
-        elif resource.connectorType is not None:
+        metrics.registry.setGauge('run_duration_seconds', time.monotonic() - startTime, action='renew')
+        metrics.registry.setGauge('run_timestamp_seconds', time.time(), action='renew')
+        # Keep the keys fetched during the renewal for the next runs
+        self.passboltServer.directory.saveCache()
+
+        # At the end of the process, show and / or send a report
+        reportManager.sendReports(self.renewalStats)
+        return self.renewalStats
+
+    """
+    Fetch and filter the resources to renew, and start a new run in the journal.
+    Returns None if the renewal cannot start.
+    """
+    def __selectTasks(self):
+        unsafeResourceIDs = self.journal.unsafeResources()
+        if self.journal.enabled and unsafeResourceIDs:
+            self.logger.error('The previous renewal was interrupted while renewing the resources [{}]. '
+                              'Please run the renewal with --resume first.'.format(', '.join(unsafeResourceIDs)))
+            return None
+
+        self.journal.startRun({'personal': self.args.personal, 'group': self.args.group,
+                               'resources': self.args.resources})
+        return self.__iterSelectedTasks()
+
+    """
+    Yields the tasks of the resources to renew, as the resources are received from the server.
+    """
+    def __iterSelectedTasks(self):
+        resources = self.__fetchResources(self.args)
+
+        # In the case where we are renewing resources that belong to a group, we will need
+        # to filter which resources are shared with edit rights, and which resources are not shared with
+        # this right
+        if not self.args.personal:
+            resources = filter(self.passboltServer.isUpdatableResource, resources)
+
+        if self.args.limit != 0:
+            self.logger.info('Limiting renewal to the first [{}] resources'.format(self.args.limit))
+            resources = islice(resources, self.args.limit)
+
+        for resource in resources:
+            self.journal.record(resource['Resource']['id'], STATE_SELECTED)
+            yield RenewalTask(resource)
+
+        self.logger.info('Found [{}] resources available'.format(self.renewalStats['foundItems']))
+
+    """
+    Build the tasks needed to finish the last run recorded in the journal :
+    * resources that were not renewed yet are renewed
+    * resources that were updated on their service but not committed are committed, or rolled back if this fails
+    * resources whose renewal is over are skipped
+    Returns None if there is nothing to resume.
+    """
+    def __resumeTasks(self):
+        runRecord, finished, resourceRecords = self.journal.loadLastRun()
+        if runRecord is None or finished:
+            self.logger.info('The last renewal is complete, nothing to resume.')
+            return None
+
+        self.journal.resumeRun(runRecord)
+        pendingRecords = {resourceID: record for resourceID, record in resourceRecords.items()
+                          if record['state'] not in FINAL_STATES}
+        self.logger.info('Resuming the renewal of [{}] resources'.format(len(pendingRecords)))
+
+        tasks = []
+        for resource in self.passboltServer.fetchResourcesByIDs(list(pendingRecords.keys())):
+            task = RenewalTask(resource)
+            record = pendingRecords.pop(resource['Resource']['id'])
+            if 'secret' in record:
+                # Re-use the password that may already be set on the service
+                task.newPassword = self.cryptoService.decrypt(record['secret'])
+            if record['state'] == STATE_SERVICE_UPDATED and task.newPassword is None:
+                # Committing a new password would not match the one set on the service
+                self.logger.error('*** Heads up ! *** The password of [{}] has been updated on its service, but '
+                                  'could not be found in the journal. It has to be reset manually.'
+                                  .format(resource['Resource']['name']))
+                self.__recordResult('errors', {'resource': resource, 'payload': None})
+                continue
+            elif record['state'] == STATE_SERVICE_UPDATED:
+                task.serviceUpdated = True
+            elif record['state'] == STATE_DECRYPTED:
+                self.logger.warning('The password of [{}] may or may not have been updated on its service, '
+                                    'trying the journaled password first'.format(resource['Resource']['name']))
+                task.mayBeUpdated = True
+            tasks.append(task)
+
+        for resourceID, record in pendingRecords.items():
+            self.logger.warning('Resource [{}] is not available anymore, skipping it'.format(resourceID))
+            self.journal.record(resourceID, STATE_SKIPPED)
+        return tasks
+
+    """
+    Send the resources through the renewal pipeline. Each resource goes through the following stages :
+    * prepare : decrypt the old password and instantiate the connector of the resource
+    * update : update the password on the service, with [args.workers] threads
+    * encrypt : resolve the users having access to the resource and encrypt the new password for each of them
+    * commit : save the new secrets on Passbolt, or rollback the password on the service if this fails. Resources
+      waiting to be committed are sent to Passbolt concurrently, with at most [pipeline.commit-window] updates in flight
+    """
+    def __renewTasks(self, tasks):
+        pipelineConfig = self.configManager.parameters().get('pipeline', {})
+        self.commitWindow = max(1, pipelineConfig.get('commit-window', 8))
+        self.commitExecutor = ThreadPoolExecutor(max_workers=self.commitWindow, thread_name_prefix='commit')
+        pipeline = self.__buildPipeline()
+        pipeline.start()
+        try:
+            for task in tasks:
+                if not pipeline.feed(task):
+                    break
+                self.renewalStats['renewableItems'] += 1
+            self.logger.info('Found [{}] resources that can be renewed'.format(self.renewalStats['renewableItems']))
+            pipeline.close()
+            return True
+        except KeyboardInterrupt:
+            # Resources that are already updated on their service will be committed or rolled back,
+            # the other ones are dropped and can be renewed later with --resume
+            self.logger.info('Interrupted, finishing the renewal of resources already updated, then exiting ...')
+            pipeline.stop()
+            pipeline.close()
+            return False
+        except Exception:
+            # Most likely the listing of the resources failed. Resources already in the pipeline are drained the same
+            # way, so that the commit executor is only shut down once nothing can be submitted to it anymore
+            self.logger.error('Failed to select the resources to renew, finishing the renewal of resources already '
+                              'updated, then exiting ...')
+            pipeline.stop()
+            pipeline.close()
+            raise
+        finally:
+            if hasattr(tasks, 'close'):
+                # Release the listing of the resources if it has not been consumed entirely
+                tasks.close()
+            self.commitExecutor.shutdown()
+
+    def __buildPipeline(self):
+        pipelineConfig = self.configManager.parameters().get('pipeline', {})
+        pipeline = Pipeline(queueSize=pipelineConfig.get('queue-size', 16),
+                            reportInterval=pipelineConfig.get('report-interval', 30))
+        if self.twoPhaseFetch:
+            pipeline.addStage('secret', self.__fetchSecretTask,
+                              workers=pipelineConfig.get('secret-workers', 4),
+                              cancellable=True,
+                              errorHandler=self.__handleTaskError)
+        pipeline.addStage('prepare', self.__prepareTask,
+                          workers=pipelineConfig.get('prepare-workers', 2),
+                          cancellable=True,
+                          errorHandler=self.__handleTaskError)
+        pipeline.addStage('update', self.__updateTask,
+                          workers=self.args.workers,
+                          cancellable=True,
+                          errorHandler=self.__handleTaskError)
+        pipeline.addStage('encrypt', self.__encryptTask,
+                          workers=pipelineConfig.get('encrypt-workers', 2),
+                          errorHandler=self.__handleTaskError)
+        pipeline.addStage('commit', self.__commitTasks,
+                          workers=pipelineConfig.get('commit-workers', 1),
+                          queueSize=max(pipeline.queueSize, self.commitWindow),
+                          batchSize=self.commitWindow,
+                          errorHandler=self.__handleTaskError)
+        return pipeline
+
+    def __buildConnectorSemaphores(self):
+        semaphores = {}
+        for connectorName, connector in self.configManager.connectors().items():
+            maxWorkers = connector.get('max-workers')
+            if maxWorkers:
+                self.logger.debug('Limiting connector [{}] to [{}] concurrent renewals'
+                                  .format(connector['alias'], maxWorkers))
+                semaphores[connector['alias']] = threading.BoundedSemaphore(maxWorkers)
+        return semaphores
+
+    """
+    Returns a context manager that holds one of the concurrent renewal slots of the given connector alias.
+    """
+    def __connectorSlot(self, connectorType):
+        semaphore = self.connectorSemaphores.get(connectorType)
+        return semaphore if semaphore else _NoLimit()
+
+    def __recordResult(self, category, item):
+        with self.statsLock:
+            self.renewalStats['items'][category].append(item)
+        metrics.registry.increment('renewed_resources_total', result=category,
+                                   connector=item['resource'].connectorType)
+        self.journal.record(item['resource']['Resource']['id'], self.resultStates[category])
+
+    """
+    Fetch the secret of resources that have been listed without their secret.
+    """
+    def __fetchSecretTask(self, task):
+        if task.resource.secret is None:
+            task.resource.secret = self.passboltServer.fetchSecret(task.resource['Resource']['id'])['data']
+        return task
+
+    def __prepareTask(self, task):
+        resourceID = task.resource['Resource']['id']
+        resourceName = task.resource['Resource']['name']
+        self.logger.debug('Renewing resource "{}"'.format(resourceName))
+
+        # Decrypt the old password
+        oldPassword = self.cryptoService.decrypt(task.resource.secret)
+        if task.newPassword is not None and task.newPassword == oldPassword:
+            # When resuming, the resource may have been committed right before the journal could record it
+            self.logger.info('Resource [{}] has already been renewed'.format(resourceName))
+            self.__recordResult('success', {'resource': task.resource})
+            return None
+
+        if task.newPassword is None:
+            # Generate the new password
+            task.newPassword = token_urlsafe(32)
+
+        task.connector = self.__createConnector(task.resource, oldPassword, task.newPassword)
+        if task.connector:
+            if not task.serviceUpdated:
+                # Keep the new password, encrypted for the current user, so that the renewal can be resumed
+                self.journal.record(resourceID, STATE_DECRYPTED, secret=self.cryptoService.encrypt(
+                    task.newPassword, self.configManager.user()['fingerprint']))
+            return task
+        elif task.resource.connectorType is not None:
             self.logger.info('Skipping resource [{}] as no connector is available.'.format(resourceName))
         else:
             self.logger.info('Skipping resource [{}] as no connector is defined.'.format(resourceName))
+        self.journal.record(resourceID, STATE_SKIPPED)
+
+    def __updateTask(self, task):
+        resource = task.resource
+        if task.serviceUpdated:
+            # The password has already been updated on the service before the renewal was resumed
+            resource.markAsUpdated()
+            return task
+
+        try:
+            if not self.args.dryRun and task.mayBeUpdated and self.__isServiceUpdated(task):
+                self.logger.info('The password of [{}] had already been updated on its service'
+                                 .format(resource['Resource']['name']))
+                task.serviceUpdated = True
+                self.journal.record(resource['Resource']['id'], STATE_SERVICE_UPDATED)
+            elif not self.args.dryRun:
+                with self.__connectorSlot(resource.connectorType):
+                    with metrics.registry.timer('connector_operation_duration_seconds',
+                                                operation='update', connector=resource.connectorType):
+                        task.connector.updatePassword()
+                task.serviceUpdated = True
+                self.journal.record(resource['Resource']['id'], STATE_SERVICE_UPDATED)
+
+            self.logger.debug('Renew success ! Updating resource on Passbolt ...')
+            resource.markAsUpdated()
+            return task
+        except PasswordUpdateError as e:
+            self.logger.error('Failed to renew resource [{}] : [{}]'.format(resource['Resource']['name'], e))
+            self.__recordResult('failures', {'resource': resource})
 
     """
-    Takes care of fetching every resource corresponding to the given criterias. Each resource will then be
-    wrapped in a Resource() to add specific methods for updating the resource metadata.
+    Check whether the service already accepts the journaled new password of a resumed task, without changing anything
+    on the service. Connectors that cannot check a password are not probed, and their password is updated again.
     """
-    def __fetchResources(self, args):
-        if args.personal:
-            rawResources = self.passboltServer.api.resources.get(
-                params={'contain[permissions.group]': 1,
-                        'contain[permission.user.profile]': 1,
-                        'contain[secret]': 1,
-                        'filter[is-owned-by-me]': 1}
-            )
+    def __isServiceUpdated(self, task):
+        resource = task.resource
+        with self.__connectorSlot(resource.connectorType):
+            with metrics.registry.timer('connector_operation_duration_seconds',
+                                        operation='check', connector=resource.connectorType):
+                passwordSet = task.connector.checkPassword(task.newPassword)
+        if passwordSet is None:
+            self.logger.debug('The connector of [{}] cannot check its password, updating it again'
+                              .format(resource['Resource']['name']))
+        return passwordSet is True
+
+    def __encryptTask(self, task):
+        resource = task.resource
+
+        # Get a map of users having access to the resource + their pubkey
+        recipients = self.passboltServer.directory.resolveRecipients(resource.groupPermissions,
+                                                                     resource.userPermissions)
+        # The resource fails, and is rolled back, if it cannot be encrypted for every user having access to it
+        self.keyringManager.importUsers(recipients.values())
+        resourceUsersMap = {userID: user['Gpgkey']['fingerprint'] for userID, user in recipients.items()}
+
+        # We now have a map of user IDs with their key fingerprint, that way we can proceed to
+        # the encryption of the new password.
+        self.logger.debug('Encrypting password for users [{}]'.format(list(resourceUsersMap.keys())))
+        messages = self.cryptoService.encryptMany(task.newPassword, set(resourceUsersMap.values()))
+        task.secretsPayload = [{'user_id': userID, 'data': messages[userKeyID]}
+                               for userID, userKeyID in resourceUsersMap.items()]
+        return task
+
+    """
+    Commit a batch of resources to Passbolt. The updates are sent concurrently, and only the resources whose update
+    failed are rolled back on their service. Errors are handled for each resource, so that a resource committed to
+    Passbolt is never rolled back because of another resource of the batch.
+    """
+    def __commitTasks(self, tasks):
+        if self.args.dryRun:
+            for task in tasks:
+                self.logger.info('Skipping the update of [{}] on Passbolt as dry-run is activated'
+                                 .format(task.resource['Resource']['name']))
+                self.__recordCommittedTask(task)
+            return
+
+        self.logger.debug('Committing a batch of [{}] resources'.format(len(tasks)))
+        futures = [(task, self.commitExecutor.submit(self.__updateResource, task)) for task in tasks]
+        failedTasks = []
+        for task, future in futures:
+            resourceName = task.resource['Resource']['name']
+            try:
+                updated = future.result()
+            except Exception as e:
+                self.logger.exception('Failed to update resource [{}] on Passbolt : [{}]'.format(resourceName, e))
+                updated = False
+
+            if updated:
+                self.logger.info('Resource [{}] successfully renewed and updated'.format(resourceName))
+                self.__recordCommittedTask(task)
+            else:
+                failedTasks.append(task)
+
+        with self.statsLock:
+            commitStats = self.renewalStats['commits']
+            commitStats['batches'] += 1
+            commitStats['committed'] += len(tasks) - len(failedTasks)
+            commitStats['failed'] += len(failedTasks)
+
+        for task in failedTasks:
+            self.logger.error('Failed to renew resource "{}" [{}], rolling back ...'
+                              .format(task.resource['Resource']['name'], task.resource['Resource']['id']))
+            try:
+                self.__rollbackTask(task)
+            except Exception as e:
+                self.logger.exception('Failed to record the rollback of resource [{}] : [{}]'
+                                      .format(task.resource['Resource']['name'], e))
+
+    """
+    Record a resource whose new password has been saved on Passbolt. The resource must not be rolled back anymore,
+    so errors are only logged.
+    """
+    def __recordCommittedTask(self, task):
+        try:
+            self.__recordResult('success', {'resource': task.resource})
+            if self.store is not None:
+                self.store.update(task.resource)
+        except Exception as e:
+            self.logger.exception('Resource [{}] has been committed to Passbolt, but could not be recorded : [{}]'
+                                  .format(task.resource['Resource']['name'], e))
+
+    def __updateResource(self, task):
+        resource = task.resource
+        startTime = time.monotonic()
+        updated = False
+        try:
+            updated = self.passboltServer.updateResource(resource['Resource']['id'], resource.generateDescription(),
+                                                         task.secretsPayload)
+            return updated
+        finally:
+            metrics.registry.observe('resource_update_duration_seconds', time.monotonic() - startTime,
+                                     connector=resource.connectorType, outcome='success' if updated else 'error')
+
+    def __rollbackTask(self, task):
+        resource = task.resource
+        try:
+            with self.__connectorSlot(resource.connectorType):
+                with metrics.registry.timer('connector_operation_duration_seconds',
+                                            operation='rollback', connector=resource.connectorType):
+                    # Connectors signal failures by raising PasswordUpdateError, some of them do not return anything
+                    rollbackSuccess = task.connector.rollbackPasswordUpdate() is not False
+        except PasswordUpdateError as e:
+            self.logger.error('Failed to rollback resource [{}] : [{}]'.format(resource['Resource']['name'], e))
+            rollbackSuccess = False
+        except Exception as e:
+            # Connectors may also fail with the errors of their transport (SSH, HTTP, ...)
+            self.logger.exception('Failed to rollback resource [{}] : [{}]'.format(resource['Resource']['name'], e))
+            rollbackSuccess = False
+
+        if rollbackSuccess:
+            self.logger.info('Password successfully rolled back')
+            self.__recordResult('rollback', {'resource': resource})
         else:
-            self.logger.debug('Resolving groups members')
-            groups = self.passboltServer.resolveGroupsByName(args.group)
+            self.logger.error('''*** Heads up ! *** Password has been updated on the service,
+but could not be saved on Passbolt. Password rollback also failed.''')
+            self.logger.error(task.secretsPayload)
+            self.__recordResult('errors', {'resource': resource, 'payload': task.secretsPayload})
 
-            # Get every password corresponding to the groups
-            groupsIDs = [x['Group']['id'] for x in groups]
-            self.logger.debug('Groups IDs : [{}]'.format(groupsIDs))
-            rawResources = self.passboltServer.fetchResourcesForGroups(groupsIDs)
+    """
+    Called when a stage fails unexpectedly on a task. If the password has already been changed on the service,
+    it needs to be rolled back as it will never be committed to Passbolt.
+    """
+    def __handleTaskError(self, task, exception):
+        if task.serviceUpdated:
+            self.__rollbackTask(task)
+        else:
+            self.__recordResult('failures', {'resource': task.resource})
+
+    """
+    Yields the resources matching the arguments of the renewal, wrapped in Resource objects.
+    Resources are streamed from the server, so that they can be renewed while the next ones are still being received.
+    """
+    def __fetchResources(self, args):
+        if args.resources:
+            rawResources = self.passboltServer.fetchResourcesByIDs(args.resources, wrap=False)
+            self.missingResourceIDs = set(args.resources) - set(x['Resource']['id'] for x in rawResources)
+            for resourceID in self.missingResourceIDs:
+                self.logger.warning('Resource [{}] could not be found, skipping it'.format(resourceID))
+        elif self.index is not None:
+            yield from self.__fetchIndexedResources(args)
+            return
+        elif args.personal:
+            params = {'contain[permissions.group]': 1,
+                      'contain[permission.user.profile]': 1,
+                      'filter[is-owned-by-me]': 1}
+            if not self.twoPhaseFetch:
+                params['contain[secret]'] = 1
+            rawResources = self.passboltServer.streamResources(params=params)
+        else:
+            rawResources = self.passboltServer.streamResourcesForGroups(self.__resolveGroupIDs(args),
+                                                                        withSecrets=not self.twoPhaseFetch)
 
         # Make sure that we wrap the resources in our super Resource object
-        # also remove every resource having a date not valid
-        # if we renew personal passwords, we also exclude resources shared with more than 1 person (the user itself)
-        filteredResources = []
         for rawResource in rawResources:
+            self.renewalStats['foundItems'] += 1
             resource = Resource(rawResource)
+            if self.__matchesArguments(resource, args):
+                yield resource
 
-            hasValidPerms = (True if (not args.personal or len(resource['Permission']) == 1) else False)
-            hasValidDate = False
-            if (args.before or args.after) and resource.lastUpdateDate is not None:
-                if ((not args.before or resource.lastUpdateDate <= args.before)
-                   and (not args.after or resource.lastUpdateDate >= args.after)):
-                    hasValidDate = True
-            else:
-                # Assume that the password needs to be initialized
-                hasValidDate = True
+    """
+    Select the resources to renew from the resource index, after having synchronized it, then fetch only the
+    selected resources from the server.
+    """
+    def __fetchIndexedResources(self, args):
+        self.index.load()
+        self.index.sync()
 
-            if hasValidDate and hasValidPerms:
-                filteredResources.append(resource)
+        catalog = self.index.catalog
+        if args.personal:
+            inScope = catalog.ownedBy(self.passboltServer.directory.currentUserID)
+        else:
+            inScope = catalog.sharedWithGroups(self.__resolveGroupIDs(args))
+        self.renewalStats['foundItems'] = len(inScope)
 
-        return filteredResources
+        if not args.personal:
+            self.passboltServer.fetchCurrentUserGroups()
+            inScope &= catalog.writableBy(self.passboltServer.cachedUserID, self.passboltServer.cachedGroupIDs)
+            inScope -= catalog.withConnector(None)
+        if args.before or args.after:
+            # Resources that have never been updated are renewed whatever the dates, as by #__matchesArguments
+            inScope &= catalog.updatedBetween(after=args.after, before=args.before) | catalog.neverUpdated()
 
-    def __createConnector(self, resource, newPassword):
-        # Decrypt the old password
-        oldPassword = str(self.keyringManager.keyring.decrypt(resource['Secret'][0]['data']))
+        selectedIDs = [x['Resource']['id'] for x in catalog.resolve(inScope) if self.__matchesArguments(x, args)]
+        self.logger.debug('Selected [{}] resources from the index'.format(len(selectedIDs)))
+
+        # Resources may have changed since the index has been synchronized, so check them again
+        missingIDs = set(selectedIDs)
+        for rawResource in self.passboltServer.streamResourcesByIDs(selectedIDs, withSecrets=not self.twoPhaseFetch):
+            resource = Resource(rawResource)
+            missingIDs.discard(resource['Resource']['id'])
+            self.index.update(resource)
+            if self.__matchesArguments(resource, args):
+                yield resource
+
+        # Resources that could not be fetched have been deleted, or are not shared with the user anymore
+        for resourceID in missingIDs:
+            self.index.remove(resourceID)
+        self.index.save()
+
+    def __resolveGroupIDs(self, args):
+        self.logger.debug('Resolving groups members')
+        groups = self.passboltServer.resolveGroupsByName(args.group)
+
+        # Get every password corresponding to the groups
+        groupsIDs = [x['Group']['id'] for x in groups]
+        self.logger.debug('Groups IDs : [{}]'.format(groupsIDs))
+        return groupsIDs
 
+    """
+    Remove every resource having a date not valid.
+    If we renew personal passwords, we also exclude resources shared with more than 1 person (the user itself).
+    """
+    def __matchesArguments(self, resource, args):
+        hasValidPerms = (True if (not args.personal or len(resource['Permission']) == 1) else False)
+        hasValidDate = False
+        if (args.before or args.after) and resource.lastUpdateDate is not None:
+            if ((not args.before or resource.lastUpdateDate <= args.before)
+               and (not args.after or resource.lastUpdateDate >= args.after)):
+                hasValidDate = True
+        else:
+            # Assume that the password needs to be initialized
+            hasValidDate = True
+
+        return hasValidDate and hasValidPerms
+
+    def __createConnector(self, resource, oldPassword, newPassword):
         if resource.connectorType is None:
             return None
         else:
@@ -210,3 +613,28 @@ but could not be saved on Passbolt. Password rollback also failed.''')
 
             self.logger.warning('Could not find any connector with alias [{}].'.format(resource.connectorType))
             return None
+
+
+class RenewalTask:
+    """State of a resource going through the renewal pipeline."""
+
+    def __init__(self, resource):
+        self.resource = resource
+        self.connector = None
+        self.newPassword = None
+        self.secretsPayload = None
+        # Whether the password has been changed on the service, and thus needs to be committed or rolled back
+        self.serviceUpdated = False
+        # Whether the new password may already be set on the service, when resuming a renewal interrupted while
+        # updating it
+        self.mayBeUpdated = False
+
+
+class _NoLimit:
+    """Context manager used for connectors that have no concurrency limit."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
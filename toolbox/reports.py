@@ -1,6 +1,10 @@
+import json
 import logging
+import metrics
+import os
 import smtplib
 
+from configuration import Environment as ConfigEnvironment
 from datetime import datetime
 from email.message import EmailMessage
 from jinja2 import Environment
@@ -16,6 +20,11 @@ class ReportManager:
         if self.args.mailReportRecipient:
             MailReporter(self.config, self.args, renewalStats).sendReport()
 
+        # The JSON summary is always written, the Prometheus file only when its path is configured
+        JSONMetricsReporter(self.config, self.args, renewalStats).sendReport()
+        if self.config.parameters().get('metrics', {}).get('prometheus-file'):
+            PrometheusReporter(self.config, self.args, renewalStats).sendReport()
+
 
 """
 Simple reporting interface.
@@ -67,3 +76,48 @@ class MailReporter(Reporter):
             msg['To'] = self.args.mailReportRecipient
 
             smtp.send_message(msg)
+
+
+"""
+Base class of the reporters exporting the metrics of the run (see metrics.py) to a file.
+"""
+
+
+class MetricsReporter(Reporter):
+    logger = logging.getLogger('MetricsReporter')
+
+    def _writeFile(self, path, content):
+        # Write to a temporary file first so that the file is never read while partially written
+        temporaryPath = '{}.tmp'.format(path)
+        with open(temporaryPath, 'w') as metricsFile:
+            metricsFile.write(content)
+        os.replace(temporaryPath, path)
+        self.logger.info('Metrics written to [{}]'.format(path))
+
+
+class JSONMetricsReporter(MetricsReporter):
+    logger = logging.getLogger('JSONMetricsReporter')
+
+    def sendReport(self):
+        summary = {
+            'date': datetime.now().isoformat(),
+            'foundItems': self.renewalStats['foundItems'],
+            'renewableItems': self.renewalStats['renewableItems'],
+            'items': {category: len(items) for category, items in self.renewalStats['items'].items()},
+            'commits': self.renewalStats.get('commits', {}),
+            'metrics': metrics.registry.toJSON()
+        }
+        path = self.config.parameters().get('metrics', {}).get('json-file') or ConfigEnvironment.metricsFilePath
+        self._writeFile(path, json.dumps(summary, indent=2))
+
+
+"""
+Writes the metrics in a file that can be collected by the textfile collector of the Prometheus node exporter.
+"""
+
+
+class PrometheusReporter(MetricsReporter):
+    logger = logging.getLogger('PrometheusReporter')
+
+    def sendReport(self):
+        self._writeFile(self.config.parameters()['metrics']['prometheus-file'], metrics.registry.toPrometheus())
@@ -1,28 +1,54 @@
 from datetime import datetime
 import logging
 import re
+import threading
+
+from catalog import splitPermissions
 
 """
-Wraps a resource JSON as returned by the Passbolt server to add specific methods.
+Wraps a resource JSON as returned by the Passbolt server to add specific methods.
 This is especially useful when dealing with resource metadata that we store as part of the description of the resource
 and that are thus not directly accessible.
+
+Only the fields of the JSON needed by the renewal are kept, and the metadata stored in the description are only parsed
+the first time they are accessed, so that large listings of resources stay cheap to hold and to filter.
 """
 
 
 class Resource:
+    __slots__ = ('resourceJSON', 'secret', 'groupPermissions', 'userPermissions',
+                 '__description', '__cleanDescription', '__lastUpdateDate', '__updateCount', '__connectorType')
+
     logger = logging.getLogger('Resource')
-    lastUpdatePropertyPattern = re.compile('^>>> Last password update : (\d{2}\/\d{2}\/\d{4})$')
-    updateCountPropertyPattern = re.compile('^>>> Update count : (\d*)$')
-    connectorTypePropertyPattern = re.compile('^>>> Connector : (.*)$')
+    metadataPattern = re.compile(r'^>>> (?:Last password update : (\d{2}/\d{2}/\d{4})'
+                                 r'|Update count : (\d*)'
+                                 r'|Connector : (.*))$')
     dateFormat = "%d/%m/%Y"
+    # Fields of the JSON kept for the resource and for each of its permissions
+    resourceFields = ('id', 'name', 'username', 'uri', 'modified')
+    permissionFields = ('aro', 'aro_foreign_key', 'type')
+    # Resources may be shared between the workers of a renewal
+    parseLock = threading.Lock()
 
     def __init__(self, resourceJSON):
-        # The pure JSON returned by the API
-        self.resourceJSON = resourceJSON
-        self.lastUpdateDate = None
-        self.updateCount = 0
-        self.connectorType = None
-        self.__parseResourceDescription()
+        # The subset of the JSON returned by the API that is used by the toolbox
+        self.resourceJSON = {
+            'Resource': {x: resourceJSON['Resource'].get(x) for x in self.resourceFields},
+            'Permission': [{x: permission.get(x) for x in self.permissionFields}
+                           for permission in resourceJSON.get('Permission', [])]
+        }
+        # The password of the resource encrypted for the current user, if it has been listed with the resource
+        secrets = resourceJSON.get('Secret')
+        self.secret = secrets[0]['data'] if secrets else None
+        # Group ID -> permission type and user ID -> permission type, for the groups and users having access
+        self.groupPermissions, self.userPermissions = splitPermissions(self.resourceJSON['Permission'])
+
+        # The description is only parsed when its metadata are first accessed
+        self.__description = resourceJSON['Resource'].get('description')
+        self.__cleanDescription = None
+        self.__lastUpdateDate = None
+        self.__updateCount = 0
+        self.__connectorType = None
 
     """
     Allow direct access to the JSON content when needed
@@ -30,45 +56,67 @@ class Resource:
     def __getitem__(self, key):
         return self.resourceJSON[key]
 
+    @property
+    def lastUpdateDate(self):
+        self.__parseResourceDescription()
+        return self.__lastUpdateDate
+
+    @property
+    def updateCount(self):
+        self.__parseResourceDescription()
+        return self.__updateCount
+
+    @property
+    def connectorType(self):
+        self.__parseResourceDescription()
+        return self.__connectorType
+
+    @property
+    def cleanDescription(self):
+        self.__parseResourceDescription()
+        return self.__cleanDescription
+
+    """
+    Split the metadata lines of the description from the other lines, with a single pattern matched once per line.
+    The raw description is released once parsed.
+    """
     def __parseResourceDescription(self):
-        self.logger.debug('Description : [{}]'.format(self.resourceJSON['Resource']['description']))
-        lines = (self.resourceJSON['Resource']['description'].split('\n')
-                 if self.resourceJSON['Resource']['description']
-                 else [])
-        self.logger.debug('Found description lines : [{}]'.format(lines))
-
-        self.cleanDescription = []
-        for line in lines:
-            updateDateMatch = self.lastUpdatePropertyPattern.match(line)
-            if updateDateMatch is not None:
-                self.lastUpdateDate = datetime.strptime(updateDateMatch.group(1), self.dateFormat)
-            else:
-                updateCountMatch = self.updateCountPropertyPattern.match(line)
-                if updateCountMatch is not None:
-                    self.updateCount = int(updateCountMatch.group(1))
+        if self.__cleanDescription is not None:
+            return
+
+        with self.parseLock:
+            if self.__cleanDescription is not None:
+                return
+
+            cleanDescription = []
+            for line in self.__description.split('\n') if self.__description else []:
+                match = self.metadataPattern.match(line)
+                if match is None:
+                    # We keep lines that are not related to the renewer
+                    cleanDescription.append(line)
+                elif match.group(1) is not None:
+                    self.__lastUpdateDate = datetime.strptime(match.group(1), self.dateFormat)
+                elif match.group(2) is not None:
+                    self.__updateCount = int(match.group(2))
                 else:
-                    connectorTypeMatch = self.connectorTypePropertyPattern.match(line)
-                    if connectorTypeMatch is not None:
-                        self.connectorType = connectorTypeMatch.group(1)
+                    self.__connectorType = match.group(3)
 
-            # We keep lines that are not related to the renewer
-            if (updateDateMatch is None
-               and updateCountMatch is None
-               and connectorTypeMatch is None):
-                self.cleanDescription.append(line)
+            self.__cleanDescription = cleanDescription
+            self.__description = None
 
-        self.logger.debug('Last update date : [{}]'.format(self.lastUpdateDate))
-        self.logger.debug('Update count : [{}]'.format(self.updateCount))
-        self.logger.debug('Connector type : [{}]'.format(self.connectorType))
-        self.logger.debug('Resulting description : [{}]'.format(self.cleanDescription))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('Parsed resource [{}] : last update date [{}], update count [{}], connector type [{}]'
+                              .format(self.resourceJSON['Resource']['id'], self.__lastUpdateDate, self.__updateCount,
+                                      self.__connectorType))
 
     """
     Registers that the resource has been updated, thus updating the description of the resouce
     for its last update date and its update count.
     """
     def markAsUpdated(self):
-        self.updateCount = self.updateCount + 1
-        self.lastUpdateDate = datetime.now()
+        self.__parseResourceDescription()
+        self.__updateCount = self.__updateCount + 1
+        self.__lastUpdateDate = datetime.now()
 
     def generateDescription(self):
         finalDescription = self.cleanDescription.copy()
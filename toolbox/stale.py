@@ -0,0 +1,67 @@
+import logging
+
+from datetime import datetime
+from datetime import timedelta
+
+from resource import Resource
+from store import MetadataStore
+
+"""
+Lists the resources that have not been renewed for a while, from the local MetadataStore, without contacting the
+server unless the store has to be rebuilt.
+"""
+
+
+class StaleHelper:
+    logger = logging.getLogger('StaleHelper')
+
+    def __init__(self, configManager, passboltServer=None):
+        self.configManager = configManager
+        self.passboltServer = passboltServer
+
+    """
+    Returns the exit status of the command.
+    """
+    def run(self, args):
+        store = MetadataStore(self.configManager)
+        store.open()
+        try:
+            if args.rebuild and not self.__rebuild(store):
+                return 1
+
+            if store.lastRebuild() is None:
+                self.logger.warning('The metadata store has never been rebuilt from the server, it only holds the '
+                                    'resources renewed since its creation. Use --rebuild to fill it.')
+
+            before = args.before
+            if args.olderThan is not None:
+                before = datetime.now() - timedelta(days=args.olderThan)
+            resources = store.stale(before=before, connector=args.connector, limit=args.limit)
+        finally:
+            store.close()
+
+        if not resources:
+            # Nothing to renew : nothing is printed, so that renew -r never gets an empty list
+            self.logger.info('No stale resource found')
+            return 1
+
+        if args.ids:
+            # Ready to be given to renew -r
+            print(','.join(x['id'] for x in resources))
+        else:
+            for resource in resources:
+                print('{}  {:<10}  {:<10}  {:>3}  {}'.format(
+                    resource['id'], resource['connector'] or '-', resource['lastUpdate'] or 'never',
+                    resource['updateCount'], resource['name']))
+        return 0
+
+    def __rebuild(self, store):
+        if not self.passboltServer.authenticate():
+            self.logger.error('Failed to authenticate to the Passbolt server.')
+            return False
+
+        # Resources are listed without their secret nor their permissions, only their description is needed
+        self.logger.info('Fetching every resource to rebuild the metadata store')
+        storedResources = store.rebuild(Resource(x) for x in self.passboltServer.streamResources())
+        self.logger.info('Rebuilt the metadata store with [{}] resources'.format(storedResources))
+        return True
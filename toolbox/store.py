@@ -0,0 +1,139 @@
+import logging
+import os
+import sqlite3
+import threading
+
+from datetime import datetime
+from datetime import timezone
+
+from configuration import Environment
+
+"""
+Local SQLite store of the renewal metadata of the resources (connector, date of the last renewal and number of
+renewals), which are otherwise only available in the descriptions of the resources on the server.
+
+The store is updated by every successful renewal, and can be rebuilt from the resources of the server. It is indexed
+by connector and by date of last renewal, so that the resources to renew can be selected without listing the server.
+"""
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS resources ('
+    '    id TEXT PRIMARY KEY,'
+    '    name TEXT,'
+    '    connector TEXT,'
+    '    last_update TEXT,'
+    '    update_count INTEGER NOT NULL DEFAULT 0'
+    ')',
+    'CREATE INDEX IF NOT EXISTS resources_by_connector ON resources (connector, last_update)',
+    'CREATE INDEX IF NOT EXISTS resources_by_last_update ON resources (last_update)',
+    'CREATE TABLE IF NOT EXISTS properties (key TEXT PRIMARY KEY, value TEXT)'
+]
+
+
+class MetadataStore:
+    logger = logging.getLogger('MetadataStore')
+    # Dates of last renewal are stored as ISO dates, so that they can be compared as text
+    dateFormat = '%Y-%m-%d'
+
+    def __init__(self, configManager, path=Environment.metadataStoreFilePath):
+        self.configManager = configManager
+        self.path = path
+        # Renewed resources are recorded by the threads committing them
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def open(self):
+        if not os.path.isfile(self.path):
+            # Create the store with restricted permissions, as it lists the resources of the user
+            os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+        # The store is only valid for the server and the user it has been built for
+        server = self.configManager.server()['uri']
+        user = self.configManager.user()['fingerprint']
+        properties = self.__properties()
+        if properties.get('server', server) != server or properties.get('user', user) != user:
+            self.logger.info('The metadata store has been built for another server or user, clearing it')
+            with self.connection:
+                self.connection.execute('DELETE FROM resources')
+                self.connection.execute('DELETE FROM properties')
+        self.__setProperties({'server': server, 'user': user})
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    """
+    Returns the time at which the store has last been rebuilt from the server, None if it never has.
+    """
+    def lastRebuild(self):
+        lastRebuild = self.__properties().get('lastRebuild')
+        return datetime.fromisoformat(lastRebuild) if lastRebuild else None
+
+    """
+    Replace the content of the store with the given resources, in a single transaction.
+    Returns the number of resources stored.
+    """
+    def rebuild(self, resources):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM resources')
+            cursor = self.connection.executemany('INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?)',
+                                                 (self.__toRow(x) for x in resources))
+            self.connection.execute('INSERT OR REPLACE INTO properties VALUES (?, ?)',
+                                    ('lastRebuild', datetime.now(timezone.utc).isoformat()))
+        return cursor.rowcount
+
+    def update(self, resource):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?)', self.__toRow(resource))
+
+    def remove(self, resourceID):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM resources WHERE id = ?', (resourceID,))
+
+    """
+    Returns the resources that have not been renewed since the given date, oldest first, as a list of maps with the
+    keys id, name, connector, lastUpdate and updateCount. Resources that have never been renewed come first.
+    @param before : only return the resources renewed before this date (or never renewed), every resource if None
+    @param connector : only return the resources using this connector alias, if given
+    @param limit : the maximum number of resources to return, 0 for no limit
+    """
+    def stale(self, before=None, connector=None, limit=0):
+        query = 'SELECT id, name, connector, last_update, update_count FROM resources WHERE 1 = 1'
+        params = []
+        if connector is not None:
+            query += ' AND connector = ?'
+            params.append(connector)
+        if before is not None:
+            query += ' AND (last_update IS NULL OR last_update < ?)'
+            params.append(before.strftime(self.dateFormat))
+        query += ' ORDER BY last_update IS NOT NULL, last_update, name'
+        if limit > 0:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [{'id': row[0], 'name': row[1], 'connector': row[2], 'lastUpdate': row[3], 'updateCount': row[4]}
+                for row in rows]
+
+    def __toRow(self, resource):
+        lastUpdateDate = resource.lastUpdateDate
+        return (resource['Resource']['id'],
+                resource['Resource']['name'],
+                resource.connectorType,
+                lastUpdateDate.strftime(self.dateFormat) if lastUpdateDate else None,
+                resource.updateCount)
+
+    def __properties(self):
+        with self.lock:
+            return dict(self.connection.execute('SELECT key, value FROM properties').fetchall())
+
+    def __setProperties(self, properties):
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO properties VALUES (?, ?)', properties.items())
@@ -0,0 +1,149 @@
+import logging
+import metrics
+import random
+import time
+
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectTimeout
+from requests.exceptions import ReadTimeout
+
+"""
+HTTP transport of the requests sent to Passbolt.
+
+Requests go through a pool of keep-alive connections shared by the workers of a run, with a timeout on each request.
+Requests failing with a retryable error (connection errors, timeouts, 429 and 5xx gateway errors) are sent again after
+a jittered exponential backoff, or after the delay asked by the server with a Retry-After header.
+"""
+
+
+class RetryingHTTPAdapter(HTTPAdapter):
+    logger = logging.getLogger('RetryingHTTPAdapter')
+    retryableStatuses = frozenset([429, 502, 503, 504])
+    # Methods that can safely be sent again if the server may have processed them already
+    idempotentMethods = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+    """
+    @param poolSize : the maximum number of connections kept open, threads wait for a free connection past this limit
+    @param timeout : the default (connect, read) timeout of the requests, in seconds
+    @param maxRetries : the number of times a failed request is sent again
+    @param backoffFactor : the maximum delay before the first retry, doubled on each retry
+    @param maxBackoff : the upper bound of the delay between two retries
+    @param maxRetryAfter : the upper bound of the delay asked by the server with a Retry-After header
+    """
+    def __init__(self, poolSize, timeout, maxRetries, backoffFactor, maxBackoff, maxRetryAfter):
+        super(RetryingHTTPAdapter, self).__init__(pool_connections=1, pool_maxsize=poolSize, max_retries=0,
+                                                  pool_block=True)
+        self.timeout = timeout
+        self.maxRetries = maxRetries
+        self.backoffFactor = backoffFactor
+        self.maxBackoff = maxBackoff
+        self.maxRetryAfter = maxRetryAfter
+
+    """
+    Send the request, retrying it on retryable errors. The returned response is annotated with the number of attempts
+    and the latency of the whole call, retries included.
+    """
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+
+        startTime = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                response = super(RetryingHTTPAdapter, self).send(request, timeout=timeout, **kwargs)
+            except (ConnectionError, ReadTimeout) as e:
+                if not self.__isRetryable(request, attempt, error=e):
+                    raise
+                reason = type(e).__name__
+                delay = self.__backoff(attempt)
+            else:
+                if not self.__isRetryable(request, attempt, status=response.status_code):
+                    response.attempts = attempt + 1
+                    response.latency = time.monotonic() - startTime
+                    return response
+                reason = 'HTTP {}'.format(response.status_code)
+                delay = max(self.__backoff(attempt), self.__retryAfter(response))
+                response.close()
+
+            attempt += 1
+            self.logger.warning('Request [{} {}] failed with [{}], retrying in [{:.2f}]s ({}/{})'
+                                .format(request.method, request.path_url.split('?')[0], reason, delay, attempt,
+                                        self.maxRetries))
+            metrics.registry.increment('api_request_retries_total', method=request.method, reason=reason)
+            time.sleep(delay)
+
+    def __isRetryable(self, request, attempt, status=None, error=None):
+        if attempt >= self.maxRetries:
+            return False
+        # The server has not processed the request if the connection could not be opened or if it asked to slow down
+        if isinstance(error, ConnectTimeout) or status == 429:
+            return True
+        if error is None and status not in self.retryableStatuses:
+            return False
+        return request.method in self.idempotentMethods
+
+    def __backoff(self, attempt):
+        return random.uniform(0, min(self.maxBackoff, self.backoffFactor * 2 ** attempt))
+
+    """
+    Returns the delay in seconds asked by the server with the Retry-After header of the response, 0 if there is none.
+    """
+    def __retryAfter(self, response):
+        retryAfter = response.headers.get('Retry-After')
+        if not retryAfter:
+            return 0
+
+        try:
+            delay = float(retryAfter)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retryAfter).timestamp() - time.time()
+            except (TypeError, ValueError):
+                self.logger.debug('Ignoring the invalid Retry-After header [{}]'.format(retryAfter))
+                return 0
+        return min(max(delay, 0), self.maxRetryAfter)
+
+
+class PassboltTransport:
+    """Holds the connection pool used by the sessions opened on Passbolt, so that it outlives re-authentications."""
+
+    logger = logging.getLogger('PassboltTransport')
+
+    def __init__(self, configManager):
+        transportConfig = configManager.parameters().get('transport', {})
+
+        poolSize = transportConfig.get('pool-size', 0)
+        if not poolSize:
+            # One connection for each worker of the renewal pipeline fetching secrets, one for each commit in flight,
+            # plus one for the listing of the resources
+            pipelineConfig = configManager.parameters().get('pipeline', {})
+            poolSize = pipelineConfig.get('secret-workers', 4) + pipelineConfig.get('commit-window', 8) + 1
+        self.logger.debug('Using a pool of [{}] connections to Passbolt'.format(poolSize))
+
+        self.adapter = RetryingHTTPAdapter(
+            poolSize=poolSize,
+            timeout=(transportConfig.get('connect-timeout', 10), transportConfig.get('read-timeout', 60)),
+            maxRetries=transportConfig.get('max-retries', 4),
+            backoffFactor=transportConfig.get('backoff-factor', 0.5),
+            maxBackoff=transportConfig.get('max-backoff', 30),
+            maxRetryAfter=transportConfig.get('max-retry-after', 120)
+        )
+
+    """
+    Grow the connection pool so that it can hold at least the given number of connections, for commands sending
+    more concurrent requests than the renewal pipeline.
+    """
+    def ensurePoolSize(self, poolSize):
+        if poolSize > self.adapter._pool_maxsize:
+            self.logger.debug('Growing the pool of connections to Passbolt to [{}]'.format(poolSize))
+            self.adapter.init_poolmanager(self.adapter._pool_connections, poolSize, block=self.adapter._pool_block)
+
+    """
+    Send the requests of the given session through the transport.
+    """
+    def mount(self, session):
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
@@ -7,9 +7,10 @@ from datetime import datetime
 from distutils.util import strtobool
 
 from gpgauth import GPGAuthSessionWrapper
+from manifest import IDENTITY_COLUMNS
 
 
-def init_logger(logLevel):
+def init_logger(logLevel, stream=sys.stdout):
     rootLogger = logging.getLogger()
     logging.captureWarnings(True)
 
@@ -18,7 +19,7 @@ def init_logger(logLevel):
     else:
         rootLogger.setLevel(logging.INFO)
 
-    handler = logging.StreamHandler(sys.stdout)
+    handler = logging.StreamHandler(stream)
     handler.setLevel(logging.DEBUG)
 
     formatter = logging.Formatter('[%(levelname)s] %(message)s')
@@ -67,6 +68,9 @@ def parse_args():
     renewScope.add_argument('-g', '--group',
                             nargs=1,
                             help='group in which the resources should be included')
+    renewScope.add_argument('--resume',
+                            action='store_true',
+                            help='finish the last renewal if it has been interrupted')
     renewParser.add_argument('-b', '--before',
                              type=valid_date,
                              help='date before which the resources should have been updated')
@@ -77,6 +81,10 @@ def parse_args():
                              type=int,
                              default=0,
                              help='only update the n first resources found')
+    renewParser.add_argument('-w', '--workers',
+                             type=int,
+                             default=1,
+                             help='number of resources to update concurrently on their services')
     renewParser.add_argument('-mr', '--mail-report',
                              dest='mailReportRecipient',
                              metavar='RECIPIENT',
@@ -86,6 +94,63 @@ def parse_args():
                              action='store_true',
                              help='run through the renewal process without actually updating resources')
 
+    # Stale utils
+    staleParser = subParsers.add_parser(
+        'stale',
+        help='list the resources that have not been renewed for a while, from the local metadata store'
+    )
+    staleAge = staleParser.add_mutually_exclusive_group()
+    staleAge.add_argument('-o', '--older-than',
+                          dest='olderThan',
+                          metavar='DAYS',
+                          type=int,
+                          help='only list the resources not renewed for this number of days')
+    staleAge.add_argument('-b', '--before',
+                          type=valid_date,
+                          help='only list the resources not renewed since this date')
+    staleParser.add_argument('-c', '--connector',
+                             metavar='ALIAS',
+                             help='only list the resources using the connector with this alias')
+    staleParser.add_argument('-l', '--limit',
+                             type=int,
+                             default=0,
+                             help='only list the n oldest resources')
+    staleParser.add_argument('--ids',
+                             action='store_true',
+                             help='only print a comma-separated list of resource IDs, to be given to renew -r')
+    staleParser.add_argument('--rebuild',
+                             action='store_true',
+                             help='rebuild the store from the resources of the server first')
+
+    # Daemon utils
+    daemonParser = subParsers.add_parser(
+        'daemon',
+        help='keep running and renew resources according to the rotation policy of their connector'
+    )
+    daemonControl = daemonParser.add_mutually_exclusive_group()
+    daemonControl.add_argument('--status',
+                               action='store_true',
+                               help='show the status of the running daemon')
+    daemonControl.add_argument('--renew',
+                               dest='renewResources',
+                               metavar='RESOURCES',
+                               type=valid_id_list,
+                               help='ask the running daemon to renew a comma-separated list of resources now')
+    daemonControl.add_argument('--stop',
+                               action='store_true',
+                               help='stop the running daemon')
+    daemonParser.add_argument('-g', '--group',
+                              nargs=1,
+                              help='only renew resources included in this group')
+    daemonParser.add_argument('-w', '--workers',
+                              type=int,
+                              default=1,
+                              help='number of resources to update concurrently on their services')
+    daemonParser.add_argument('--dry-run',
+                              dest='dryRun',
+                              action='store_true',
+                              help='run through the renewal process without actually updating resources')
+
     importParser = subParsers.add_parser(
         'import',
         help='import a CSV file on the Passbolt Server'
@@ -102,7 +167,15 @@ def parse_args():
         '--skip-if-exists',
         dest='skipIfExists',
         action='store_true',
-        help='skip if a password with the same name accessible by the user already exists on the server'
+        help='skip if a password with the same identity accessible by the user already exists on the server, or is '
+             'present earlier in the file'
+    )
+
+    importParser.add_argument(
+        '--identity',
+        choices=sorted(IDENTITY_COLUMNS),
+        default='name',
+        help='the columns identifying a password, for --skip-if-exists and for the lines imported by a previous run'
     )
 
     importParser.add_argument(
@@ -121,6 +194,20 @@ def parse_args():
         help='a comma-separated list of the user IDs to add as member when creating the groups'
     )
 
+    importParser.add_argument(
+        '--plan',
+        action='store_true',
+        help='only show the lines to import, the groups to create and the expected API calls and encryptions, without '
+             'writing anything'
+    )
+
+    importParser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=1,
+        help='number of lines to create and share concurrently on the server'
+    )
+
     importParser.add_argument(
         'file',
         help='a path to the CSV file that needs to be imported'
@@ -129,7 +216,12 @@ def parse_args():
     return rootParser.parse_args()
 
 def valid_id_list(string):
-    return string.split(',')
+    # Empty IDs come from stray commas, or from an empty list given by another command
+    ids = [x.strip() for x in string.split(',') if x.strip()]
+    if not ids:
+        msg = "No resource ID given: [{}].".format(string)
+        raise argparse.ArgumentTypeError(msg)
+    return ids
 
 def valid_date(string):
     try:
@@ -148,23 +240,10 @@ def ask_question(question, defaultReturn):
 
 
 def test_configuration(logger, configuration, keyring):
-    serverURI = configuration.server()['uri']
-    serverFingerprint = configuration.server()['fingerprint']
-    serverVerifyCert = configuration.server()['verifyCert']
-    userFingerprint = configuration.user()['fingerprint']
-    logger.info('Testing the authentication to the server [{}]'.format(serverURI))
-
-    session = GPGAuthSessionWrapper(
-        gpg=keyring,
-        server_url=serverURI,
-        user_fingerprint=userFingerprint,
-        verify=serverVerifyCert
-    )
-
-    assert session.server_fingerprint == serverFingerprint
-    session.authenticate()
+    logger.info('Testing the authentication to the server [{}]'.format(configuration.server()['uri']))
 
-    if session.is_authenticated_with_token:
+    session = GPGAuthSessionWrapper.forConfiguration(configuration, keyring)
+    if session.resumeOrAuthenticate(configuration.server()['fingerprint']):
         logger.info('Success!')
     else:
         logger.info('Failed to authenticate to the server.')